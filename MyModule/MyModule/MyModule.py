@@ -4,13 +4,15 @@ import vtk, qt, ctk, slicer
 from slicer.ScriptedLoadableModule import *
 import logging
 import numpy as np
+from vtk.util import numpy_support
+from MyModuleLib import Backends
+from MyModuleLib.Tasks import BackgroundTask
 
-# Check if SlicerRT extension is correctly installed
-try:
-	segmentComparisonModule = slicer.modules.segmentcomparison
-except:
-	print('ERROR: SlicerRT extension is required to use this module.')
-	logging.error('ERROR: SlicerRT extension is required to use this module.')
+# The comparison, alignment and distance computations are in MyModuleLib, which does not need Qt or
+# the Slicer application (see MyModuleLib/Core.py). Its modules are imported by the methods that use
+# them, so that loading this module at Slicer startup does not import VTK filters, SciPy or SQLite.
+# SlicerRT is looked up when it is first needed (see MyModuleLib/Backends.py).
+SLICER_RT_REQUIRED = 'SlicerRT extension is required by the SegmentComparison engines.'
 
 #
 # MyModule
@@ -36,15 +38,17 @@ class MyModule(ScriptedLoadableModule):
 class MyModuleWidget(ScriptedLoadableModuleWidget):
 
 	def setup(self):
+		from MyModuleLib import DisagreementRegions, DistanceEngines, LevelOfDetail, SurfaceHausdorff
+
 		ScriptedLoadableModuleWidget.setup(self)
 
 		self.logic = MyModuleLogic()
 
-		# ------ 1. CREATE LAYOUT AND BUTTONS ------
+		# Check if SlicerRT extension is correctly installed
+		if Backends.segmentComparisonModule() is None:
+			logging.error(SLICER_RT_REQUIRED)
 
-		# Layout setup: 3D Only
-		self.layoutManager = slicer.app.layoutManager()
-		self.layoutManager.setLayout(slicer.vtkMRMLLayoutNode.SlicerLayoutOneUp3DView)
+		# ------ 1. CREATE BUTTONS (the 3D only layout is set when the module is entered) ------
 
 		#
 		# LOAD DATA
@@ -76,6 +80,50 @@ class MyModuleWidget(ScriptedLoadableModuleWidget):
 		self.loadSegmentsButton.enabled = True  # if True it can be clicked
 		formLayout_load.addRow(self.loadSegmentsButton)  # include button in layout
 
+		# Button to remove the segments and every table and model of the current case
+		self.clearCaseButton = qt.QPushButton("CLEAR CASE")
+		self.clearCaseButton.toolTip = "Remove the segments, tables and color map of the current case from the scene"
+		self.clearCaseButton.enabled = True
+		formLayout_load.addRow(self.clearCaseButton)
+
+		#
+		# REVIEW
+		#
+
+		# Create layout
+		collapsibleButtonReview = ctk.ctkCollapsibleButton()
+		collapsibleButtonReview.text = "REVIEW"
+		self.layout.addWidget(collapsibleButtonReview)
+		formLayout_review = qt.QFormLayout(collapsibleButtonReview)
+
+		# Case list (CSV file with the columns segment1, segment2 and optionally case, as in batch mode)
+		self.reviewCaseList_pathSelector = ctk.ctkPathLineEdit()
+		self.reviewCaseList_pathSelector.nameFilters = ['Case lists (*.csv)']
+		self.reviewCaseList_pathSelector.setMaximumWidth(400)
+		formLayout_review.addRow("Case list: ", self.reviewCaseList_pathSelector)
+
+		# Button to start the review (the alignment mode of the ALIGNMENT section is used for every case)
+		self.startReviewButton = qt.QPushButton("START REVIEW")
+		self.startReviewButton.toolTip = "Show the first case of the list; the next case is loaded, aligned and compared in the background"
+		self.startReviewButton.enabled = True
+		formLayout_review.addRow(self.startReviewButton)
+
+		# Navigation buttons
+		review_H_Layout = qt.QHBoxLayout()
+		formLayout_review.addRow(review_H_Layout)
+		self.previousCaseButton = qt.QPushButton("PREVIOUS")
+		self.previousCaseButton.toolTip = "Show the previous case of the list"
+		self.previousCaseButton.enabled = False
+		review_H_Layout.addWidget(self.previousCaseButton)
+		self.nextCaseButton = qt.QPushButton("NEXT")
+		self.nextCaseButton.toolTip = "Show the next case of the list (it is ready once its preparation is done)"
+		self.nextCaseButton.enabled = False
+		review_H_Layout.addWidget(self.nextCaseButton)
+
+		# Current case and preparation of the next one
+		self.reviewStatus_label = qt.QLabel("")
+		formLayout_review.addRow(self.reviewStatus_label)
+
 		#
 		# ALIGNMENT
 		#
@@ -86,12 +134,33 @@ class MyModuleWidget(ScriptedLoadableModuleWidget):
 		self.layout.addWidget(collapsibleButtonAlignment)
 		formLayout_alignment = qt.QFormLayout(collapsibleButtonAlignment)
 
+		# Alignment mode selector
+		self.alignmentMode_comboBox = qt.QComboBox()
+		self.alignmentMode_comboBox.addItems(['fixed', 'automatic', 'file'])
+		self.alignmentMode_comboBox.toolTip = "fixed: rotation of 180 degrees around Z; automatic: PCA initialization and ICP; file: Data/transform.h5"
+		formLayout_alignment.addRow("Mode: ", self.alignmentMode_comboBox)
+
 		# Button for masks alignment
 		self.alignSegmentsButton = qt.QPushButton("ALIGN MODELS")  # text in button
 		self.alignSegmentsButton.toolTip = "Align segments"  # hint text for button (appears when cursor is above the button for more than one second)
 		self.alignSegmentsButton.enabled = True
 		formLayout_alignment.addRow(self.alignSegmentsButton)
 
+		# Result of the automatic alignment
+		self.alignmentResult_label = qt.QLabel("")
+		formLayout_alignment.addRow(self.alignmentResult_label)
+
+		# Alignments of the case (one per mode), the selected one is used by the metrics
+		self.alignmentCandidate_comboBox = qt.QComboBox()
+		self.alignmentCandidate_comboBox.toolTip = "Alignment of segment 2 used by the metrics (segments are not modified)"
+		formLayout_alignment.addRow("Alignment: ", self.alignmentCandidate_comboBox)
+
+		# Button to compare all alignments
+		self.compareAlignmentsButton = qt.QPushButton("COMPARE ALIGNMENTS")
+		self.compareAlignmentsButton.toolTip = "Dice and distances of segment 2 with each alignment of the case"
+		self.compareAlignmentsButton.enabled = True
+		formLayout_alignment.addRow(self.compareAlignmentsButton)
+
 		#       COMPARISON BETWEEN MASKS         #
 		# SORENSEN-DICE COEFFICIENT & HOUSDORFF DISTANCE BUTTONS
 		#
@@ -102,18 +171,105 @@ class MyModuleWidget(ScriptedLoadableModuleWidget):
 		self.layout.addWidget(collapsibleButtonComparison)
 		formLayout_comparison = qt.QFormLayout(collapsibleButtonComparison)
 
+		# Dice engine: SegmentComparison labelmaps, or bit-packed masks (see MyModuleLib/PackedMasks.py)
+		self.diceEngine_comboBox = qt.QComboBox()
+		self.diceEngine_comboBox.addItems(['segmentComparison', 'packedMask'])
+		self.diceEngine_comboBox.toolTip = "Labelmaps used by the Dice coefficient: SegmentComparison, or bit-packed masks cached on disk"
+		formLayout_comparison.addRow("Dice engine: ", self.diceEngine_comboBox)
+
+		# Packed masks: memory budget and target accuracy of the automatic voxel size
+		self.maskMemoryBudget_spinBox = qt.QSpinBox()
+		self.maskMemoryBudget_spinBox.setRange(64, 65536)  # the rasterization alone takes 48 MB (PackedMasks.RASTERIZATION_BYTES)
+		self.maskMemoryBudget_spinBox.setValue(512)
+		self.maskMemoryBudget_spinBox.suffix = ' MB'
+		self.maskMemoryBudget_spinBox.toolTip = "Maximum memory of both packed masks"
+		self.maskTargetError_spinBox = qt.QDoubleSpinBox()
+		self.maskTargetError_spinBox.setDecimals(4)
+		self.maskTargetError_spinBox.setRange(0.0001, 0.1)
+		self.maskTargetError_spinBox.setSingleStep(0.0005)
+		self.maskTargetError_spinBox.setValue(0.001)
+		self.maskTargetError_spinBox.toolTip = "Voxels are refined until the Dice coefficient changes by less than this value"
+		maskAccuracyLayout = qt.QHBoxLayout()
+		maskAccuracyLayout.addWidget(self.maskMemoryBudget_spinBox)
+		maskAccuracyLayout.addWidget(qt.QLabel("Target Dice error: "))
+		maskAccuracyLayout.addWidget(self.maskTargetError_spinBox)
+		formLayout_comparison.addRow("Mask memory: ", maskAccuracyLayout)
+
 		# Button to obtain the Sorensen-Dice Coefficient
 		self.diceCoeffButton = qt.QPushButton("SORENSEN-DICE COEFFICIENT")  # text in button
 		self.diceCoeffButton.toolTip = "Sorensen-Dice Coefficient"  # hint text for button (appears when the cursor is above the button for more than one second)
 		self.diceCoeffButton.enabled = True  # if true it can be clicked
 		formLayout_comparison.addRow(self.diceCoeffButton)  # include button in layout
 
+		# Hausdorff engine: SegmentComparison, distances of the surface vertices (see MyModuleLib/SurfaceHausdorff.py)
+		# or distance transforms of the masks (see MyModuleLib/DistanceTransforms.py)
+		self.hausdorffMode_comboBox = qt.QComboBox()
+		self.hausdorffMode_comboBox.addItems(SurfaceHausdorff.HAUSDORFF_MODES)
+		self.hausdorffMode_comboBox.toolTip = "exact: maximum distance with early break; sampled: 95th percentile and mean with confidence bounds; screening: sampled, exact if above the threshold; distanceTransform: boundary voxels of both masks"
+		formLayout_comparison.addRow("Hausdorff engine: ", self.hausdorffMode_comboBox)
+
 		#Button to obtain the Hausdorff Distance
 		self.hausDistButton = qt.QPushButton("HAUSDORFF DISTANCE") # text in button
 		self.hausDistButton.toolTip = qt.QPushButton("Hausdorff Distance") # hint text for button (appears when the cursor is above the button for more than a second)
 		self.hausDistButton.enabled = True # if true it can be clicked
 		formLayout_comparison.addRow(self.hausDistButton) # include button in layout
 
+		# Button to obtain all metrics (Dice, Jaccard, volumes and Hausdorff) in one pass
+		self.allMetricsButton = qt.QPushButton("ALL METRICS")  # text in button
+		self.allMetricsButton.toolTip = "Dice, Jaccard, volumes and Hausdorff distances computed together"
+		self.allMetricsButton.enabled = True
+		formLayout_comparison.addRow(self.allMetricsButton)
+
+		# Software that created segment 2, stored with the results
+		self.software_lineEdit = qt.QLineEdit()
+		self.software_lineEdit.toolTip = "Name of the software that created segment 2 (stored with the results)"
+		formLayout_comparison.addRow("Software: ", self.software_lineEdit)
+
+		# Button to export the stored results
+		self.exportResultsButton = qt.QPushButton("EXPORT RESULTS")
+		self.exportResultsButton.toolTip = "Write all stored results to a CSV file"
+		self.exportResultsButton.enabled = True
+		formLayout_comparison.addRow(self.exportResultsButton)
+
+		#
+		# Segment matrix: all segments of several segmentation nodes against each other
+		#
+
+		# Create collapsible button inside layout
+		segmentMatrix_GroupBox = ctk.ctkCollapsibleGroupBox()
+		segmentMatrix_GroupBox.setTitle("SEGMENT MATRIX")
+		segmentMatrix_GroupBox.collapsed = True
+		formLayout_comparison.addRow(segmentMatrix_GroupBox)
+		segmentMatrix_GroupBox_Layout = qt.QFormLayout(segmentMatrix_GroupBox)
+
+		# Segmentations giving the rows of the matrices
+		self.matrixReference_nodeComboBox = slicer.qMRMLCheckableNodeComboBox()
+		self.matrixReference_nodeComboBox.nodeTypes = ['vtkMRMLSegmentationNode']
+		self.matrixReference_nodeComboBox.setMRMLScene(slicer.mrmlScene)
+		self.matrixReference_nodeComboBox.toolTip = "All segments of the checked segmentations are the rows of the matrices"
+		segmentMatrix_GroupBox_Layout.addRow("Rows: ", self.matrixReference_nodeComboBox)
+
+		# Segmentations giving the columns of the matrices
+		self.matrixCompare_nodeComboBox = slicer.qMRMLCheckableNodeComboBox()
+		self.matrixCompare_nodeComboBox.nodeTypes = ['vtkMRMLSegmentationNode']
+		self.matrixCompare_nodeComboBox.setMRMLScene(slicer.mrmlScene)
+		self.matrixCompare_nodeComboBox.toolTip = "All segments of the checked segmentations are the columns of the matrices"
+		segmentMatrix_GroupBox_Layout.addRow("Columns: ", self.matrixCompare_nodeComboBox)
+
+		# Voxel size of the masks used by the Dice coefficient
+		self.matrixVoxelSize_spinBox = qt.QDoubleSpinBox()
+		self.matrixVoxelSize_spinBox.setRange(0.1, 10.0)
+		self.matrixVoxelSize_spinBox.setSingleStep(0.1)
+		self.matrixVoxelSize_spinBox.value = 1.0
+		self.matrixVoxelSize_spinBox.suffix = ' mm'
+		segmentMatrix_GroupBox_Layout.addRow("Voxel size: ", self.matrixVoxelSize_spinBox)
+
+		# Button to compute the Dice and Hausdorff matrices
+		self.comparisonMatrixButton = qt.QPushButton("COMPARISON MATRIX")
+		self.comparisonMatrixButton.toolTip = "Dice and Hausdorff distances between every row segment and every column segment"
+		self.comparisonMatrixButton.enabled = True
+		segmentMatrix_GroupBox_Layout.addRow(self.comparisonMatrixButton)
+
 		#
 		# VISUALIZATION
 		#
@@ -195,6 +351,40 @@ class MyModuleWidget(ScriptedLoadableModuleWidget):
 		self.showColorMapButton.enabled = True
 		formLayout_colorMap.addRow(self.showColorMapButton)
 
+		# Distance engine selector
+		self.distanceEngine_comboBox = qt.QComboBox()
+		self.distanceEngine_comboBox.addItems(DistanceEngines.DISTANCE_ENGINES)
+		self.distanceEngine_comboBox.toolTip = "Algorithm used to compute the distance between surfaces"
+		formLayout_colorMap.addRow("Distance engine: ", self.distanceEngine_comboBox)
+
+		# Number of cores used to compute distances
+		self.distanceWorkers_spinBox = qt.QSpinBox()
+		self.distanceWorkers_spinBox.setMinimum(1)
+		self.distanceWorkers_spinBox.setMaximum(os.cpu_count() or 1)
+		self.distanceWorkers_spinBox.value = 1
+		self.distanceWorkers_spinBox.toolTip = "Number of cores used to compute distances (the locator engine only uses several for very large meshes)"
+		formLayout_colorMap.addRow("Distance workers: ", self.distanceWorkers_spinBox)
+		self.logic.distanceWorkers = self.distanceWorkers_spinBox.value
+
+		# Level of detail: decimated display mesh for large surfaces
+		colorMapLevelOfDetail_H_Layout = qt.QHBoxLayout()
+		formLayout_colorMap.addRow("Level of detail: ", colorMapLevelOfDetail_H_Layout)
+		self.colorMapLevelOfDetail_checkBox = qt.QCheckBox('Decimate')
+		self.colorMapLevelOfDetail_checkBox.checked = False
+		self.colorMapLevelOfDetail_checkBox.toolTip = "Display a decimated mesh with interpolated distances (statistics use all points)"
+		colorMapLevelOfDetail_H_Layout.addWidget(self.colorMapLevelOfDetail_checkBox)
+		self.colorMapTriangleBudget_spinBox = qt.QSpinBox()
+		self.colorMapTriangleBudget_spinBox.setRange(1000, 10000000)
+		self.colorMapTriangleBudget_spinBox.setSingleStep(50000)
+		self.colorMapTriangleBudget_spinBox.value = LevelOfDetail.DEFAULT_TRIANGLE_BUDGET
+		self.colorMapTriangleBudget_spinBox.suffix = ' triangles'
+		self.colorMapTriangleBudget_spinBox.toolTip = "Maximum number of triangles of the displayed mesh"
+		colorMapLevelOfDetail_H_Layout.addWidget(self.colorMapTriangleBudget_spinBox)
+		self.colorMapProgressive_checkBox = qt.QCheckBox('Progressive')
+		self.colorMapProgressive_checkBox.checked = False
+		self.colorMapProgressive_checkBox.toolTip = "Show a coarse color map first, then replace it by the full mesh"
+		colorMapLevelOfDetail_H_Layout.addWidget(self.colorMapProgressive_checkBox)
+
 		# Displayed Range group box
 		self.displayedRange_GroupBox = ctk.ctkCollapsibleGroupBox()
 		self.displayedRange_GroupBox.setTitle("Displayed Range")
@@ -237,6 +427,71 @@ class MyModuleWidget(ScriptedLoadableModuleWidget):
 		self.ScalarBar_visibility_checkBox.checked = True
 		displayedRange_GroupBox_Layout.addRow(self.ScalarBar_visibility_checkBox)  
 
+		# Disagreement regions: connected areas of the color map at the threshold or more (see MyModuleLib/DisagreementRegions.py)
+		self.disagreementRegions_GroupBox = ctk.ctkCollapsibleGroupBox()
+		self.disagreementRegions_GroupBox.setTitle("Disagreement Regions")
+		self.disagreementRegions_GroupBox.collapsed = False
+		self.disagreementRegions_GroupBox.enabled = False
+		formLayout_colorMap.addRow(self.disagreementRegions_GroupBox)
+		disagreementRegions_GroupBox_Layout = qt.QFormLayout(self.disagreementRegions_GroupBox)
+		self.regionThreshold_spinBox = qt.QDoubleSpinBox()
+		self.regionThreshold_spinBox.setRange(0.1, 100.0)
+		self.regionThreshold_spinBox.setSingleStep(0.5)
+		self.regionThreshold_spinBox.value = DisagreementRegions.DEFAULT_THRESHOLD_MM
+		self.regionThreshold_spinBox.suffix = ' mm'
+		self.regionThreshold_spinBox.toolTip = "Vertices of segment 1 at this distance or more from segment 2"
+		disagreementRegions_GroupBox_Layout.addRow("Threshold: ", self.regionThreshold_spinBox)
+		self.regionOrder_comboBox = qt.QComboBox()
+		self.regionOrder_comboBox.addItems(DisagreementRegions.REGION_ORDERS)
+		self.regionOrder_comboBox.toolTip = "Regions are sorted by decreasing area, maximum or mean distance"
+		disagreementRegions_GroupBox_Layout.addRow("Sort by: ", self.regionOrder_comboBox)
+		self.findRegionsButton = qt.QPushButton("FIND REGIONS")
+		self.findRegionsButton.toolTip = "Connected regions of the color map above the threshold, with their area, distances and centroid"
+		disagreementRegions_GroupBox_Layout.addRow(self.findRegionsButton)
+		self.region_comboBox = qt.QComboBox()
+		self.region_comboBox.toolTip = "Center the 3D view on the maximum distance of the region"
+		disagreementRegions_GroupBox_Layout.addRow("Go to region: ", self.region_comboBox)
+
+		#
+		# PROGRESS: computations run in the background and can be cancelled
+		#
+		collapsibleButtonProgress = ctk.ctkCollapsibleButton()
+		collapsibleButtonProgress.text = "PROGRESS"
+		self.layout.addWidget(collapsibleButtonProgress)
+		formLayout_progress = qt.QFormLayout(collapsibleButtonProgress)
+
+		self.taskStatus_label = qt.QLabel("Idle")
+		formLayout_progress.addRow(self.taskStatus_label)
+
+		progress_H_Layout = qt.QHBoxLayout()
+		formLayout_progress.addRow(progress_H_Layout)
+		self.task_progressBar = qt.QProgressBar()
+		self.task_progressBar.setRange(0, 100)
+		self.task_progressBar.value = 0
+		progress_H_Layout.addWidget(self.task_progressBar)
+		self.cancelTaskButton = qt.QPushButton("CANCEL")
+		self.cancelTaskButton.toolTip = "Stop the running computation at its next step"
+		self.cancelTaskButton.enabled = False
+		progress_H_Layout.addWidget(self.cancelTaskButton)
+
+		# Running task, polled by a timer so that the GUI keeps responding
+		self.task = None
+		self.taskFinishedCallback = None
+		self.taskButtons = [self.loadSegmentsButton, self.clearCaseButton, self.startReviewButton, self.previousCaseButton, self.nextCaseButton,
+			self.alignSegmentsButton, self.compareAlignmentsButton, self.diceCoeffButton,
+			self.hausDistButton, self.allMetricsButton, self.comparisonMatrixButton, self.showColorMapButton, self.findRegionsButton]
+		self.taskButtonsEnabled = []
+		self.taskTimer = qt.QTimer()
+		self.taskTimer.setInterval(100)
+
+		# Review queue, polled by a timer: prepared cases are collected and shown in the main thread
+		self.reviewTimer = qt.QTimer()
+		self.reviewTimer.setInterval(100)
+
+		# Slider updates are applied by a single-shot timer, at most once per frame
+		self.displayTimer = qt.QTimer()
+		self.displayTimer.setSingleShot(True)
+
 		# Add vertical spacing
 		self.layout.addStretch(1)
 
@@ -244,32 +499,147 @@ class MyModuleWidget(ScriptedLoadableModuleWidget):
 
 		# Connect each button with a function
 		self.loadSegmentsButton.connect('clicked(bool)',self.onloadSegmentsButton)  # when the button is pressed we call the function onLoadSegment1Button
+		self.clearCaseButton.connect('clicked(bool)', self.onClearCaseButton)
+		self.startReviewButton.connect('clicked(bool)', self.onStartReviewButton)
+		self.previousCaseButton.connect('clicked(bool)', self.onPreviousCaseButton)
+		self.nextCaseButton.connect('clicked(bool)', self.onNextCaseButton)
 		self.segment1_checkBox.connect('stateChanged(int)', self.onupdateSegment1Visibility)
 		self.segment2_checkBox.connect('stateChanged(int)', self.onupdateSegment2Visibility)
 		self.opacityValueSliderWidget_1.connect("valueChanged(double)", self.onupdateSegment1Opacity)
 		self.opacityValueSliderWidget_2.connect("valueChanged(double)", self.onupdateSegment2Opacity)
 		self.alignSegmentsButton.connect('clicked(bool)', self.onAlignSegmentsButton)
+		self.alignmentCandidate_comboBox.connect('activated(int)', self.onAlignmentCandidateSelected)
+		self.compareAlignmentsButton.connect('clicked(bool)', self.onCompareAlignmentsButton)
 		self.diceCoeffButton.connect('clicked(bool)', self.onDiceCoeffButton)
 		self.hausDistButton.connect('clicked(bool)', self.onHausdorffDistButton)
+		self.allMetricsButton.connect('clicked(bool)', self.onAllMetricsButton)
+		self.diceEngine_comboBox.connect('currentIndexChanged(int)', self.onDiceEngineChanged)
+		self.maskMemoryBudget_spinBox.connect('valueChanged(int)', self.onMaskAccuracyChanged)
+		self.maskTargetError_spinBox.connect('valueChanged(double)', self.onMaskAccuracyChanged)
+		self.hausdorffMode_comboBox.connect('currentIndexChanged(int)', self.onHausdorffModeChanged)
+		self.comparisonMatrixButton.connect('clicked(bool)', self.onComparisonMatrixButton)
 		self.showColorMapButton.connect('clicked(bool)', self.onShowColorMapButton)
+		self.software_lineEdit.connect('textChanged(QString)', self.onSoftwareChanged)
+		self.exportResultsButton.connect('clicked(bool)', self.onExportResultsButton)
+		self.distanceEngine_comboBox.connect('currentIndexChanged(int)', self.onDistanceEngineChanged)
+		self.distanceWorkers_spinBox.connect('valueChanged(int)', self.onDistanceWorkersChanged)
 		self.displayedRange_SliderWidget.connect("valuesChanged(double,double)", self.onDisplayedRangeSliderChanged)
 		self.minDisplayedRange_SpinBox.connect("valueChanged(double)", self.onDisplayedRangeSpinBoxChanged)
 		self.maxDisplayedRange_SpinBox.connect("valueChanged(double)", self.onDisplayedRangeSpinBoxChanged)
 		self.ScalarBar_visibility_checkBox.connect('stateChanged(int)', self.onScalarBarVisibilityChecked)		
+		self.findRegionsButton.connect('clicked(bool)', self.onFindRegionsButton)
+		self.region_comboBox.connect('activated(int)', self.onRegionSelected)
+		self.cancelTaskButton.connect('clicked(bool)', self.onCancelTaskButton)
+		self.taskTimer.connect('timeout()', self.onTaskTimer)
+		self.reviewTimer.connect('timeout()', self.onReviewTimer)
+		self.displayTimer.connect('timeout()', self.onDisplayTimer)
+
+	def enter(self):
+		# Layout setup: 3D Only
+		layoutManager = slicer.app.layoutManager()
+		if layoutManager is not None:
+			layoutManager.setLayout(slicer.vtkMRMLLayoutNode.SlicerLayoutOneUp3DView)
+
+	def cleanup(self):
+		# Stop the running computation when the module is closed
+		self.taskTimer.stop()
+		self.displayTimer.stop()
+		self.reviewTimer.stop()
+		if self.task is not None:
+			self.task.cancel()
+		self.logic.stopReview()
 
 
 	# ------ 3. DEFINITION OF FUNCTIONS CALLED WHEN PRESSING THE BUTTONS ------
 	def onloadSegmentsButton(self):
+		# A pair loaded by hand ends the review
+		self.stopReview()
 		# Get inputs
 		self.logic.segment1_path = self.segment1_pathSelector.currentPath
 		self.logic.segment2_path = self.segment2_pathSelector.currentPath
-		# Load segments as segments
-		success = self.logic.loadSegments()
+		# Load segments as segments (the selectors stay enabled: loading another pair releases this case)
+		self.logic.loadSegments()
 		# Update GUI
-		if success: # if segments are loaded correctly, then button and selectors are disabled
-			self.segment1_pathSelector.enabled = False
-			self.segment2_pathSelector.enabled = False
-			self.loadSegmentsButton.enabled = False
+		self.alignmentResult_label.text = ''
+		self.updateAlignmentCandidates()
+		self.displayedRange_GroupBox.enabled = False
+		self.disagreementRegions_GroupBox.enabled = False
+		self.region_comboBox.clear()
+
+	def onClearCaseButton(self):
+		self.stopReview()
+		self.logic.clearCase()
+		# Update GUI: a new pair of segments can be loaded
+		self.segment1_pathSelector.enabled = True
+		self.segment2_pathSelector.enabled = True
+		self.loadSegmentsButton.enabled = True
+		self.alignSegmentsButton.enabled = True
+		self.alignmentResult_label.text = ''
+		self.updateAlignmentCandidates()
+		self.displayedRange_GroupBox.enabled = False
+		self.disagreementRegions_GroupBox.enabled = False
+		self.region_comboBox.clear()
+
+	def onStartReviewButton(self):
+		self.logic.alignmentMode = self.alignmentMode_comboBox.currentText
+		try:
+			self.logic.startReview(self.reviewCaseList_pathSelector.currentPath)
+		except Exception as e:
+			slicer.util.errorDisplay('Review could not be started: ' + str(e))
+			return
+		self.reviewTimer.start()
+		self.onReviewTimer()
+
+	def onPreviousCaseButton(self):
+		self.logic.reviewQueue.previous()
+		self.onReviewTimer()
+
+	def onNextCaseButton(self):
+		self.logic.reviewQueue.next()
+		self.onReviewTimer()
+
+	def stopReview(self):
+		self.reviewTimer.stop()
+		self.logic.stopReview()
+		self.previousCaseButton.enabled = False
+		self.nextCaseButton.enabled = False
+		self.reviewStatus_label.text = ''
+
+	def onReviewTimer(self):
+
+		# The case on screen is not replaced while a task computes on it
+		queue = self.logic.reviewQueue
+		if queue is None or self.task is not None:
+			return
+		if self.logic.updateReview():
+			self.onReviewCaseShown(queue.currentCase())
+		self.previousCaseButton.enabled = queue.hasPrevious()
+		self.nextCaseButton.enabled = queue.hasNext()
+
+		# Current case, then the preparation running in the background
+		text = 'Case %d/%d: %s' % (queue.index + 1, len(queue), queue.case()['case'])
+		status = queue.status()
+		if status is not None:
+			progress, message, current = status
+			text += '\n%s %s (%d%%)' % ('Loading:' if current else 'Next:', message, int(round(100 * progress)))
+		elif queue.hasNext():
+			text += '\nNext case ready'
+		self.reviewStatus_label.text = text
+
+	def onReviewCaseShown(self, prepared):
+		# Update GUI with the case shown by the logic
+		self.segment1_pathSelector.currentPath = prepared['case']['segment1']
+		self.segment2_pathSelector.currentPath = prepared['case']['segment2']
+		self.alignmentResult_label.text = ''
+		if prepared['error'] is not None:
+			self.alignmentResult_label.text = 'Case failed: ' + str(prepared['error'])
+		elif prepared['registrationResult'] is not None:
+			self.alignmentResult_label.text = 'RMS residual: %.3f mm (%d iterations)' % (prepared['registrationResult']['rmsResidual'],
+				prepared['registrationResult']['iterations'])
+		self.updateAlignmentCandidates()
+		self.displayedRange_GroupBox.enabled = prepared['error'] is None
+		self.disagreementRegions_GroupBox.enabled = prepared['error'] is None
+		self.region_comboBox.clear()
 
 	def onupdateSegment1Visibility(self, checked):
 		self.logic.updateSegment1Visibility(checked)
@@ -278,45 +648,197 @@ class MyModuleWidget(ScriptedLoadableModuleWidget):
 		self.logic.updateSegment2Visibility(checked)
 
 	def onupdateSegment1Opacity(self, opacityValue):
-		self.logic.updateSegment1Opacity(opacityValue)
+		self.logic.requestSegmentOpacity(1, opacityValue)
+		self.scheduleDisplayUpdate()
 
 	def onupdateSegment2Opacity(self, opacityValue):
-		self.logic.updateSegment2Opacity(opacityValue)
+		self.logic.requestSegmentOpacity(2, opacityValue)
+		self.scheduleDisplayUpdate()
 
 	def onAlignSegmentsButton(self):
 		# Align segments
-		self.logic.alignSegments()
-		# Update GUI
-		self.alignSegmentsButton.enabled = False
+		self.logic.alignmentMode = self.alignmentMode_comboBox.currentText
+		self.startTask(self.logic.alignSegmentsTask(), self.onAlignSegmentsFinished)
+
+	def onAlignSegmentsFinished(self, result):
+		if self.logic.alignmentMode == 'automatic':
+			self.alignmentResult_label.text = 'RMS residual: %.3f mm (%d iterations)' % (self.logic.alignmentResult['rmsResidual'], self.logic.alignmentResult['iterations'])
+		# Update GUI (the button stays enabled: other modes can be tried on the same segments)
+		self.updateAlignmentCandidates()
+
+	def updateAlignmentCandidates(self):
+		self.alignmentCandidate_comboBox.clear()
+		self.alignmentCandidate_comboBox.addItems(self.logic.alignmentCandidates.names())
+		if self.logic.alignmentName is not None:
+			self.alignmentCandidate_comboBox.setCurrentText(self.logic.alignmentName)
+
+	def onAlignmentCandidateSelected(self, index):
+		self.logic.selectAlignment(self.alignmentCandidate_comboBox.currentText)
+
+	def onCompareAlignmentsButton(self):
+		if not len(self.logic.alignmentCandidates):
+			slicer.util.errorDisplay('Align the segments with at least one mode first')
+			return
+		self.startTask(self.logic.compareAlignmentsTask())
+
+	def onDiceEngineChanged(self, index):
+		self.logic.diceEngine = self.diceEngine_comboBox.currentText
+
+	def onMaskAccuracyChanged(self, value):
+		self.logic.maskMemoryBudgetMB = self.maskMemoryBudget_spinBox.value
+		self.logic.maskTargetDiceError = self.maskTargetError_spinBox.value
+
+	def onHausdorffModeChanged(self, index):
+		self.logic.hausdorffMode = self.hausdorffMode_comboBox.currentText
 
 	def onDiceCoeffButton(self):
-		self.logic.diceCoeff()
+		self.startTask(self.logic.diceCoeffTask())
 
 	def onHausdorffDistButton(self):
-		self.logic.hausdorffDist()
+		self.startTask(self.logic.hausdorffDistTask())
+
+	def onAllMetricsButton(self):
+		self.startTask(self.logic.allMetricsTask())
+
+	def onComparisonMatrixButton(self):
+		referenceNodes = self.matrixReference_nodeComboBox.checkedNodes()
+		compareNodes = self.matrixCompare_nodeComboBox.checkedNodes()
+		if not referenceNodes:
+			slicer.util.errorDisplay('Select at least one segmentation for the rows of the matrix')
+			return
+		self.logic.matrixVoxelSizeMm = self.matrixVoxelSize_spinBox.value
+		self.startTask(self.logic.comparisonMatrixTask(referenceNodes, compareNodes or None))
+
+	def onSoftwareChanged(self, text):
+		self.logic.software = text.strip()
+
+	def onExportResultsButton(self):
+		if self.logic.resultsStore is None:
+			slicer.util.errorDisplay('The results store is disabled')
+			return
+		path = qt.QFileDialog.getSaveFileName(None, 'Export results', 'results.csv', 'CSV files (*.csv)')
+		if not path:
+			return
+		numberOfResults = self.logic.exportResultsCSV(path)
+		self.taskStatus_label.text = '%d results written to %s' % (numberOfResults, path)
 
 	def onShowColorMapButton(self):
-		print('Computing color map...')
-		self.logic.showColorMap()
+		self.logic.colorMapLevelOfDetail = self.colorMapLevelOfDetail_checkBox.checked
+		self.logic.colorMapTriangleBudget = self.colorMapTriangleBudget_spinBox.value
+		self.logic.colorMapProgressive = self.colorMapProgressive_checkBox.checked
+		self.startTask(self.logic.showColorMapTask(), self.onShowColorMapFinished)
+
+	def onShowColorMapFinished(self, result):
 		# Update GUI
 		self.displayedRange_GroupBox.enabled = True 
+		self.disagreementRegions_GroupBox.enabled = True
+		self.region_comboBox.clear()
+
+	def onFindRegionsButton(self):
+		self.logic.regionThresholdMm = self.regionThreshold_spinBox.value
+		self.logic.regionOrder = self.regionOrder_comboBox.currentText
+		self.startTask(self.logic.disagreementRegionsTask(), self.onFindRegionsFinished)
+
+	def onFindRegionsFinished(self, regions):
+		self.region_comboBox.clear()
+		self.region_comboBox.addItems(['%d: %.1f mm2, max %.2f mm, mean %.2f mm' % (index + 1, regions['areaMm2'][index], regions['maxMm'][index],
+			regions['meanMm'][index]) for index in range(regions['numberOfRegions'])])
+
+	def onRegionSelected(self, index):
+		self.logic.jumpToRegion(index)
+
+	def startTask(self, task, finishedCallback=None):
+
+		# Heavy buttons are disabled while the task runs; sliders and checkboxes stay active
+		if self.task is not None:
+			return
+		self.task = task
+		self.taskFinishedCallback = finishedCallback
+		self.taskButtonsEnabled = [button.enabled for button in self.taskButtons]
+		for button in self.taskButtons:
+			button.enabled = False
+		self.cancelTaskButton.enabled = True
+		self.task_progressBar.value = 0
+		self.taskStatus_label.text = task.name + '...'
+		task.start()
+		self.taskTimer.start()
+
+	def onTaskTimer(self):
+
+		task = self.task
+		progress, message = task.status()
+		self.task_progressBar.value = int(round(100 * progress))
+		if task.cancelRequested.is_set():
+			self.taskStatus_label.text = task.name + ': cancelling...'
+		else:
+			self.taskStatus_label.text = task.name + ': ' + message if message else task.name + '...'
+		task.applyPartialResult()
+		if not task.isDone():
+			return
+
+		# Results are applied to the scene here, in the main thread
+		self.taskTimer.stop()
+		self.task = None
+		for button, enabled in zip(self.taskButtons, self.taskButtonsEnabled):
+			button.enabled = enabled
+		self.cancelTaskButton.enabled = False
+		if task.cancelled:
+			self.taskStatus_label.text = task.name + ' cancelled'
+			return
+		try:
+			result = task.finish()
+		except Exception as e:
+			self.taskStatus_label.text = task.name + ' failed'
+			logging.error(task.errorTraceback)
+			slicer.util.errorDisplay(task.name + ' failed: ' + str(e))
+			return
+		self.taskStatus_label.text = '%s done (%.1f s)' % (task.name, task.elapsedSeconds)
+		if self.taskFinishedCallback is not None:
+			self.taskFinishedCallback(result)
+
+	def onCancelTaskButton(self):
+		if self.task is not None:
+			self.task.cancel()
+
+	def onDistanceEngineChanged(self, index):
+		self.logic.distanceEngine = self.distanceEngine_comboBox.currentText
+
+	def onDistanceWorkersChanged(self, value):
+		self.logic.distanceWorkers = value
 
 	def onDisplayedRangeSliderChanged (self, minVal, maxVal):
 
-		# Update spin box values
-		self.minDisplayedRange_SpinBox.value = minVal
-		self.maxDisplayedRange_SpinBox.value = maxVal
+		# Update spin box values (without their signals, which would request the same range again)
+		for spinBox, value in [(self.minDisplayedRange_SpinBox, minVal), (self.maxDisplayedRange_SpinBox, maxVal)]:
+			wasBlocked = spinBox.blockSignals(True)
+			spinBox.value = value
+			spinBox.blockSignals(wasBlocked)
 
 		# Update displayed range
-		self.logic.updateDisplayedRangeColorMap(minVal, maxVal)
+		self.logic.requestDisplayedRangeColorMap(minVal, maxVal)
+		self.scheduleDisplayUpdate()
 
 	def onDisplayedRangeSpinBoxChanged(self):
 
 		# Update slider range
+		wasBlocked = self.displayedRange_SliderWidget.blockSignals(True)
 		self.displayedRange_SliderWidget.setValues(self.minDisplayedRange_SpinBox.value,self.maxDisplayedRange_SpinBox.value)
+		self.displayedRange_SliderWidget.blockSignals(wasBlocked)
 
 		# Update displayed range
-		self.logic.updateDisplayedRangeColorMap(self.minDisplayedRange_SpinBox.value,self.maxDisplayedRange_SpinBox.value)
+		self.logic.requestDisplayedRangeColorMap(self.minDisplayedRange_SpinBox.value,self.maxDisplayedRange_SpinBox.value)
+		self.scheduleDisplayUpdate()
+
+	def scheduleDisplayUpdate(self):
+		# Requests arriving before the timer fires are coalesced into one update
+		if not self.displayTimer.isActive():
+			self.displayTimer.start(int(round(1000 * self.logic.displayUpdates.secondsUntilNextFlush())))
+
+	def onDisplayTimer(self):
+		try:
+			self.logic.flushDisplayUpdates()
+		except Exception as e:
+			logging.error('Display update failed: ' + str(e))
 
 	def onScalarBarVisibilityChecked(self, checked):
 
@@ -332,8 +854,25 @@ class MyModuleWidget(ScriptedLoadableModuleWidget):
 
 class MyModuleLogic(ScriptedLoadableModuleLogic):
 
+	# Files whose segment is a closed surface: only these are kept in the mesh cache, since a cached
+	# surface is loaded back as a closed surface segment (labelmap files keep their labelmap master)
+	SURFACE_FILE_EXTENSIONS = ('.stl', '.vtk', '.vtp', '.obj')
+
+	# State of the current case (comparison nodes and tables, alignment, distance maps, regions, Colors
+	# module handles), None until computed. resetCaseState sets all of them, and clearCase calls it
+	# after removing the nodes: every attribute created for a case must be listed here.
+	CASE_ATTRIBUTES = ('segCompNode', 'segCompnode', 'segCompAllNode', 'tableD', 'tableH', 'tableM', 'tableAlignments', 'matrixTables',
+		'comparisonMatrix', 'surfaceHausdorffResult', 'tableDistanceStatistics', 'tableDistanceHistogram', 'tableRegions',
+		'alignmentTransform', 'alignmentResult', 'alignmentMatrix', 'alignmentName', 'distanceModel', 'distanceColorMap_display',
+		'distancePolyData', 'reverseDistancePolyData', 'distanceStatistics', 'disagreementRegions', 'scalarBarHandles')
+
 	def __init__(self):
 
+		from MyModuleLib import Alignments, DisagreementRegions, DisplayUpdates, DistanceTransforms, DistanceStatistics, LevelOfDetail
+		from MyModuleLib import Profiling, SurfaceHausdorff
+		from MyModuleLib.MeshCache import MeshCache
+		from MyModuleLib.ResultsStore import ResultsStore
+
 		# Segment paths
 		self.segment1_path = ''
 		self.segment2_path = ''
@@ -342,20 +881,284 @@ class MyModuleLogic(ScriptedLoadableModuleLogic):
 		self.segment1 = None
 		self.segment2 = None
 
+		# Alignment: 'fixed' (rotation of 180 degrees around Z), 'automatic' (see MyModuleLib/Registration.py)
+		# or 'file' (ITK transform file alignmentTransformPath). The alignment is kept as a 4x4 matrix
+		# applied on the fly to the points of segment 2, whose geometry is never modified; it is shown by
+		# a transform node observed by segment 2. Every alignment of the case is kept in
+		# alignmentCandidates (see MyModuleLib/Alignments.py), so that another one can be selected or all
+		# compared without loading the segments again.
+		self.alignmentMode = 'fixed'
+		self.alignmentSeed = 0
+		self.alignmentTransformPath = Alignments.DEFAULT_TRANSFORM_PATH
+
+		# Cache of loaded surfaces and derived labelmaps (see MyModuleLib/MeshCache.py)
+		self.meshCache = MeshCache(os.path.join(slicer.app.cachePath, 'MyModule'))
+
+		# Store of the computed results (see MyModuleLib/ResultsStore.py), set to None to disable it.
+		# The case is named after the segment files unless caseId is set.
+		self.resultsStore = ResultsStore(os.path.join(os.path.dirname(slicer.app.slicerUserSettingsFilePath), 'MyModule', 'results.sqlite'))
+		self.caseId = None
+		self.software = ''
+
+		# Output nodes (tables, color map model and display) by name, reused by later runs and removed
+		# by clearCase, so that repeated comparisons do not accumulate nodes in the scene
+		self.outputNodes = {}
+
 		# Color map display
-		self.distanceColorMap_display = None
+		self.distanceColorNodeID = 'vtkMRMLColorTableNodeFileDivergingBlueRed.txt'
+
+		# Slider updates (color map range, segment opacities) are coalesced and applied at most once per
+		# frame by flushDisplayUpdates (see MyModuleLib/DisplayUpdates.py); displayUpdates.statistics()
+		# gives their latency. Widgets of the Colors module used for the scalar bar are looked up once.
+		self.displayUpdates = DisplayUpdates.DisplayUpdates()
+		self.displayUpdates.setHandler('colorMapRange', self.updateDisplayedRangeColorMap)
+		self.displayUpdates.setHandler('segment1Opacity', self.updateSegment1Opacity)
+		self.displayUpdates.setHandler('segment2Opacity', self.updateSegment2Opacity)
+
+		# Surface distance engine used by the color map (see MyModuleLib/DistanceEngines.py)
+		self.distanceEngine = 'auto'
+		self.distanceWorkers = 1  # number of cores used by the distance computation
+
+		# Dice engine: 'segmentComparison' (SlicerRT labelmaps) or 'packedMask' (bit-packed masks on a
+		# grid of maskVoxelSizeMm, memory-mapped from the cache, see MyModuleLib/PackedMasks.py)
+		self.diceEngine = 'segmentComparison'
+		# Packed-mask Dice: voxel size in mm, or None to refine it until the Dice coefficient changes by
+		# less than maskTargetDiceError, within maskMemoryBudgetMB of masks
+		self.maskVoxelSizeMm = None
+		self.maskMemoryBudgetMB = 512
+		self.maskTargetDiceError = 0.001
+
+		# Hausdorff engine: 'segmentComparison' (SlicerRT), 'exact', 'sampled' and 'screening' on the
+		# surface vertices (see MyModuleLib/SurfaceHausdorff.py), or 'distanceTransform' on the boundary
+		# voxels of masks of hausdorffVoxelSpacingMm (x, y, z), see MyModuleLib/DistanceTransforms.py.
+		# Screening computes the exact maximum only when the upper bound of the sampled 95th percentile
+		# reaches hausdorffThresholdMm.
+		self.hausdorffMode = 'segmentComparison'
+		self.hausdorffSamples = SurfaceHausdorff.DEFAULT_SAMPLES
+		self.hausdorffConfidence = 0.95
+		self.hausdorffThresholdMm = 5.0
+		self.hausdorffSeed = 0
+		self.hausdorffVoxelSpacingMm = DistanceTransforms.DEFAULT_VOXEL_SPACING_MM
+
+		# Level of detail of the color map (see MyModuleLib/LevelOfDetail.py): surfaces above the
+		# triangle budget are displayed decimated, or shown coarse first and then at full resolution
+		# (progressive). The full-resolution distances are kept in distancePolyData.
+		self.colorMapLevelOfDetail = False
+		self.colorMapTriangleBudget = LevelOfDetail.DEFAULT_TRIANGLE_BUDGET
+		self.colorMapProgressive = False
+
+		# The color map computes the distances in both directions (distancePolyData from segment 1 to
+		# segment 2, reverseDistancePolyData from segment 2 to segment 1); their statistics and histogram
+		# are published as tables (see MyModuleLib/DistanceStatistics.py)
+		self.distanceHistogramBinWidthMm = DistanceStatistics.DEFAULT_HISTOGRAM_BIN_WIDTH_MM
+		self.distanceHistogramBins = DistanceStatistics.DEFAULT_HISTOGRAM_BINS
+
+		# Disagreement regions of the color map: vertices of segment 1 at regionThresholdMm or more from
+		# segment 2, connected by the mesh, in a table sorted by regionOrder and a markup point list
+		# (maximum distance of the first regionMarkupsMaximum regions)
+		self.regionThresholdMm = DisagreementRegions.DEFAULT_THRESHOLD_MM
+		self.regionMinimumAreaMm2 = DisagreementRegions.DEFAULT_MINIMUM_AREA_MM2
+		self.regionOrder = 'areaMm2'
+		self.regionMarkupsMaximum = 20
+
+		# Binary STL files are read with NumPy (see MyModuleLib/STLFiles.py) instead of slicer.util.loadSegmentation
+		self.fastSTLReader = True
+
+		# Review of a case list (see MyModuleLib/ReviewQueue.py): the next case is loaded, aligned with
+		# alignmentMode and compared (metrics and color map) in the background while the current one is
+		# shown; only the current and next cases are kept
+		self.reviewQueue = None
+		self.reviewCaseShown = None
+		self.reviewAlignmentMatrix = None
+
+		# Voxel size of the masks of the segment matrix (see MyModuleLib/ComparisonMatrix.py)
+		self.matrixVoxelSizeMm = 1.0
+
+		# Stage timings, disabled unless MYMODULE_PROFILE is set or profiler.enabled is True (see MyModuleLib/Profiling.py)
+		self.profiler = Profiling.defaultProfiler
+
+		self.resetCaseState()
+
+	def resetCaseState(self):
+
+		# Every attribute of CASE_ATTRIBUTES back to None, and no alignment candidate
+		from MyModuleLib import Alignments
+		for attributeName in self.CASE_ATTRIBUTES:
+			setattr(self, attributeName, None)
+		self.alignmentCandidates = Alignments.AlignmentCandidates()
 
 	def loadSegmentFromFile(self, segmentFilePath, colorRGB_array, visibility_bool):
 
-		[success, node] = slicer.util.loadSegmentation(segmentFilePath, returnNode=True) # segment loading as segment
+		from MyModuleLib import Profiling, STLFiles
+		with self.profiler.span('load', file=os.path.basename(segmentFilePath)) as span:
+			# Surfaces already parsed are taken from the cache
+			cacheKey = None
+			polyData = None
+			if (self.meshCache is not None and segmentFilePath.lower().endswith(self.SURFACE_FILE_EXTENSIONS)
+				and os.path.isfile(segmentFilePath)):
+				cacheKey = self.meshCache.fileKey(segmentFilePath, 'closedSurface')
+				polyData = self.meshCache.getPolyData(cacheKey)
+
+			cacheHit = polyData is not None
+			if (polyData is None and self.fastSTLReader and segmentFilePath.lower().endswith('.stl') and os.path.isfile(segmentFilePath)
+				and STLFiles.isBinarySTL(segmentFilePath)):
+				# Only the surface is parsed, without the segmentation reader and its intermediate nodes
+				polyData = STLFiles.readSTLPolyData(segmentFilePath, 'RAS')
+				if cacheKey is not None:
+					self.meshCache.putPolyData(cacheKey, polyData)
+
+			if polyData is not None:
+				node = self.createSegmentationNode(polyData, os.path.splitext(os.path.basename(segmentFilePath))[0])
+				success = True
+			else:
+				[success, node] = slicer.util.loadSegmentation(segmentFilePath, returnNode=True) # segment loading as segment
+				if success and cacheKey is not None:
+					self.meshCache.putPolyData(cacheKey, self.getSegmentPolyData(node))
+			if success:
+				span.setAttributes(cacheHit=cacheHit, **Profiling.meshSize(self.getSegmentPolyData(node)))
+
 		if success:
 			node.GetDisplayNode().SetColor(colorRGB_array)
 			node.GetDisplayNode().SetVisibility(visibility_bool)
-			print(node.GetName() + ' segment loaded')
+			logging.info(node.GetName() + ' segment loaded')
 		else:
-			print('ERROR: segment not found in path')
+			logging.error('Segment not found: ' + segmentFilePath)
 		return (success, node)
 
+	def createSegmentationNode(self, polyData, name):
+
+		# Segmentation node with a single closed surface segment (segment ID is the node name)
+		node = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLSegmentationNode', name)
+		node.CreateDefaultDisplayNodes()
+		node.SetMasterRepresentationToClosedSurface()
+		segment = slicer.vtkSegment()
+		segment.SetName(name)
+		segment.AddRepresentation(slicer.vtkSegmentationConverter.GetSegmentationClosedSurfaceRepresentationName(), polyData)
+		node.GetSegmentation().AddSegment(segment, name)
+		return node
+
+	def createBinaryLabelmapRepresentation(self, segmentNode):
+
+		with self.profiler.span('rasterization', segment=segmentNode.GetName()) as span:
+			cacheHit = self.createBinaryLabelmapRepresentationFromCache(segmentNode)
+			segmentation = segmentNode.GetSegmentation()
+			labelmap = segmentation.GetSegment(segmentation.GetNthSegmentID(0)).GetRepresentation(
+				slicer.vtkSegmentationConverter.GetSegmentationBinaryLabelmapRepresentationName())
+			span.setAttributes(cacheHit=cacheHit, dimensions=list(labelmap.GetDimensions()) if labelmap else None)
+
+	def createBinaryLabelmapRepresentationFromCache(self, segmentNode):
+
+		# Binary labelmap of the first segment, taken from the cache if the same surface was already
+		# rasterized with the same conversion parameters. Returns True on a cache hit.
+		segmentation = segmentNode.GetSegmentation()
+		segmentId = segmentation.GetNthSegmentID(0)
+		labelmapName = slicer.vtkSegmentationConverter.GetSegmentationBinaryLabelmapRepresentationName()
+		if self.meshCache is None:
+			segmentNode.CreateBinaryLabelmapRepresentation()
+			return False
+
+		parameters = {'conversion': segmentation.SerializeAllConversionParameters()}
+		cacheKey = self.meshCache.polyDataKey(self.getSegmentPolyData(segmentNode), 'binaryLabelmap', parameters)
+		arrays = self.meshCache.getArrays(cacheKey)
+		if arrays is not None:
+			segment = segmentation.GetSegment(segmentId)
+			segment.SetLabelValue(int(arrays['labelValue']))
+			segment.AddRepresentation(labelmapName, self.orientedImageFromArrays(arrays))
+			return True
+
+		segmentNode.CreateBinaryLabelmapRepresentation()
+		segment = segmentation.GetSegment(segmentId)
+		arrays = self.arraysFromOrientedImage(segment.GetRepresentation(labelmapName))
+		arrays['labelValue'] = np.array(segment.GetLabelValue())
+		self.meshCache.putArrays(cacheKey, arrays)
+		return False
+
+	def arraysFromOrientedImage(self, image):
+
+		imageToWorld = vtk.vtkMatrix4x4()
+		image.GetImageToWorldMatrix(imageToWorld)
+		return {
+			'scalars': numpy_support.vtk_to_numpy(image.GetPointData().GetScalars()),
+			'scalarType': np.array(image.GetScalarType()),
+			'extent': np.array(image.GetExtent()),
+			'imageToWorld': slicer.util.arrayFromVTKMatrix(imageToWorld)}
+
+	def orientedImageFromArrays(self, arrays):
+
+		image = slicer.vtkOrientedImageData()
+		image.SetExtent([int(value) for value in arrays['extent']])
+		image.SetImageToWorldMatrix(slicer.util.vtkMatrixFromArray(arrays['imageToWorld']))
+		scalars = numpy_support.numpy_to_vtk(arrays['scalars'], deep=0, array_type=int(arrays['scalarType']))
+		image.GetPointData().SetScalars(scalars)
+		return image
+
+	def centerThreeDView(self):
+
+		# No 3D view when running without main window (batch mode)
+		layoutManager = slicer.app.layoutManager()
+		if layoutManager is None:
+			return
+		threeDWidget = layoutManager.threeDWidget(0)
+		threeDView = threeDWidget.threeDView()
+		threeDView.resetFocalPoint()
+
+	def showTable(self, tableNode):
+
+		# No table view when running without main window (batch mode)
+		layoutManager = slicer.app.layoutManager()
+		if layoutManager is None:
+			return
+		layoutManager.setLayout(slicer.vtkMRMLLayoutNode.SlicerLayout3DTableView)
+		slicer.app.applicationLogic().GetSelectionNode().SetReferenceActiveTableID(tableNode.GetID())
+		slicer.app.applicationLogic().PropagateTableSelection()
+
+	def getOutputNode(self, className, name):
+
+		# Node of the main scene owned by the logic: created on first use, then reused
+		node = self.outputNodes.get(name)
+		if node is None or not slicer.mrmlScene.IsNodePresent(node):
+			node = slicer.mrmlScene.AddNewNodeByClass(className, name)
+			self.outputNodes[name] = node
+		return node
+
+	def getOutputTableNode(self, name):
+
+		# Empty table node
+		tableNode = self.getOutputNode('vtkMRMLTableNode', name)
+		tableNode.RemoveAllColumns()
+		return tableNode
+
+	def removeNode(self, node):
+
+		# Node with its display and storage nodes
+		if node is None or not slicer.mrmlScene.IsNodePresent(node):
+			return
+		dependentNodes = []
+		if node.IsA('vtkMRMLDisplayableNode'):
+			dependentNodes += [node.GetNthDisplayNode(index) for index in range(node.GetNumberOfDisplayNodes())]
+		if node.IsA('vtkMRMLStorableNode'):
+			dependentNodes += [node.GetNthStorageNode(index) for index in range(node.GetNumberOfStorageNodes())]
+		slicer.mrmlScene.RemoveNode(node)
+		for dependentNode in dependentNodes:
+			if dependentNode is not None and slicer.mrmlScene.IsNodePresent(dependentNode):
+				slicer.mrmlScene.RemoveNode(dependentNode)
+
+	def clearCase(self, removeSegments=True):
+
+		# Releases everything created for the current case: output nodes, segments (unless
+		# removeSegments is False), comparison nodes of the private scenes and distance maps
+		with self.profiler.span('clearCase', outputNodes=len(self.outputNodes)):
+			for node in self.outputNodes.values():
+				self.removeNode(node)
+			self.outputNodes = {}
+			if removeSegments:
+				self.removeNode(self.segment1)
+				self.removeNode(self.segment2)
+				self.segment1 = None
+				self.segment2 = None
+			self.displayUpdates.discard()
+			self.resetCaseState()
+
 	def updateVisibility(self, segmentNode, show):
 
 		if show:
@@ -369,6 +1172,9 @@ class MyModuleLogic(ScriptedLoadableModuleLogic):
 
 	def loadSegments(self):
 
+		# A new pair starts a new case: the nodes of the previous one are released
+		self.clearCase()
+
 		# Segment 1
 		[success1, self.segment1] = self.loadSegmentFromFile(self.segment1_path, [1, 0, 0], True)  # call function from logic
 
@@ -376,39 +1182,172 @@ class MyModuleLogic(ScriptedLoadableModuleLogic):
 		[success2, self.segment2] = self.loadSegmentFromFile(self.segment2_path, [0, 1, 0], True)  # call function from logic
 
 		# Center 3D view
-		layoutManager = slicer.app.layoutManager()
-		threeDWidget = layoutManager.threeDWidget(0)
-		threeDView = threeDWidget.threeDView()
-		threeDView.resetFocalPoint() 
+		self.centerThreeDView()
 
 		return (success1 and success2)
 
 	def alignSegments(self):
 
-		# Rotation
-		self.alignmentTransform = slicer.vtkMRMLLinearTransformNode()
-		self.alignmentTransform.SetName("alignmentTransform")
-		slicer.mrmlScene.AddNode(self.alignmentTransform)
-
-		# Create transformation matrix
-		rotMatrix = vtk.vtkTransform()
-		rotMatrix.RotateZ(-180.0) 
-		self.alignmentTransform.SetMatrixTransformToParent(rotMatrix.GetMatrix())
-
-		# Build transform tree
-		self.segment2.SetAndObserveTransformNodeID(self.alignmentTransform.GetID())
-
-		# Harden transform
-		self.segment2.HardenTransform()
-
-		# Delete transform from scene
-		slicer.mrmlScene.RemoveNode(self.alignmentTransform)
+		self.alignSegmentsTask().runSynchronously()
+
+	def alignSegmentsTask(self):
+
+		# The registration runs in the background on copies of the original points; the matrix is
+		# stored and displayed when the task finishes
+		from MyModuleLib import Alignments, DistanceEngines
+		mode = self.alignmentMode
+		if mode == 'automatic':
+			points1 = DistanceEngines.polyDataPoints(self.getSegmentPolyData(self.segment1)).copy()
+			points2 = DistanceEngines.polyDataPoints(self.getSegmentPolyData(self.segment2)).copy()
+		elif mode == 'file':
+			fileMatrix = self.readTransformFile(self.alignmentTransformPath)
+		elif mode != 'fixed':
+			raise ValueError('Unknown alignment mode: ' + str(mode))
+
+		def compute(task):
+			# The registration result is only stored by apply, in the main thread
+			if mode == 'fixed':
+				return Alignments.FIXED_ALIGNMENT, None
+			if mode == 'file':
+				return fileMatrix, None
+			task.setProgress(0.0, 'Registering segments...')
+			with self.profiler.span('registration', movingPoints=len(points2), fixedPoints=len(points1)):
+				registrationResult = self.computeAutomaticAlignment(points1, points2, lambda fraction: task.setProgress(fraction))
+			task.setProgress(1.0, 'RMS residual %.3f mm after %d iterations' % (registrationResult['rmsResidual'], registrationResult['iterations']))
+			return registrationResult['matrix'], registrationResult
+
+		def apply(result):
+			alignmentMatrix, registrationResult = result
+			details = {}
+			if mode == 'automatic':
+				self.alignmentResult = registrationResult
+				details = {'rmsResidualMm': registrationResult['rmsResidual'], 'iterations': registrationResult['iterations']}
+			elif mode == 'file':
+				details = {'path': self.alignmentTransformPath}
+			self.alignmentCandidates.add(mode, alignmentMatrix, mode, **details)
+			self.applyAlignment(mode)
+			return alignmentMatrix
+
+		return BackgroundTask('Alignment', compute, apply)
+
+	def readTransformFile(self, path):
+
+		# 4x4 matrix of a linear transform file (ITK .h5 files are read with h5py when available,
+		# otherwise by a temporary transform node)
+		from MyModuleLib import Alignments
+		if path.lower().endswith('.h5') and Backends.h5pyModule() is not None:
+			return Alignments.readITKTransform(path)
+		transformNode = slicer.util.loadTransform(path)
+		try:
+			if not transformNode.IsLinear():
+				raise ValueError('Not a linear transform: ' + path)
+			return slicer.util.arrayFromTransformMatrix(transformNode)
+		finally:
+			slicer.mrmlScene.RemoveNode(transformNode)
+
+	def applyAlignment(self, name):
+
+		# Candidate alignment used by the metrics; segment 2 is displayed through a transform node
+		with self.profiler.span('applyAlignment', alignment=name):
+			self.alignmentName = name
+			self.alignmentMatrix = self.alignmentCandidates.get(name)['matrix']
+			self.alignmentTransform = self.getOutputNode('vtkMRMLLinearTransformNode', 'alignmentTransform')
+			self.alignmentTransform.SetMatrixTransformToParent(slicer.util.vtkMatrixFromArray(self.alignmentMatrix))
+			self.segment2.SetAndObserveTransformNodeID(self.alignmentTransform.GetID())
 
 		# Center 3D view
-		layoutManager = slicer.app.layoutManager()
-		threeDWidget = layoutManager.threeDWidget(0)
-		threeDView = threeDWidget.threeDView()
-		threeDView.resetFocalPoint()
+		self.centerThreeDView()
+
+	def selectAlignment(self, name):
+
+		if name not in self.alignmentCandidates:
+			raise ValueError('Unknown alignment: ' + str(name))
+		self.applyAlignment(name)
+
+	def computeAutomaticAlignment(self, points1, points2, progressCallback=None):
+
+		# Rigid registration of segment 2 onto segment 1 (PCA initialization + multi-resolution ICP).
+		# Runs on the worker thread: the result (matrix, RMS residual, iterations) is returned, not stored.
+		from MyModuleLib import Registration
+		return Registration.rigidRegistration(points2, points1, seed=self.alignmentSeed, progressCallback=progressCallback)
+
+	def getAlignedSegment2PolyData(self, copy=False):
+
+		# Surface of segment 2 moved by the current alignment; it shares the cells of the segment
+		# surface (or of a copy of it, for the background tasks) and only has its own points
+		from MyModuleLib import Alignments
+		polyData = self.getSegmentPolyData(self.segment2)
+		if copy:
+			polyDataCopy = vtk.vtkPolyData()
+			polyDataCopy.DeepCopy(polyData)
+			polyData = polyDataCopy
+		return Alignments.transformedPolyData(polyData, self.alignmentMatrix)
+
+	def compareAlignments(self):
+
+		return self.compareAlignmentsTask().runSynchronously()
+
+	def compareAlignmentsTask(self):
+
+		# Metrics of every candidate alignment, from the original surfaces: the distance engines and
+		# masks of segment 1 are built once, only the points of segment 2 are transformed per candidate
+		from MyModuleLib import Alignments, Labelmaps
+		if not len(self.alignmentCandidates):
+			raise ValueError('No alignment to compare: align the segments first')
+		sourcePolyData = vtk.vtkPolyData()
+		sourcePolyData.DeepCopy(self.getSegmentPolyData(self.segment1))
+		targetPolyData = vtk.vtkPolyData()
+		targetPolyData.DeepCopy(self.getSegmentPolyData(self.segment2))
+		candidates = [(name, self.alignmentCandidates.get(name)['matrix']) for name in self.alignmentCandidates.names()]
+		voxelSizeMm = self.maskVoxelSizeMm or Labelmaps.DEFAULT_VOXEL_SIZE_MM
+		distanceEngine = self.distanceEngine
+
+		def compute(task):
+			evaluator = Alignments.AlignmentEvaluator(sourcePolyData, targetPolyData, distanceEngine, voxelSizeMm, self.meshCache)
+			results = []
+			for index, (name, matrix) in enumerate(candidates):
+				task.setProgress(index / float(len(candidates)), 'Evaluating alignment ' + name + '...')
+				with self.profiler.span('alignmentCandidate', alignment=name):
+					results.append((name, evaluator.evaluate(matrix)))
+			return results
+
+		def apply(results):
+			for name, metrics in results:
+				if name in self.alignmentCandidates:
+					self.alignmentCandidates.setMetrics(name, metrics)
+				self.storeResults(metrics, 'alignmentCandidate', {'alignment': name, 'voxelSizeMm': voxelSizeMm, 'distanceEngine': distanceEngine})
+			self.tableAlignments = self.createAlignmentsTable("Alignment Candidates", results)
+			self.showTable(self.tableAlignments)
+			return results
+
+		return BackgroundTask('Alignment comparison', compute, apply)
+
+	def createAlignmentsTable(self, name, results):
+
+		# One row per candidate alignment, one column per metric
+		tableNode = self.getOutputTableNode(name)
+		metricNames = list(results[0][1].keys()) if results else []
+		for columnName in ['Alignment', 'Source'] + metricNames:
+			column = tableNode.AddColumn()
+			column.SetName(columnName)
+		for row, (alignmentName, metrics) in enumerate(results):
+			tableNode.AddEmptyRow()
+			tableNode.SetCellText(row, 0, alignmentName + (' (selected)' if alignmentName == self.alignmentName else ''))
+			tableNode.SetCellText(row, 1, self.alignmentCandidates.get(alignmentName)['source'] if alignmentName in self.alignmentCandidates else '')
+			for column, metricName in enumerate(metricNames):
+				tableNode.SetCellText(row, column + 2, '%.4f' % metrics[metricName])
+		return tableNode
+
+	def getSegmentPolyData(self, segmentNode):
+
+		# Closed surface of the first segment of a segmentation node
+		from MyModuleLib import Profiling
+		with self.profiler.span('closedSurface', segment=segmentNode.GetName()) as span:
+			segmentNode.CreateClosedSurfaceRepresentation()
+			segmentId = segmentNode.GetSegmentation().GetNthSegmentID(0)
+			polyData = segmentNode.GetClosedSurfaceRepresentation(segmentId)
+			span.setAttributes(**Profiling.meshSize(polyData))
+		return polyData
 
 	def updateSegment1Visibility(self,checked):
 
@@ -422,180 +1361,994 @@ class MyModuleLogic(ScriptedLoadableModuleLogic):
 
 		# Get opacity value and normalize it to get values in [0,100]
 		opacityValue_norm = opacityValue / 100.0
-		print(opacityValue_norm)
 
-		self.updateSegmentOpacity(self.segment1, opacityValue_norm)  # Update segment opacity
+		if self.segment1 is not None:
+			self.updateSegmentOpacity(self.segment1, opacityValue_norm)  # Update segment opacity
 
 	def updateSegment2Opacity(self, opacityValue):
 
 		# Get opacity value and normalize it to get values in [0,100]
 		opacityValue_norm = opacityValue / 100.0
-		print(opacityValue_norm)
 
-		self.updateSegmentOpacity(self.segment2, opacityValue_norm)  # Update segment opacity
+		if self.segment2 is not None:
+			self.updateSegmentOpacity(self.segment2, opacityValue_norm)  # Update segment opacity
 
-	def diceCoeff(self):
+	def createSegmentComparisonNode(self, referenceNode, compareNode, scene=None):
 
 		# Creation of a node for segments comparison
-		self.segCompNode = slicer.vtkMRMLSegmentComparisonNode()
-		slicer.mrmlScene.AddNode(self.segCompNode)
-		slicer.modules.segmentcomparison.logic().SetMRMLScene(slicer.mrmlScene)
+		segCompNode = slicer.vtkMRMLSegmentComparisonNode()
+		if scene is None:
+			scene = slicer.mrmlScene
+			slicer.modules.segmentcomparison.logic().SetMRMLScene(slicer.mrmlScene)
+		scene.AddNode(segCompNode)
 
 		# Loading of the segmentation node and the first segmentation
-		self.segCompNode.SetAndObserveReferenceSegmentationNode(self.segment1)
-		self.segCompNode.SetReferenceSegmentID(self.segment1.GetName())
+		segCompNode.SetAndObserveReferenceSegmentationNode(referenceNode)
+		segCompNode.SetReferenceSegmentID(referenceNode.GetSegmentation().GetNthSegmentID(0))
 
 		# Loading of the segmentation node and the segmentation of comparison
-		self.segCompNode.SetAndObserveCompareSegmentationNode(self.segment2)
-		self.segCompNode.SetCompareSegmentID(self.segment2.GetName())
-
-		# Creation and configuration of a table node where the results will be shown
-		self.tableD = slicer.vtkMRMLTableNode()
-		self.tableD.SetName("Sorensen-Dice Coefficient")
-		slicer.mrmlScene.AddNode(self.tableD)
-		self.segCompNode.SetAndObserveDiceTableNode(self.tableD)
-
-		# Display Dice Coefficient Table (3D Table View)
-		slicer.app.layoutManager().setLayout(slicer.vtkMRMLLayoutNode.SlicerLayout3DTableView)
-		slicer.app.applicationLogic().GetSelectionNode().SetReferenceActiveTableID(self.tableD.GetID())
-		slicer.app.applicationLogic().PropagateTableSelection()
+		segCompNode.SetAndObserveCompareSegmentationNode(compareNode)
+		segCompNode.SetCompareSegmentID(compareNode.GetSegmentation().GetNthSegmentID(0))
+
+		return segCompNode
+
+	def createPrivateComparison(self):
+
+		# Copies of both segments in a scene of their own, with their own SegmentComparison logic,
+		# so that the comparison can run on a worker thread without touching the main scene
+		from MyModuleLib import Alignments
+		if Backends.segmentComparisonModule() is None:
+			raise RuntimeError(SLICER_RT_REQUIRED + ' Use the packedMask Dice engine and a surface Hausdorff mode without it.')
+		scene = slicer.vtkMRMLScene()
+		segmentNodes = []
+		for segmentNode in [self.segment1, self.segment2]:
+			segmentNodeCopy = slicer.vtkMRMLSegmentationNode()
+			segmentNodeCopy.SetName(segmentNode.GetName())
+			segmentNodeCopy.GetSegmentation().DeepCopy(segmentNode.GetSegmentation())
+			scene.AddNode(segmentNodeCopy)
+			segmentNodes.append(segmentNodeCopy)
+
+		# SegmentComparison does not apply transforms: the alignment is hardened on the copy of segment 2 only
+		if not Alignments.isIdentity(self.alignmentMatrix):
+			transformNode = slicer.vtkMRMLLinearTransformNode()
+			scene.AddNode(transformNode)
+			transformNode.SetMatrixTransformToParent(slicer.util.vtkMatrixFromArray(self.alignmentMatrix))
+			segmentNodes[1].SetAndObserveTransformNodeID(transformNode.GetID())
+			segmentNodes[1].HardenTransform()
+			scene.RemoveNode(transformNode)
+		segCompNode = self.createSegmentComparisonNode(segmentNodes[0], segmentNodes[1], scene)
+		segmentComparisonLogic = slicer.vtkSlicerSegmentComparisonModuleLogic()
+		segmentComparisonLogic.SetMRMLScene(scene)
+		return scene, segmentNodes, segCompNode, segmentComparisonLogic
+
+	def createLabelmapsInBackground(self, task, segmentNodes, progressStart, progressEnd):
+
+		# Binary labelmaps of the copied segments (from the cache when possible)
+		for index, segmentNode in enumerate(segmentNodes):
+			progress = progressStart + (progressEnd - progressStart) * index / float(len(segmentNodes))
+			task.setProgress(progress, 'Creating labelmap of ' + segmentNode.GetName() + '...')
+			self.createBinaryLabelmapRepresentation(segmentNode)
+
+	def addTableNode(self, name, sourceTableNode):
+
+		# Copy of a table computed in a private scene, in the output table node of that name
+		tableNode = self.getOutputNode('vtkMRMLTableNode', name)
+		tableNode.Copy(sourceTableNode)
+		tableNode.SetName(name)
+		return tableNode
 
-		# Calculation of the Dice Index
-		slicer.modules.segmentcomparison.logic().ComputeDiceStatistics(self.segCompNode)
+	def diceCoeff(self):
 
-		# Save table in a CSV file
-		storagenode = self.tableD.CreateDefaultStorageNode()
-		storagenode.SetFileName("dice.csv")
-		storagenode.WriteData(self.tableD)
+		self.diceCoeffTask().runSynchronously()
 
-	def hausdorffDist(self):
+	def diceCoeffTask(self):
+
+		if self.diceEngine == 'packedMask':
+			return self.packedDiceTask()
 
 		# Creation of a node for segments comparison
-		self.segCompnode = slicer.vtkMRMLSegmentComparisonNode()
-		slicer.mrmlScene.AddNode(self.segCompnode)
-		slicer.modules.segmentcomparison.logic().SetMRMLScene(slicer.mrmlScene)
+		scene, segmentNodes, segCompNode, segmentComparisonLogic = self.createPrivateComparison()
+
+		# Table node where the results are computed
+		diceTable = slicer.vtkMRMLTableNode()
+		scene.AddNode(diceTable)
+		segCompNode.SetAndObserveDiceTableNode(diceTable)
+
+		def compute(task):
+			self.createLabelmapsInBackground(task, segmentNodes, 0.0, 0.8)
+			task.setProgress(0.8, 'Computing Dice coefficient...')
+			with self.profiler.span('segmentComparison.dice'):
+				errorMessage = segmentComparisonLogic.ComputeDiceStatistics(segCompNode)
+			if errorMessage:
+				raise RuntimeError('Dice computation failed: ' + errorMessage)
+			return diceTable
+
+		def apply(diceTable):
+			self.segCompNode = segCompNode
+			self.tableD = self.addTableNode("Sorensen-Dice Coefficient", diceTable)
+
+			# Display Dice Coefficient Table (3D Table View)
+			self.showTable(self.tableD)
+
+			# Save results
+			self.storeResults({'dice': segCompNode.GetDiceCoefficient(), 'referenceVolumeCc': segCompNode.GetReferenceVolumeCc(),
+				'compareVolumeCc': segCompNode.GetCompareVolumeCc()}, 'segmentComparison', self.segmentComparisonParameters())
+			return self.tableD
+
+		return BackgroundTask('Dice coefficient', compute, apply)
+
+	def computePackedDice(self):
+
+		return self.packedDiceTask().runSynchronously()
+
+	def packedDiceTask(self):
+
+		# Dice and volumes computed on bit-packed masks of both closed surfaces. With the cache, the
+		# masks of a revisited case are memory-mapped from disk instead of being rasterized again.
+		from MyModuleLib import PackedMasks
+		sourcePolyData = vtk.vtkPolyData()
+		sourcePolyData.DeepCopy(self.getSegmentPolyData(self.segment1))
+		targetPolyData = self.getAlignedSegment2PolyData(copy=True)
+		voxelSizeMm = self.maskVoxelSizeMm
+		alignmentName = self.alignmentName
+		memoryBudgetBytes = int(self.maskMemoryBudgetMB * 1024**2)
+		targetDiceError = self.maskTargetDiceError
+
+		def compute(task):
+			task.setProgress(0.0, 'Computing Dice coefficient...')
+			with self.profiler.span('packedDice', voxelSizeMm=voxelSizeMm, memoryBudgetBytes=memoryBudgetBytes) as span:
+				result = PackedMasks.computeDice(sourcePolyData, targetPolyData, voxelSizeMm, self.meshCache, memoryBudgetBytes,
+					targetDiceError, lambda size: task.setProgress(0.0, 'Computing Dice coefficient (%.3g mm voxels)...' % size))
+				span.setAttributes(maskBytes=result['maskBytes'], cacheHits=result['cacheHits'], voxelSizeMm=result['voxelSizeMm'])
+			return result
+
+		def apply(result):
+			metrics = {name: result[name] for name in ['dice', 'referenceVolumeCc', 'compareVolumeCc', 'voxelSizeMm', 'oversamplingFactor',
+				'estimatedDiceError', 'referenceVolumeErrorCc', 'compareVolumeErrorCc', 'memoryLimited']}
+			self.tableD = self.createMetricsTable("Sorensen-Dice Coefficient", metrics)
+
+			# Display Dice Coefficient Table (3D Table View)
+			self.showTable(self.tableD)
+
+			# Save results (the voxel size actually used is part of the parameters)
+			self.storeResults(metrics, 'packedMask', {'voxelSizeMm': result['voxelSizeMm'], 'targetDiceError': None if voxelSizeMm else targetDiceError,
+				'alignment': alignmentName})
+			if result['memoryLimited']:
+				logging.warning('Dice coefficient: voxel size limited by the memory budget (%g MB), estimated error %.2g'
+					% (memoryBudgetBytes / 1024.0**2, result['estimatedDiceError']))
+			return metrics
+
+		return BackgroundTask('Dice coefficient', compute, apply)
+
+	def createMetricsTable(self, name, metrics):
+
+		# Table node with one row holding all metrics
+		tableNode = self.getOutputTableNode(name)
+		tableNode.AddEmptyRow()
+		for metricName in metrics:
+			column = tableNode.AddColumn()
+			column.SetName(metricName)
+			tableNode.SetCellText(0, tableNode.GetNumberOfColumns() - 1, str(metrics[metricName]))
+		return tableNode
 
-		# Loading of the segmentation node and the first segmentation
-		self.segCompnode.SetAndObserveReferenceSegmentationNode(self.segment1)
-		self.segCompnode.SetReferenceSegmentID(self.segment1.GetName())
+	def hausdorffDist(self):
 
-		# Loading of the segmentation node and the segmentation of comparison
-		self.segCompnode.SetAndObserveCompareSegmentationNode(self.segment2)
-		self.segCompnode.SetCompareSegmentID(self.segment2.GetName())
-
-		# Creation and configuration of a table node where the results will be shown
-		self.tableH = slicer.vtkMRMLTableNode()
-		self.tableH.SetName("Hausdorff Distance")
-		slicer.mrmlScene.AddNode(self.tableH)
-		self.segCompnode.SetAndObserveHausdorffTableNode(self.tableH)
-
-		# Display Hausdorff Distance Table (3D Table View)
-		slicer.app.layoutManager().setLayout(slicer.vtkMRMLLayoutNode.SlicerLayout3DTableView)
-		slicer.app.applicationLogic().GetSelectionNode().SetReferenceActiveTableID(self.tableH.GetID())
-		slicer.app.applicationLogic().PropagateTableSelection()
+		self.hausdorffDistTask().runSynchronously()
 
-		# Calculation of the Hausdorff Distance
-		slicer.modules.segmentcomparison.logic().ComputeHausdorffDistances(self.segCompnode)
+	def hausdorffDistTask(self):
 
-		# Save table in a CSV file
-		storagenode = self.tableH.CreateDefaultStorageNode()
-		storagenode.SetFileName("hausdorff.csv")
-		storagenode.WriteData(self.tableH)
+		if self.hausdorffMode != 'segmentComparison':
+			return self.surfaceHausdorffTask()
 
-	def showColorMap(self):
+		# Creation of a node for segments comparison
+		scene, segmentNodes, segCompNode, segmentComparisonLogic = self.createPrivateComparison()
+
+		# Table node where the results are computed
+		hausdorffTable = slicer.vtkMRMLTableNode()
+		scene.AddNode(hausdorffTable)
+		segCompNode.SetAndObserveHausdorffTableNode(hausdorffTable)
+
+		def compute(task):
+			self.createLabelmapsInBackground(task, segmentNodes, 0.0, 0.5)
+			task.setProgress(0.5, 'Computing Hausdorff distances...')
+			with self.profiler.span('segmentComparison.hausdorff'):
+				errorMessage = segmentComparisonLogic.ComputeHausdorffDistances(segCompNode)
+			if errorMessage:
+				raise RuntimeError('Hausdorff computation failed: ' + errorMessage)
+			return hausdorffTable
+
+		def apply(hausdorffTable):
+			self.segCompnode = segCompNode
+			self.tableH = self.addTableNode("Hausdorff Distance", hausdorffTable)
+
+			# Display Hausdorff Distance Table (3D Table View)
+			self.showTable(self.tableH)
+
+			# Save results
+			self.storeResults({'hausdorffMaxMm': segCompNode.GetMaximumHausdorffDistanceForBoundaryMm(),
+				'hausdorff95Mm': segCompNode.GetPercent95HausdorffDistanceForBoundaryMm(),
+				'hausdorffMeanMm': segCompNode.GetAverageHausdorffDistanceForBoundaryMm()}, 'segmentComparison', self.segmentComparisonParameters())
+			return self.tableH
+
+		return BackgroundTask('Hausdorff distance', compute, apply)
+
+	def computeSurfaceHausdorff(self):
+
+		return self.surfaceHausdorffTask().runSynchronously()
+
+	def surfaceHausdorffTask(self):
+
+		# Hausdorff distances between the vertices of both closed surfaces (hausdorffMode 'exact',
+		# 'sampled' or 'screening') or between the boundary voxels of their masks ('distanceTransform')
+		from MyModuleLib import DistanceTransforms, Profiling, SurfaceHausdorff
+		sourcePolyData = vtk.vtkPolyData()
+		sourcePolyData.DeepCopy(self.getSegmentPolyData(self.segment1))
+		targetPolyData = self.getAlignedSegment2PolyData(copy=True)
+		# Settings are read once here, so that widget changes during the computation do not affect it
+		mode = self.hausdorffMode
+		distanceEngine = self.distanceEngine
+		seed = self.hausdorffSeed
+		samples = self.hausdorffSamples
+		confidence = self.hausdorffConfidence
+		thresholdMm = self.hausdorffThresholdMm
+		voxelSpacingMm = [float(value) for value in self.hausdorffVoxelSpacingMm]
+		meshCache = self.meshCache
+		parameters = {'distanceEngine': distanceEngine, 'seed': seed}
+		if mode != 'exact':
+			parameters.update({'samples': samples, 'confidence': confidence})
+		if mode == 'screening':
+			parameters['thresholdMm'] = thresholdMm
+		if mode == 'distanceTransform':
+			parameters = {'voxelSpacingMm': voxelSpacingMm}
+		parameters['alignment'] = self.alignmentName
+
+		def compute(task):
+			task.setProgress(0.0, 'Computing Hausdorff distances...')
+			progressCallback = lambda fraction: task.setProgress(fraction)
+			with self.profiler.span('surfaceHausdorff', mode=mode, **Profiling.meshSize(sourcePolyData)) as span:
+				if mode == 'exact':
+					result = SurfaceHausdorff.exactHausdorff(sourcePolyData, targetPolyData, distanceEngine, seed, progressCallback)
+				elif mode == 'sampled':
+					result = SurfaceHausdorff.sampledHausdorff(sourcePolyData, targetPolyData, samples, confidence, distanceEngine, seed)
+				elif mode == 'screening':
+					result = SurfaceHausdorff.screenHausdorff(sourcePolyData, targetPolyData, thresholdMm, samples, confidence,
+						distanceEngine, seed, progressCallback)
+				elif mode == 'distanceTransform':
+					result = DistanceTransforms.distanceTransformHausdorff(sourcePolyData, targetPolyData, voxelSpacingMm,
+						meshCache, progressCallback)
+				else:
+					raise ValueError('Unknown Hausdorff mode: ' + str(mode))
+				span.setAttributes(exactEvaluations=result.get('exactEvaluations'), boundaryVoxels=result.get('boundaryVoxels'))
+			return result
+
+		def apply(result):
+			self.surfaceHausdorffResult = result
+			self.tableH = self.createMetricsTable("Hausdorff Distance", result)
+
+			# Display Hausdorff Distance Table (3D Table View)
+			self.showTable(self.tableH)
+
+			# Save results (distances only)
+			self.storeResults({name: value for name, value in result.items() if name.endswith('Mm')}, 'surfaceHausdorff.' + mode, parameters)
+			return result
+
+		return BackgroundTask('Hausdorff distance', compute, apply)
+
+	def computeAllMetrics(self):
+
+		return self.allMetricsTask().runSynchronously()
+
+	def allMetricsTask(self):
+
+		# Binary labelmaps are created once and shared by the Dice and Hausdorff computations.
+		# A single comparison node holds both results.
+		scene, segmentNodes, segCompNode, segmentComparisonLogic = self.createPrivateComparison()
+
+		def compute(task):
+			self.createLabelmapsInBackground(task, segmentNodes, 0.0, 0.4)
+			task.setProgress(0.4, 'Computing Dice coefficient...')
+			with self.profiler.span('segmentComparison.dice'):
+				errorMessage = segmentComparisonLogic.ComputeDiceStatistics(segCompNode)
+			if errorMessage:
+				raise RuntimeError('Dice computation failed: ' + errorMessage)
+			task.setProgress(0.5, 'Computing Hausdorff distances...')
+			with self.profiler.span('segmentComparison.hausdorff'):
+				errorMessage = segmentComparisonLogic.ComputeHausdorffDistances(segCompNode)
+			if errorMessage:
+				raise RuntimeError('Hausdorff computation failed: ' + errorMessage)
+
+			# Result row
+			dice = segCompNode.GetDiceCoefficient()
+			metrics = {}
+			metrics['dice'] = dice
+			metrics['jaccard'] = dice / (2.0 - dice)
+			metrics['referenceVolumeCc'] = segCompNode.GetReferenceVolumeCc()
+			metrics['compareVolumeCc'] = segCompNode.GetCompareVolumeCc()
+			metrics['hausdorffMaxMm'] = segCompNode.GetMaximumHausdorffDistanceForBoundaryMm()
+			metrics['hausdorff95Mm'] = segCompNode.GetPercent95HausdorffDistanceForBoundaryMm()
+			metrics['hausdorffMeanMm'] = segCompNode.GetAverageHausdorffDistanceForBoundaryMm()
+			return metrics
+
+		def apply(metrics):
+			self.segCompAllNode = segCompNode
+
+			# Creation of a table node with one row holding all metrics
+			self.tableM = self.createMetricsTable("Segment Comparison Metrics", metrics)
+
+			# Display metrics table (3D Table View)
+			self.showTable(self.tableM)
+
+			# Save results
+			self.storeResults(metrics, 'segmentComparison', self.segmentComparisonParameters())
+			return metrics
+
+		return BackgroundTask('All metrics', compute, apply)
+
+	def getSegmentsPolyData(self, segmentNode):
+
+		# (name, closed surface) of every segment of a segmentation node; names are 'node/segment'.
+		# Surfaces are in world coordinates (a linear transform of the node, e.g. the alignment of
+		# segment 2, is applied to the points).
+		from MyModuleLib import Alignments
+		segmentNode.CreateClosedSurfaceRepresentation()
+		segmentation = segmentNode.GetSegmentation()
+		matrix = None
+		transformNode = segmentNode.GetParentTransformNode()
+		if transformNode is not None and transformNode.IsTransformToWorldLinear():
+			toWorld = vtk.vtkMatrix4x4()
+			transformNode.GetMatrixTransformToWorld(toWorld)
+			matrix = slicer.util.arrayFromVTKMatrix(toWorld)
+		namedPolyData = []
+		for segmentIndex in range(segmentation.GetNumberOfSegments()):
+			segmentId = segmentation.GetNthSegmentID(segmentIndex)
+			polyData = vtk.vtkPolyData()
+			polyData.DeepCopy(segmentNode.GetClosedSurfaceRepresentation(segmentId))
+			namedPolyData.append((segmentNode.GetName() + '/' + segmentation.GetSegment(segmentId).GetName(),
+				Alignments.transformedPolyData(polyData, matrix)))
+		return namedPolyData
+
+	def computeComparisonMatrix(self, referenceNodes, compareNodes=None):
+
+		return self.comparisonMatrixTask(referenceNodes, compareNodes).runSynchronously()
+
+	def comparisonMatrixTask(self, referenceNodes, compareNodes=None):
+
+		# Dice and Hausdorff matrices between all segments of referenceNodes (rows) and all segments of
+		# compareNodes (columns, referenceNodes if not given). Each segment is rasterized and gets its
+		# distance locator once, whatever the number of pairs.
+		from MyModuleLib import ComparisonMatrix
+		segmentsByNode = {}
+		def nodeSegments(nodes):
+			# Surfaces of a node checked on both sides are shared, so that they are prepared once
+			for node in nodes:
+				if node.GetID() not in segmentsByNode:
+					segmentsByNode[node.GetID()] = self.getSegmentsPolyData(node)
+			return [entry for node in nodes for entry in segmentsByNode[node.GetID()]]
+		rowSegments = nodeSegments(referenceNodes)
+		columnSegments = nodeSegments(referenceNodes if compareNodes is None else compareNodes)
+		voxelSizeMm = self.matrixVoxelSizeMm
+		distanceEngine = self.distanceEngine
+
+		def compute(task):
+			task.setProgress(0.0, 'Comparing %d x %d segments...' % (len(rowSegments), len(columnSegments)))
+			with self.profiler.span('comparisonMatrix', rows=len(rowSegments), columns=len(columnSegments), voxelSizeMm=voxelSizeMm):
+				return ComparisonMatrix.computeComparisonMatrix(rowSegments, columnSegments, voxelSizeMm, distanceEngine,
+					lambda fraction: task.setProgress(fraction))
+
+		def apply(result):
+			self.comparisonMatrix = result
+			self.matrixTables = {}
+			for metric, tableName in [('dice', 'Dice Matrix'), ('hausdorffMaxMm', 'Hausdorff Matrix'),
+				('hausdorff95Mm', 'Hausdorff 95% Matrix'), ('hausdorffMeanMm', 'Mean Distance Matrix')]:
+				self.matrixTables[metric] = self.createMatrixTable(tableName, result['rowNames'], result['columnNames'], result['matrices'][metric])
+
+			# Display Dice matrix (3D Table View)
+			self.showTable(self.matrixTables['dice'])
+
+			# Save results: one entry per pair of segments
+			parameters = {'voxelSizeMm': voxelSizeMm, 'distanceEngine': distanceEngine}
+			for row, rowName in enumerate(result['rowNames']):
+				for column, columnName in enumerate(result['columnNames']):
+					pairMetrics = {metric: float(result['matrices'][metric][row, column]) for metric in ComparisonMatrix.MATRIX_METRICS}
+					self.storeResults(pairMetrics, 'comparisonMatrix', parameters, rowName, columnName)
+			return result
+
+		return BackgroundTask('Comparison matrix', compute, apply)
+
+	def createMatrixTable(self, name, rowNames, columnNames, matrix):
+
+		# Table node with the row names in the first column and one column per column segment
+		tableNode = self.getOutputTableNode(name)
+		segmentColumn = tableNode.AddColumn()
+		segmentColumn.SetName('Segment')
+		for rowName in rowNames:
+			tableNode.AddEmptyRow()
+		for columnName in columnNames:
+			column = tableNode.AddColumn()
+			column.SetName(columnName)
+		for row, rowName in enumerate(rowNames):
+			tableNode.SetCellText(row, 0, rowName)
+			for column in range(len(columnNames)):
+				tableNode.SetCellText(row, column + 1, '%.4f' % matrix[row, column])
+		return tableNode
+
+	#
+	# Results store
+	#
+
+	def currentCaseId(self):
+
+		from MyModuleLib import BatchComparison
+		if self.caseId:
+			return self.caseId
+		if self.segment1_path and self.segment2_path:
+			return BatchComparison.caseIdFromPaths(self.segment1_path, self.segment2_path)
+		return 'scene'
+
+	def segmentComparisonParameters(self):
+
+		return {'alignmentMode': self.alignmentMode, 'alignment': self.alignmentName}
+
+	def storeResults(self, metrics, engine, parameters=None, segment1=None, segment2=None):
+
+		# Metrics of the current case (segment 1 against segment 2 unless other names are given)
+		if self.resultsStore is None:
+			return
+		if segment1 is None:
+			segment1 = self.segment1.GetName() if self.segment1 else os.path.basename(self.segment1_path)
+		if segment2 is None:
+			segment2 = self.segment2.GetName() if self.segment2 else os.path.basename(self.segment2_path)
+		self.resultsStore.addMetrics(self.currentCaseId(), segment1, segment2, metrics, engine, parameters, self.software)
+
+	def exportResultsCSV(self, path, **filters):
+
+		# Stored results (optionally filtered, see ResultsStore.query) written to a CSV file
+		return self.resultsStore.exportCSV(path, **filters)
+
+	def benchmarkMetrics(self, segment1_path, segment2_path):
+
+		# Compare wall time and peak memory of the Dice + Hausdorff buttons with computeAllMetrics.
+		# Segments are loaded again before each run so that no representation is reused.
+		from MyModuleLib.ResourceUsage import PeakMemorySampler
+		results = {}
+		for runName in ['buttons', 'computeAllMetrics']:
+			self.segment1_path = segment1_path
+			self.segment2_path = segment2_path
+			self.loadSegments()
+			with PeakMemorySampler() as sampler:
+				if runName == 'buttons':
+					self.diceCoeff()
+					self.hausdorffDist()
+				else:
+					self.computeAllMetrics()
+			results[runName] = {'seconds': sampler.elapsedSeconds, 'peakMemoryMB': sampler.peakDelta / 1e6}
+			slicer.mrmlScene.RemoveNode(self.segment1)
+			slicer.mrmlScene.RemoveNode(self.segment2)
+		results['timeSaving'] = 1.0 - results['computeAllMetrics']['seconds'] / results['buttons']['seconds']
+		results['peakMemorySavingMB'] = results['buttons']['peakMemoryMB'] - results['computeAllMetrics']['peakMemoryMB']
+		return results
+
+	def computeDistanceMap(self):
 
 		# Get PolyData from Segment 1
-		self.segment1.CreateClosedSurfaceRepresentation();
-		ss1 = self.segment1.GetSegmentation();
-		str1 = ss1.GetNthSegmentID(0);
-		pl1 = vtk.vtkPolyData()
-		pl1 = self.segment1.GetClosedSurfaceRepresentation(str1)
-
-		# Get PolyData from Segment 2
-		self.segment2.CreateClosedSurfaceRepresentation();
-		ss2 = self.segment2.GetSegmentation();
-		str2 = ss2.GetNthSegmentID(0);
-		pl2 = vtk.vtkPolyData()
-		pl2 = self.segment2.GetClosedSurfaceRepresentation(str2)
+		pl1 = self.getSegmentPolyData(self.segment1)
+
+		# Get PolyData from Segment 2 (aligned)
+		pl2 = self.getAlignedSegment2PolyData()
 
 		# Compute distance
-		distanceFilter = vtk.vtkDistancePolyDataFilter()
-		distanceFilter.SetInputData(0, pl1)
-		distanceFilter.SetInputData(1, pl2)
-		distanceFilter.SignedDistanceOff()
-		distanceFilter.Update()
+		return self.computeDistancePolyData(pl1, pl2)
 
-		# Center 3D view
-		#slicer.app.layoutManager().tableWidget(0).setVisible(False)
-		layoutManager = slicer.app.layoutManager()
-		threeDWidget = layoutManager.threeDWidget(0)
-		threeDView = threeDWidget.threeDView()
-		threeDView.resetFocalPoint()
+	def computeDistancePolyData(self, sourcePolyData, targetPolyData, progressCallback=None):
+
+		from MyModuleLib import DistanceEngines
+		with self.profiler.span('distance', engine=self.distanceEngine, workers=self.distanceWorkers,
+			sourcePoints=sourcePolyData.GetNumberOfPoints(), targetCells=targetPolyData.GetNumberOfCells()):
+			return DistanceEngines.computeDistancePolyData(sourcePolyData, targetPolyData, self.distanceEngine, self.distanceWorkers, progressCallback)
 
-		# Output model
-		model = slicer.vtkMRMLModelNode()
-		slicer.mrmlScene.AddNode(model)
-		model.SetName('DistanceModelNode')
-		model.SetAndObservePolyData(distanceFilter.GetOutput())
-		self.distanceColorMap_display = slicer.vtkMRMLModelDisplayNode()
-		slicer.mrmlScene.AddNode(self.distanceColorMap_display)
-		model.SetAndObserveDisplayNodeID(self.distanceColorMap_display.GetID())
-		self.distanceColorMap_display.SetActiveScalarName('Distance')
-		self.distanceColorMap_display.SetAndObserveColorNodeID('vtkMRMLColorTableNodeFileDivergingBlueRed.txt')
-		self.distanceColorMap_display.SetScalarVisibility(True)
-		self.distanceColorMap_display.SetScalarRangeFlag(0) # Set scalar range mode to Manual
-		self.distanceColorMap_display.SetScalarRange(0.0,10.0) 
-
-		[rmin,rmax] = self.distanceColorMap_display.GetScalarRange()
-		print(rmin)
-		print(rmax)
-
-		# Scalar bar
-		self.updateScalarBarRange(0.0,10.0)
-		self.updateScalarBarVisibility(True)        
+	def showColorMap(self):
+
+		self.showColorMapTask().runSynchronously()
+
+	def showColorMapTask(self):
+
+		# Distances are computed in the background on copies of the surfaces
+		from MyModuleLib import DistanceStatistics, LevelOfDetail, Profiling
+		sourcePolyData = vtk.vtkPolyData()
+		sourcePolyData.DeepCopy(self.getSegmentPolyData(self.segment1))
+		targetPolyData = self.getAlignedSegment2PolyData(copy=True)
+
+		histogramBinWidthMm = self.distanceHistogramBinWidthMm
+		histogramBins = self.distanceHistogramBins
+		triangleBudget = self.colorMapTriangleBudget
+		levelOfDetail = self.colorMapLevelOfDetail and sourcePolyData.GetNumberOfPolys() > triangleBudget
+		progressive = levelOfDetail and self.colorMapProgressive
+		partialModelShown = []
+
+		def compute(task):
+			progressStart = 0.0
+			if progressive:
+				# Coarse preview: distances between both decimated surfaces
+				task.setProgress(0.0, 'Computing coarse color map...')
+				with self.profiler.span('colorMapDecimation', triangleBudget=triangleBudget, **Profiling.meshSize(sourcePolyData)):
+					coarseSourcePolyData = LevelOfDetail.decimateToBudget(sourcePolyData, triangleBudget)
+					coarseTargetPolyData = LevelOfDetail.decimateToBudget(targetPolyData, triangleBudget)
+				task.setPartialResult(self.computeDistancePolyData(coarseSourcePolyData, coarseTargetPolyData))
+				progressStart = 0.2
+			task.setProgress(progressStart, 'Computing distances...')
+			progressEnd = 0.9 if levelOfDetail and not progressive else 1.0
+
+			# Both directions, progress in proportion to the number of points
+			progressMiddle = progressStart + (progressEnd - progressStart) * sourcePolyData.GetNumberOfPoints() / float(
+				max(1, sourcePolyData.GetNumberOfPoints() + targetPolyData.GetNumberOfPoints()))
+			distancePolyData = self.computeDistancePolyData(sourcePolyData, targetPolyData,
+				lambda fraction: task.setProgress(progressStart + (progressMiddle - progressStart) * fraction))
+			task.setProgress(progressMiddle, 'Computing distances from segment 2...')
+			reverseDistancePolyData = self.computeDistancePolyData(targetPolyData, sourcePolyData,
+				lambda fraction: task.setProgress(progressMiddle + (progressEnd - progressMiddle) * fraction))
+			with self.profiler.span('distanceStatistics', points=sourcePolyData.GetNumberOfPoints() + targetPolyData.GetNumberOfPoints()):
+				statistics = DistanceStatistics.bidirectionalStatistics(distancePolyData, reverseDistancePolyData, histogramBinWidthMm, histogramBins)
+
+			displayPolyData = distancePolyData
+			if levelOfDetail and not progressive:
+				task.setProgress(progressEnd, 'Decimating color map...')
+				with self.profiler.span('colorMapDecimation', triangleBudget=triangleBudget, **Profiling.meshSize(distancePolyData)):
+					displayPolyData = LevelOfDetail.decimateDistancePolyData(distancePolyData, triangleBudget)
+			return distancePolyData, reverseDistancePolyData, displayPolyData, statistics
+
+		def applyPartial(coarsePolyData):
+			self.showDistanceModel(coarsePolyData)
+			partialModelShown.append(True)
+
+		def apply(result):
+			distancePolyData, reverseDistancePolyData, displayPolyData, statistics = result
+			self.distancePolyData = distancePolyData
+			self.reverseDistancePolyData = reverseDistancePolyData
+			self.distanceStatistics = statistics
+			self.disagreementRegions = None  # regions of the previous distances
+			if partialModelShown:
+				# The coarse preview is replaced in the same model node
+				with self.profiler.span('colorMapDisplay', **Profiling.meshSize(displayPolyData)):
+					self.distanceModel.SetAndObservePolyData(displayPolyData)
+			else:
+				self.showDistanceModel(displayPolyData)
+
+			# Statistics and histogram tables (3D Table View)
+			self.tableDistanceStatistics, self.tableDistanceHistogram = self.createDistanceStatisticsTables(statistics,
+				histogramBinWidthMm, histogramBins)
+			self.showTable(self.tableDistanceStatistics)
+
+			# Save results (full resolution distances)
+			self.storeResults({'distanceMaxMm': statistics['1->2']['maxMm'], 'distanceMeanMm': statistics['1->2']['meanMm'],
+				'hausdorffMaxMm': statistics['symmetric']['maxMm'], 'hausdorff95Mm': statistics['symmetric']['percentile95Mm'],
+				'hausdorffMeanMm': statistics['symmetric']['meanMm'], 'hausdorffRmsMm': statistics['symmetric']['rmsMm']},
+				'surfaceDistance', {'distanceEngine': self.distanceEngine, 'alignment': self.alignmentName})
+
+		return BackgroundTask('Color map', compute, apply, applyPartial)
+
+	def createDistanceStatisticsTables(self, statistics, histogramBinWidthMm, histogramBins):
+
+		# One row per direction (and both together), and one row per histogram bin
+		from MyModuleLib import DistanceStatistics
+		directions = [('1->2', 'Segment 1 to segment 2'), ('2->1', 'Segment 2 to segment 1'), ('symmetric', 'Both directions')]
+		statisticsTable = self.getOutputTableNode("Distance Statistics")
+		columnNames = ['Direction', 'maxMm', 'percentile95Mm', 'meanMm', 'rmsMm', 'count']
+		for columnName in columnNames:
+			statisticsTable.AddColumn().SetName(columnName)
+		for row, (direction, directionName) in enumerate(directions):
+			statisticsTable.AddEmptyRow()
+			statisticsTable.SetCellText(row, 0, directionName)
+			for column, columnName in enumerate(columnNames[1:], 1):
+				statisticsTable.SetCellText(row, column, str(statistics[direction][columnName]))
+
+		histogramTable = self.getOutputTableNode("Distance Histogram")
+		for columnName in ['binStartMm', 'binEndMm'] + [directionName for direction, directionName in directions]:
+			histogramTable.AddColumn().SetName(columnName)
+		edges = DistanceStatistics.histogramEdges(histogramBinWidthMm, histogramBins)
+		for row in range(histogramBins):
+			histogramTable.AddEmptyRow()
+			histogramTable.SetCellText(row, 0, '%g' % edges[row])
+			histogramTable.SetCellText(row, 1, '%g' % edges[row + 1] if row < histogramBins - 1 else 'inf')
+			for column, (direction, directionName) in enumerate(directions, 2):
+				histogramTable.SetCellText(row, column, str(int(statistics[direction]['histogramCounts'][row])))
+		return statisticsTable, histogramTable
+
+	def findDisagreementRegions(self):
+
+		return self.disagreementRegionsTask().runSynchronously()
+
+	def disagreementRegionsTask(self):
+
+		# Regions of the full-resolution distances from segment 1 to segment 2 (computed by the color map)
+		from MyModuleLib import DisagreementRegions, Profiling
+		if self.distancePolyData is None:
+			raise ValueError('No distance map: show the color map first')
+		distancePolyData = vtk.vtkPolyData()
+		distancePolyData.DeepCopy(self.distancePolyData)
+		thresholdMm = self.regionThresholdMm
+		minimumAreaMm2 = self.regionMinimumAreaMm2
+		order = self.regionOrder
+
+		def compute(task):
+			task.setProgress(0.0, 'Finding disagreement regions...')
+			with self.profiler.span('disagreementRegions', thresholdMm=thresholdMm, **Profiling.meshSize(distancePolyData)) as span:
+				regions = DisagreementRegions.findRegions(distancePolyData, thresholdMm, minimumAreaMm2, order)
+				span.setAttributes(regions=regions['numberOfRegions'])
+			return regions
+
+		def apply(regions):
+			self.disagreementRegions = regions
+			self.tableRegions = self.createRegionsTable("Disagreement Regions", regions)
+			self.showRegionMarkups(regions)
+			self.showTable(self.tableRegions)
+
+			# Save results (summary of the regions)
+			self.storeResults({'disagreementRegions': regions['numberOfRegions'], 'disagreementAreaMm2': float(regions['areaMm2'].sum()),
+				'largestRegionAreaMm2': float(regions['areaMm2'].max()) if regions['numberOfRegions'] else 0.0},
+				'disagreementRegions', {'thresholdMm': thresholdMm, 'minimumAreaMm2': minimumAreaMm2, 'alignment': self.alignmentName})
+			logging.info('%d disagreement regions at %.2f mm or more' % (regions['numberOfRegions'], thresholdMm))
+			return regions
+
+		return BackgroundTask('Disagreement regions', compute, apply)
+
+	def createRegionsTable(self, name, regions):
+
+		# One row per region, in the order of the regions
+		tableNode = self.getOutputTableNode(name)
+		columns = [('Region', None), ('areaMm2', regions['areaMm2']), ('maxMm', regions['maxMm']), ('meanMm', regions['meanMm']),
+			('vertices', regions['numberOfVertices'])]
+		columns += [('centroid' + axis, regions['centroid'][:, index]) for index, axis in enumerate('RAS')]
+		columns += [('max' + axis, regions['maxPoint'][:, index]) for index, axis in enumerate('RAS')]
+		for columnName, values in columns:
+			column = tableNode.AddColumn()
+			column.SetName(columnName)
+		for row in range(regions['numberOfRegions']):
+			tableNode.AddEmptyRow()
+			tableNode.SetCellText(row, 0, str(row + 1))
+			for column, (columnName, values) in enumerate(columns[1:]):
+				tableNode.SetCellText(row, column + 1, str(values[row]) if columnName == 'vertices' else '%.4f' % values[row])
+		return tableNode
+
+	def showRegionMarkups(self, regions):
+
+		# Point list at the maximum distance of the first regions (labelled by region number)
+		numberOfPoints = min(regions['numberOfRegions'], self.regionMarkupsMaximum)
+		markupsNode = self.getOutputNode('vtkMRMLMarkupsFiducialNode', 'Disagreement Regions')
+		markupsNode.RemoveAllControlPoints()
+		if numberOfPoints == 0:
+			return markupsNode
+		slicer.util.updateMarkupsControlPointsFromArray(markupsNode, regions['maxPoint'][:numberOfPoints])
+		for index in range(numberOfPoints):
+			markupsNode.SetNthControlPointLabel(index, 'R%d' % (index + 1))
+			markupsNode.SetNthControlPointLocked(index, True)
+		return markupsNode
+
+	def jumpToRegion(self, regionIndex):
+
+		# 3D view centered on the maximum distance of a region
+		if self.disagreementRegions is None or not 0 <= regionIndex < self.disagreementRegions['numberOfRegions']:
+			return
+		layoutManager = slicer.app.layoutManager()
+		if layoutManager is None:
+			return
+		viewNode = layoutManager.threeDWidget(0).mrmlViewNode()
+		cameraNode = slicer.modules.cameras.logic().GetViewActiveCameraNode(viewNode)
+		cameraNode.SetFocalPoint(*self.disagreementRegions['maxPoint'][regionIndex])
+
+	def showDistanceModel(self, distancePolyData):
+
+		from MyModuleLib import Profiling
+		with self.profiler.span('colorMapDisplay', **Profiling.meshSize(distancePolyData)):
+			# Center 3D view
+			#slicer.app.layoutManager().tableWidget(0).setVisible(False)
+			self.centerThreeDView()
+
+			# Output model (the model and display nodes of a previous color map are reused)
+			model = self.getOutputNode('vtkMRMLModelNode', 'DistanceModelNode')
+			model.SetAndObservePolyData(distancePolyData)
+			self.distanceModel = model
+			self.distanceColorMap_display = self.getOutputNode('vtkMRMLModelDisplayNode', 'DistanceModelNodeDisplay')
+			model.SetAndObserveDisplayNodeID(self.distanceColorMap_display.GetID())
+			self.distanceColorMap_display.SetActiveScalarName('Distance')
+			self.distanceColorMap_display.SetAndObserveColorNodeID(self.distanceColorNodeID)
+			self.distanceColorMap_display.SetScalarVisibility(True)
+			self.distanceColorMap_display.SetScalarRangeFlag(0) # Set scalar range mode to Manual
+			self.distanceColorMap_display.SetScalarRange(0.0,10.0) 
+
+			# Scalar bar (color table, labels and title are set once here, the sliders only change the range)
+			self.setupScalarBar()
+			self.updateScalarBarRange(0.0,10.0)
+			self.updateScalarBarVisibility(True)        
 
 		# Deactivate visibility of segments (deberia actualizarse el checkbox del GUI pero no lo consigo)
 		self.updateSegment1Visibility(False)
 		self.updateSegment2Visibility(False)
 
+	def compareCase(self, segment1_path, segment2_path):
+
+		# Run the whole comparison pipeline for one pair of segments (used by batch mode)
+		with self.profiler.span('compareCase', segment1=os.path.basename(segment1_path), segment2=os.path.basename(segment2_path)):
+			self.segment1_path = segment1_path
+			self.segment2_path = segment2_path
+			if not self.loadSegments():
+				raise IOError('Segments could not be loaded: ' + segment1_path + ', ' + segment2_path)
+			self.alignSegments()
+			metrics = self.computeAllMetrics()
+
+			# Distance map from segment 1 to segment 2
+			distancePolyData = self.computeDistanceMap()
+			distances = numpy_support.vtk_to_numpy(distancePolyData.GetPointData().GetArray('Distance'))
+
+			# Result row
+			row = dict(metrics)
+			row['distanceMeanMm'] = float(np.mean(distances))
+			row['distanceMaxMm'] = float(np.max(distances))
+			return row
+
+	#
+	# Review of a case list
+	#
+
+	def startReview(self, cases):
+
+		# Cases of a manifest path (see BatchComparison.readManifest) or a list of {'case', 'segment1',
+		# 'segment2'}, reviewed one at a time from the first one
+		from MyModuleLib import BatchComparison, ReviewQueue
+		if isinstance(cases, str):
+			cases = BatchComparison.readManifest(cases)
+		if not cases:
+			raise ValueError('The case list is empty')
+		self.stopReview()
+		self.reviewAlignmentMatrix = None
+		if self.alignmentMode == 'file':
+			# Read once in the main thread (it may need a transform node)
+			self.reviewAlignmentMatrix = self.readTransformFile(self.alignmentTransformPath)
+		self.reviewQueue = ReviewQueue.ReviewQueue(cases, self.prepareReviewCase)
+		self.reviewQueue.moveTo(0)
+
+	def stopReview(self):
+
+		# The case named by the review is forgotten with it
+		if self.reviewQueue is not None:
+			self.reviewQueue.close()
+			self.caseId = None
+		self.reviewQueue = None
+		self.reviewCaseShown = None
+
+	def prepareReviewCase(self, case, progressCallback):
+
+		# Runs on the worker thread of the review queue: no MRML node is created here
+		from MyModuleLib import LevelOfDetail, Profiling, ReviewQueue
+		with self.profiler.span('prepareReviewCase', case=case['case'], alignmentMode=self.alignmentMode) as span:
+			prepared = ReviewQueue.prepareCase(case, progressCallback, self.alignmentMode, self.distanceEngine, self.distanceWorkers,
+				self.maskVoxelSizeMm, self.meshCache, self.alignmentSeed, self.alignmentTransformPath, self.readSurfaceFile,
+				self.distanceHistogramBinWidthMm, self.distanceHistogramBins, self.reviewAlignmentMatrix)
+			prepared['displayPolyData'] = prepared['distancePolyData']
+			if self.colorMapLevelOfDetail and prepared['distancePolyData'].GetNumberOfPolys() > self.colorMapTriangleBudget:
+				prepared['displayPolyData'] = LevelOfDetail.decimateDistancePolyData(prepared['distancePolyData'], self.colorMapTriangleBudget)
+			span.setAttributes(**Profiling.meshSize(prepared['polyData1']))
+		return prepared
+
+	def readSurfaceFile(self, path):
+
+		# Closed surface of a segment file without MRML (it can be called from a worker thread), taken
+		# from the mesh cache when the file was already read
+		from MyModuleLib import Core
+		cacheKey = None
+		if self.meshCache is not None and os.path.isfile(path):
+			cacheKey = self.meshCache.fileKey(path, 'closedSurface')
+			polyData = self.meshCache.getPolyData(cacheKey)
+			if polyData is not None:
+				return polyData
+		polyData = Core.readSurface(path)
+		if cacheKey is not None:
+			self.meshCache.putPolyData(cacheKey, polyData)
+		return polyData
+
+	def updateReview(self):
+
+		# Called periodically from the main thread: collects the prepared cases, starts the next
+		# preparation and shows the current case once it is ready. Returns True when a case was shown.
+		if self.reviewQueue is None or not self.reviewQueue.poll() or self.reviewCaseShown == self.reviewQueue.index:
+			return False
+		self.reviewCaseShown = self.reviewQueue.index
+		self.showReviewCase(self.reviewQueue.currentCase())
+		return True
+
+	def reviewNext(self):
+
+		self.reviewQueue.next()
+		return self.updateReview()
+
+	def reviewPrevious(self):
+
+		self.reviewQueue.previous()
+		return self.updateReview()
+
+	def showReviewCase(self, prepared):
+
+		# The nodes of the previous case are released, then the prepared surfaces, alignment, distance
+		# map and metrics are added to the scene (nothing is computed here)
+		case = prepared['case']
+		with self.profiler.span('showReviewCase', case=case['case']):
+			self.clearCase()
+			self.segment1_path = case['segment1']
+			self.segment2_path = case['segment2']
+			self.caseId = case['case']
+			if prepared['error'] is not None:
+				logging.error('Case %s could not be prepared: %s' % (case['case'], prepared['error']))
+				return False
+
+			# Segments
+			self.segment1 = self.createSegmentationNode(prepared['polyData1'], os.path.splitext(os.path.basename(case['segment1']))[0])
+			self.segment2 = self.createSegmentationNode(prepared['polyData2'], os.path.splitext(os.path.basename(case['segment2']))[0])
+			for node, color in [(self.segment1, [1, 0, 0]), (self.segment2, [0, 1, 0])]:
+				node.GetDisplayNode().SetColor(color)
+
+			# Alignment of segment 2
+			mode = prepared['alignmentMode']
+			self.alignmentMode = mode
+			self.alignmentResult = prepared['registrationResult']
+			details = {}
+			if mode == 'automatic':
+				details = {'rmsResidualMm': self.alignmentResult['rmsResidual'], 'iterations': self.alignmentResult['iterations']}
+			elif mode == 'file':
+				details = {'path': self.alignmentTransformPath}
+			self.alignmentCandidates.add(mode, prepared['matrix'], mode, **details)
+			self.applyAlignment(mode)
+
+			# Color map and distance statistics
+			self.distancePolyData = prepared['distancePolyData']
+			self.reverseDistancePolyData = prepared['reverseDistancePolyData']
+			self.distanceStatistics = prepared['statistics']
+			self.showDistanceModel(prepared['displayPolyData'])
+			self.tableDistanceStatistics, self.tableDistanceHistogram = self.createDistanceStatisticsTables(self.distanceStatistics,
+				self.distanceHistogramBinWidthMm, self.distanceHistogramBins)
+
+			# Metrics table (3D Table View)
+			self.tableM = self.createMetricsTable("Review Metrics", prepared['metrics'])
+			self.showTable(self.tableM)
+
+			# Save results
+			self.storeResults(prepared['metrics'], 'review', {'alignment': self.alignmentName, 'distanceEngine': self.distanceEngine,
+				'voxelSizeMm': prepared['metrics']['voxelSizeMm']})
+		logging.info('Case %s (%d/%d)' % (case['case'], self.reviewQueue.index + 1, len(self.reviewQueue)))
+		return True
+
 	def updateScalarBarVisibility(self, visibilityFlag):
 
-		colorWidget = slicer.modules.colors.widgetRepresentation()
-		ctkScalarBarWidget = slicer.util.findChildren(colorWidget, name='VTKScalarBar')[0]
-		ctkScalarBarWidget.setDisplay(visibilityFlag)
+		with self.profiler.span('scalarBarVisibility'):
+			self.setScalarBarVisibility(visibilityFlag)
 
+	def getScalarBarHandles(self):
 
-	def updateScalarBarRange(self, minVal, maxVal):
+		# Colors module widget, its color table selector and scalar bar widget, looked up once
+		if self.scalarBarHandles is None:
+			colorWidget = slicer.modules.colors.widgetRepresentation()
+			self.scalarBarHandles = {'colorWidget': colorWidget,
+				'colorTableSelector': slicer.util.findChildren(colorWidget, 'ColorTableComboBox')[0],
+				'scalarBar': slicer.util.findChildren(colorWidget, name='VTKScalarBar')[0]}
+		return self.scalarBarHandles
 
-		# Colors module widget
-		colorWidget = slicer.modules.colors.widgetRepresentation()
+	def setScalarBarVisibility(self, visibilityFlag):
 
-		# Select desired color table
-		activeColorNodeSelector = slicer.util.findChildren(colorWidget, 'ColorTableComboBox')[0]
-		divergentColorTable = slicer.util.getNode('DivergingBlueRed')
-		activeColorNodeSelector.setCurrentNodeID(divergentColorTable.GetID())
+		self.getScalarBarHandles()['scalarBar'].setDisplay(visibilityFlag)
 
-		# Set range
-		colorWidget.setLookupTableRange(minVal,maxVal)
+	def setupScalarBar(self):
+
+		handles = self.getScalarBarHandles()
 
-		# Scalar bar widget
-		ctkScalarBarWidget = slicer.util.findChildren(colorWidget, name='VTKScalarBar')[0]
+		# Select desired color table
+		handles['colorTableSelector'].setCurrentNodeID(self.distanceColorNodeID)
 
 		# Set number of labels
-		ctkScalarBarWidget.setNumberOfLabels(5)
+		handles['scalarBar'].setNumberOfLabels(5)
 
 		# Set title
-		ctkScalarBarWidget.setTitle('Distance (mm)  \n')
+		handles['scalarBar'].setTitle('Distance (mm)  \n')
 
+	def updateScalarBarRange(self, minVal, maxVal):
+
+		with self.profiler.span('scalarBarRange'):
+			self.setScalarBarRange(minVal, maxVal)
+
+	def setScalarBarRange(self, minVal, maxVal):
+
+		# The range applies to the color table selected in the Colors module (selected again if it was changed)
+		handles = self.getScalarBarHandles()
+		if handles['colorTableSelector'].currentNodeID != self.distanceColorNodeID:
+			self.setupScalarBar()
+
+		# Set range
+		handles['colorWidget'].setLookupTableRange(minVal,maxVal)
 
 	def updateDisplayedRangeColorMap(self, minVal, maxVal):
 
+		if self.distanceColorMap_display is None:
+			return
+
 		# Update visualization
 		self.distanceColorMap_display.SetScalarRange(minVal,maxVal) 
 
 		# Update scalar bar
 		self.updateScalarBarRange(minVal, maxVal)
 
+	def requestDisplayedRangeColorMap(self, minVal, maxVal):
 
+		# Applied by the next flushDisplayUpdates (only the last range requested before it)
+		self.displayUpdates.request('colorMapRange', minVal, maxVal)
 
+	def requestSegmentOpacity(self, segmentNumber, opacityValue):
+
+		self.displayUpdates.request('segment%dOpacity' % segmentNumber, opacityValue)
+
+	def flushDisplayUpdates(self):
+
+		with self.profiler.span('displayUpdates') as span:
+			span.setAttributes(updates=self.displayUpdates.flush())
+
+
+#
+# MyModule TEST: repeated comparisons of a case in the Slicer scene (run by CTest, see CMakeLists.txt;
+# the MyModuleLib computations are tested without Slicer in Testing/Python)
+#
 
+class MyModuleTest(ScriptedLoadableModuleTest):
+
+	def setUp(self):
+
+		slicer.mrmlScene.Clear(0)
+
+	def runTest(self):
+
+		self.setUp()
+		self.test_repeatedComparisons()
+
+	def test_repeatedComparisons(self):
+
+		# Loading, aligning and comparing the same case again and again (engines that do not need
+		# SlicerRT) keeps the number of scene nodes and the resident memory constant
+		import shutil
+		import tempfile
+		from MyModuleLib import SyntheticMeshes
+		from MyModuleLib.ResourceUsage import currentRSS
+
+		self.delayDisplay('Repeated comparisons')
+		logic = MyModuleLogic()
+		logic.meshCache = None
+		logic.resultsStore = None
+		logic.diceEngine = 'packedMask'
+		logic.maskVoxelSizeMm = 1.0
+		logic.hausdorffMode = 'exact'
+		colorMap = slicer.app.layoutManager() is not None
+		directory = tempfile.mkdtemp(prefix='MyModuleTest')
+		numberOfRuns, warmupRuns, window = 100, 5, 10
+		sceneNodes = []
+		rssMB = []
+		try:
+			for segmentNumber, (radius, center) in enumerate([(20.0, (0.0, 0.0, 0.0)), (19.0, (1.0, 0.0, 0.0))], 1):
+				writer = vtk.vtkSTLWriter()
+				writer.SetInputData(SyntheticMeshes.sphere(radius, center, 20000))
+				writer.SetFileName(os.path.join(directory, 'segment%d.stl' % segmentNumber))
+				writer.SetFileTypeToBinary()
+				writer.Write()
+			for run in range(numberOfRuns):
+				logic.segment1_path = os.path.join(directory, 'segment1.stl')
+				logic.segment2_path = os.path.join(directory, 'segment2.stl')
+				self.assertTrue(logic.loadSegments())
+				logic.alignSegments()
+				logic.diceCoeff()
+				logic.hausdorffDist()
+				if colorMap:
+					logic.showColorMap()
+				slicer.app.processEvents()
+				sceneNodes.append(slicer.mrmlScene.GetNumberOfNodes())
+				rssMB.append(currentRSS() / 1e6)
+			logic.clearCase()
+		finally:
+			shutil.rmtree(directory, ignore_errors=True)
+
+		self.assertEqual(sceneNodes[-1], sceneNodes[warmupRuns])
+		memoryGrowthMB = np.median(rssMB[-window:]) - np.median(rssMB[warmupRuns:warmupRuns + window])
+		self.assertLessEqual(memoryGrowthMB, 20.0)
+		self.delayDisplay('Scene nodes constant, memory growth %.1f MB over %d runs' % (memoryGrowthMB, numberOfRuns))
@@ -0,0 +1,177 @@
+#
+# MyModuleLib: alignments of segment 2 kept as 4x4 matrices and applied on the fly
+#
+# An alignment is the 4x4 matrix that maps the RAS coordinates of segment 2 onto segment 1 (the
+# 'to parent' matrix of a Slicer transform). The surfaces themselves are never modified:
+#   - transformedPolyData gives a surface that shares the cells (and point data) of the original one,
+#     with only its point coordinates transformed (one vectorized product)
+#   - AlignmentEvaluator measures distances without any transformed surface: distances from segment 2
+#     are those of its transformed points to segment 1, and for rigid matrices the distances from
+#     segment 1 are those of its points moved by the inverse matrix to the original segment 2. The
+#     distance engines of both surfaces are built once and reused by every candidate.
+# AlignmentCandidates keeps several alignments of a case (fixed rotation, transform file, automatic
+# registration) so that they can be compared and selected without loading the segments again.
+#
+# Transform files are ITK files (.h5 with h5py, see Backends.py), converted from the LPS resampling
+# convention of ITK to the RAS 'to parent' convention of Slicer.
+#
+
+import os
+import collections
+
+import numpy as np
+from vtkmodules.vtkCommonCore import vtkPoints
+from vtkmodules.vtkCommonDataModel import vtkPolyData
+from vtkmodules.util import numpy_support
+
+from MyModuleLib import Backends
+from MyModuleLib import DistanceEngines
+from MyModuleLib import DistanceStatistics
+from MyModuleLib import Labelmaps
+from MyModuleLib import PackedMasks
+from MyModuleLib.Registration import transformPoints
+
+LPS_TO_RAS = np.diag([-1.0, -1.0, 1.0, 1.0])
+
+# Transform file of the 'file' alignment mode
+DEFAULT_TRANSFORM_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Data', 'transform.h5')
+
+# 'fixed' alignment of the module: rotation of 180 degrees around Z
+FIXED_ALIGNMENT = np.diag([-1.0, -1.0, 1.0, 1.0])
+
+def isIdentity(matrix):
+
+	return matrix is None or np.allclose(matrix, np.eye(4))
+
+def isRigid(matrix, tolerance=1e-6):
+
+	# Rotation and translation only (distances are preserved)
+	rotation = np.asarray(matrix)[:3, :3]
+	return np.allclose(rotation.T.dot(rotation), np.eye(3), atol=tolerance) and abs(np.linalg.det(rotation) - 1.0) < tolerance
+
+def transformedPolyData(polyData, matrix):
+
+	# Surface sharing the cells and point data of polyData, with transformed point coordinates (of the
+	# type of the original points)
+	if isIdentity(matrix):
+		return polyData
+	originalPoints = DistanceEngines.polyDataPoints(polyData)
+	transformedPoints = transformPoints(np.asarray(matrix, dtype=np.float64), originalPoints).astype(originalPoints.dtype, copy=False)
+	points = vtkPoints()
+	points.SetData(numpy_support.numpy_to_vtk(transformedPoints, deep=0))
+	transformed = vtkPolyData()
+	transformed.ShallowCopy(polyData)
+	transformed.SetPoints(points)
+	return transformed
+
+def matrixFromITKParameters(parameters, fixedParameters):
+
+	# ITK affine transform (matrix and translation of LPS points of the fixed image to the moving
+	# image, around a center) as the RAS matrix moving segment 2 onto segment 1
+	parameters = np.asarray(parameters, dtype=np.float64)
+	center = np.asarray(fixedParameters, dtype=np.float64)[:3]
+	fromParent = np.eye(4)
+	fromParent[:3, :3] = parameters[:9].reshape(3, 3)
+	fromParent[:3, 3] = parameters[9:12] + center - fromParent[:3, :3].dot(center)
+	return np.linalg.inv(LPS_TO_RAS.dot(fromParent).dot(LPS_TO_RAS))
+
+def readITKTransform(path):
+
+	# First linear transform of an ITK .h5 transform file
+	h5py = Backends.h5pyModule()
+	if h5py is None:
+		raise ImportError('h5py is required to read ' + path)
+	with h5py.File(path, 'r') as transformFile:
+		for name in sorted(transformFile['TransformGroup'].keys(), key=int):
+			group = transformFile['TransformGroup'][name]
+			transformType = group['TransformType'][0]
+			transformType = transformType.decode() if isinstance(transformType, bytes) else str(transformType)
+			if transformType.startswith('CompositeTransform'):
+				continue
+			if not (transformType.startswith('AffineTransform') or transformType.startswith('MatrixOffsetTransformBase')):
+				raise ValueError('Unsupported transform type in %s: %s' % (path, transformType))
+			return matrixFromITKParameters(group['TranformParameters'][()], group['TranformFixedParameters'][()])
+	raise ValueError('No transform in ' + path)
+
+class AlignmentCandidates(object):
+
+	# Alignments of the current case by name, in the order they were added. Adding an alignment with
+	# an existing name replaces it (its metrics are computed again).
+
+	def __init__(self):
+
+		self.candidates = collections.OrderedDict()
+
+	def add(self, name, matrix, source, **details):
+
+		self.candidates[name] = {'name': name, 'matrix': np.array(matrix, dtype=np.float64), 'source': source, 'details': details, 'metrics': None}
+		return self.candidates[name]
+
+	def get(self, name):
+
+		return self.candidates[name]
+
+	def names(self):
+
+		return list(self.candidates.keys())
+
+	def setMetrics(self, name, metrics):
+
+		self.candidates[name]['metrics'] = metrics
+
+	def clear(self):
+
+		self.candidates.clear()
+
+	def __len__(self):
+
+		return len(self.candidates)
+
+	def __contains__(self, name):
+
+		return name in self.candidates
+
+class AlignmentEvaluator(object):
+
+	# Metrics of segment 2 aligned by different matrices onto segment 1, from the original surfaces
+
+	def __init__(self, polyData1, polyData2, engineName='auto', voxelSizeMm=Labelmaps.DEFAULT_VOXEL_SIZE_MM, cache=None):
+
+		self.polyData1 = polyData1
+		self.polyData2 = polyData2
+		self.engineName = 'auto' if engineName == 'filter' else engineName
+		self.voxelSizeMm = voxelSizeMm
+		self.cache = cache
+		self.engines = {}
+
+	def engine(self, index):
+
+		# Distance engine of the original surface 1 or 2, built on first use
+		if index not in self.engines:
+			engine = DistanceEngines.createDistanceEngine(self.engineName)
+			engine.setTarget(self.polyData1 if index == 1 else self.polyData2)
+			self.engines[index] = engine
+		return self.engines[index]
+
+	def distances(self, matrix):
+
+		# Distances from the vertices of segment 1 to aligned segment 2, and from aligned segment 2 to segment 1
+		points1 = DistanceEngines.polyDataPoints(self.polyData1)
+		points2 = DistanceEngines.polyDataPoints(self.polyData2)
+		distances21 = self.engine(1).computeDistances(transformPoints(matrix, points2))
+		if isRigid(matrix):
+			distances12 = self.engine(2).computeDistances(transformPoints(np.linalg.inv(matrix), points1))
+		else:
+			engine = DistanceEngines.createDistanceEngine(self.engineName)
+			engine.setTarget(transformedPolyData(self.polyData2, matrix))
+			distances12 = engine.computeDistances(points1)
+		return distances12, distances21
+
+	def evaluate(self, matrix):
+
+		distances12, distances21 = self.distances(matrix)
+		statistics = DistanceStatistics.distanceStatistics([distances12, distances21])
+		diceResult = PackedMasks.computeDice(self.polyData1, transformedPolyData(self.polyData2, matrix), self.voxelSizeMm, self.cache)
+		return {'dice': diceResult['dice'], 'hausdorffMaxMm': statistics['maxMm'], 'hausdorff95Mm': statistics['percentile95Mm'],
+			'hausdorffMeanMm': statistics['meanMm'], 'distanceMeanMm': float(distances12.mean()) if len(distances12) else float('nan'),
+			'distanceMaxMm': float(distances12.max()) if len(distances12) else float('nan')}
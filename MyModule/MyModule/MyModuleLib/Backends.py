@@ -0,0 +1,61 @@
+#
+# MyModuleLib: optional backends, discovered on first use
+#
+# SciPy (KD-trees for the kdtree distance engine, registration and exact Hausdorff, distance
+# transforms for the distanceTransform Hausdorff mode), h5py (ITK transform files) and SlicerRT
+# (SegmentComparison) are optional. They are looked up the first time a computation needs them, not
+# when MyModuleLib is imported, so that processes that do not use them do not pay for their import.
+# The result of each lookup is kept.
+#
+
+import threading
+
+_lock = threading.RLock()
+_backends = {}
+
+def discover(name, load):
+
+	# load() returns the backend, or raises ImportError (or AttributeError) when it is not available
+	with _lock:
+		if name not in _backends:
+			try:
+				_backends[name] = load()
+			except (ImportError, AttributeError):
+				_backends[name] = None
+		return _backends[name]
+
+def kdTreeClass():
+
+	# scipy.spatial.cKDTree, or None without SciPy
+	def load():
+		from scipy.spatial import cKDTree
+		return cKDTree
+	return discover('scipy', load)
+
+def distanceTransformFunction():
+
+	# scipy.ndimage.distance_transform_edt, or None without SciPy
+	def load():
+		from scipy.ndimage import distance_transform_edt
+		return distance_transform_edt
+	return discover('scipy.ndimage', load)
+
+def h5pyModule():
+
+	# h5py, or None when it is not installed
+	def load():
+		import h5py
+		return h5py
+	return discover('h5py', load)
+
+def segmentComparisonModule():
+
+	# SlicerRT SegmentComparison module, or None outside Slicer or without SlicerRT
+	def load():
+		import slicer
+		return slicer.modules.segmentcomparison
+	return discover('slicerRT', load)
+
+def availableBackends():
+
+	return {'scipy': kdTreeClass() is not None, 'h5py': h5pyModule() is not None, 'slicerRT': segmentComparisonModule() is not None}
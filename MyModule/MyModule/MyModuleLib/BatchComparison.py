@@ -0,0 +1,253 @@
+#
+# MyModule BATCH COMPARISON: run the comparison pipeline over a manifest of segment pairs
+#
+# Usage:
+#   PythonSlicer BatchComparison.py manifest.csv results.csv --slicer /path/to/Slicer [--workers N] [--database results.sqlite]
+#   python BatchComparison.py manifest.csv results.csv --backend core [--workers N]
+#
+# The manifest is a CSV file with the columns segment1, segment2 and (optionally) case.
+# Each case is computed by MyModuleLogic in a headless Slicer process, or with --backend core by
+# MyModuleLib/Core.py in worker processes of this Python, without Slicer (packed-mask Dice and
+# surface distances instead of SegmentComparison; --timeout is not applied). Result rows are
+# appended to the output CSV file as soon as each case finishes, and cases that are
+# already in the output file are skipped when the command is run again. With --database, the
+# metrics of each case are also added to a results store (see ResultsStore.py).
+#
+
+import os
+import sys
+import csv
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+
+BACKENDS = ['slicer', 'core']
+
+RESULT_FIELDS = ['case', 'segment1', 'segment2', 'status', 'error', 'elapsedSeconds',
+	'dice', 'referenceVolumeCc', 'compareVolumeCc',
+	'hausdorffMaxMm', 'hausdorff95Mm', 'hausdorffMeanMm',
+	'distanceMeanMm', 'distanceMaxMm', 'alignmentRmsMm', 'alignmentIterations']
+
+#
+# Manifest and results file
+#
+
+def caseIdFromPaths(segment1_path, segment2_path):
+
+	name1 = os.path.splitext(os.path.basename(segment1_path))[0]
+	name2 = os.path.splitext(os.path.basename(segment2_path))[0]
+	return name1 + '__' + name2
+
+def readManifest(manifestPath):
+
+	# Relative segment paths are relative to the manifest file
+	manifestDir = os.path.dirname(os.path.abspath(manifestPath))
+	cases = []
+	caseIds = set()
+	with open(manifestPath, newline='') as manifestFile:
+		for row in csv.DictReader(manifestFile):
+			segment1_path = os.path.join(manifestDir, row['segment1'].strip())
+			segment2_path = os.path.join(manifestDir, row['segment2'].strip())
+			caseId = (row.get('case') or '').strip() or caseIdFromPaths(segment1_path, segment2_path)
+			if caseId in caseIds:
+				raise ValueError('Duplicated case in manifest: ' + caseId)
+			caseIds.add(caseId)
+			cases.append({'case': caseId, 'segment1': segment1_path, 'segment2': segment2_path})
+	return cases
+
+def readCompletedCases(resultsPath, retryFailed=False):
+
+	# Cases already in the results file (only successful ones if failed cases are retried)
+	completed = set()
+	if not os.path.exists(resultsPath):
+		return completed
+	with open(resultsPath, newline='') as resultsFile:
+		for row in csv.DictReader(resultsFile):
+			if retryFailed and row.get('status') != 'ok':
+				continue
+			completed.add(row['case'])
+	return completed
+
+class ResultsWriter(object):
+
+	def __init__(self, resultsPath):
+
+		writeHeader = not os.path.exists(resultsPath) or os.path.getsize(resultsPath) == 0
+		self.resultsFile = open(resultsPath, 'a', newline='')
+		self.writer = csv.DictWriter(self.resultsFile, fieldnames=RESULT_FIELDS, extrasaction='ignore')
+		self.lock = threading.Lock()
+		if writeHeader:
+			self.writer.writeheader()
+			self.resultsFile.flush()
+
+	def writeRow(self, row):
+
+		# Rows are flushed one by one so that an interrupted run can be resumed
+		with self.lock:
+			self.writer.writerow(row)
+			self.resultsFile.flush()
+
+	def close(self):
+
+		self.resultsFile.close()
+
+#
+# Case processing
+#
+
+def runCaseInSlicer(slicerExecutable, case, timeout=None, alignmentMode='fixed'):
+
+	workDir = tempfile.mkdtemp(prefix='MyModuleBatch_')
+	resultPath = os.path.join(workDir, 'result.json')
+	logPath = os.path.join(workDir, 'slicer.log')
+	command = [slicerExecutable, '--no-splash', '--no-main-window', '--disable-cli-modules',
+		'--python-script', os.path.abspath(__file__), '--',
+		'--worker', case['segment1'], case['segment2'], resultPath, '--alignment', alignmentMode]
+
+	row = dict(case)
+	startTime = time.time()
+	try:
+		# Each case runs in its own working directory, so files written by the logic do not collide
+		with open(logPath, 'w') as logFile:
+			subprocess.run(command, cwd=workDir, stdout=logFile, stderr=subprocess.STDOUT, timeout=timeout)
+		if os.path.exists(resultPath):
+			with open(resultPath) as resultFile:
+				row.update(json.load(resultFile))
+		else:
+			with open(logPath) as logFile:
+				lastLines = logFile.read().strip().splitlines()[-5:]
+			row.update({'status': 'failed', 'error': 'No result written by Slicer: ' + ' | '.join(lastLines)})
+	except subprocess.TimeoutExpired:
+		row.update({'status': 'failed', 'error': 'Timeout after %d s' % timeout})
+	except OSError as e:
+		row.update({'status': 'failed', 'error': 'Slicer could not be started: ' + repr(e)})
+	finally:
+		shutil.rmtree(workDir, ignore_errors=True)
+	row['elapsedSeconds'] = round(time.time() - startTime, 2)
+	return row
+
+def runCaseWithCore(case, alignmentMode='fixed'):
+
+	# Executed in a worker process of the batch: no Slicer, Qt or MRML
+	addModuleDirToPath()
+	row = dict(case)
+	startTime = time.time()
+	try:
+		from MyModuleLib import Core
+		row.update(Core.compareFiles(case['segment1'], case['segment2'], alignmentMode))
+		row['status'] = 'ok'
+	except Exception as e:
+		row.update({'status': 'failed', 'error': repr(e)})
+	row['elapsedSeconds'] = round(time.time() - startTime, 2)
+	return row
+
+def addModuleDirToPath():
+
+	# This file is run as a script: MyModule and MyModuleLib are imported from the module directory
+	moduleDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+	if moduleDir not in sys.path:
+		sys.path.insert(0, moduleDir)
+
+def runWorker(segment1_path, segment2_path, resultPath, alignmentMode='fixed'):
+
+	# Executed inside Slicer: compute one case and write the result row as JSON
+	addModuleDirToPath()
+	try:
+		from MyModule import MyModuleLogic
+		logic = MyModuleLogic()
+		logic.alignmentMode = alignmentMode
+		logic.resultsStore = None  # results are stored by the batch process only
+		result = logic.compareCase(segment1_path, segment2_path)
+		if logic.alignmentResult:
+			result['alignmentRmsMm'] = logic.alignmentResult['rmsResidual']
+			result['alignmentIterations'] = logic.alignmentResult['iterations']
+		result['status'] = 'ok'
+	except Exception as e:
+		result = {'status': 'failed', 'error': repr(e)}
+	with open(resultPath, 'w') as resultFile:
+		json.dump(result, resultFile)
+
+def storeRow(store, row, alignmentMode, software=''):
+
+	# Numeric metrics of a successful case
+	metrics = {field: row[field] for field in RESULT_FIELDS[RESULT_FIELDS.index('elapsedSeconds') + 1:] if row.get(field) is not None}
+	return store.addMetrics(row['case'], os.path.basename(row['segment1']), os.path.basename(row['segment2']), metrics,
+		'batch', {'alignmentMode': alignmentMode}, software)
+
+def runBatch(manifestPath, resultsPath, slicerExecutable, numberOfWorkers=None, retryFailed=False, timeout=None, alignmentMode='fixed',
+	databasePath=None, software='', backend='slicer'):
+
+	cases = readManifest(manifestPath)
+	completed = readCompletedCases(resultsPath, retryFailed)
+	pendingCases = [case for case in cases if case['case'] not in completed]
+	print('%d cases in manifest, %d already done, %d to compute' % (len(cases), len(cases) - len(pendingCases), len(pendingCases)))
+	if not pendingCases:
+		return 0
+
+	# Workers run in their own directory, so a relative executable path must be resolved here
+	if os.path.dirname(slicerExecutable):
+		slicerExecutable = os.path.abspath(slicerExecutable)
+	numberOfWorkers = numberOfWorkers or os.cpu_count() or 1
+	numberOfFailures = 0
+	store = None
+	if databasePath:
+		addModuleDirToPath()
+		from MyModuleLib.ResultsStore import ResultsStore
+		store = ResultsStore(databasePath)
+	writer = ResultsWriter(resultsPath)
+	try:
+		if backend == 'core':
+			executor = ProcessPoolExecutor(max_workers=numberOfWorkers)
+		else:
+			executor = ThreadPoolExecutor(max_workers=numberOfWorkers)
+		with executor:
+			if backend == 'core':
+				futures = [executor.submit(runCaseWithCore, case, alignmentMode) for case in pendingCases]
+			else:
+				futures = [executor.submit(runCaseInSlicer, slicerExecutable, case, timeout, alignmentMode) for case in pendingCases]
+			for index, future in enumerate(as_completed(futures)):
+				row = future.result()
+				writer.writeRow(row)
+				if row['status'] != 'ok':
+					numberOfFailures += 1
+				elif store is not None:
+					storeRow(store, row, alignmentMode, software)
+				print('[%d/%d] %s: %s (%.1f s)' % (index + 1, len(pendingCases), row['case'], row['status'], row['elapsedSeconds']))
+	finally:
+		writer.close()
+		if store is not None:
+			store.close()
+	return numberOfFailures
+
+def main(argv):
+
+	parser = argparse.ArgumentParser(description='Compare pairs of segments listed in a manifest file.')
+	parser.add_argument('--worker', nargs=3, metavar=('SEGMENT1', 'SEGMENT2', 'RESULT'), help=argparse.SUPPRESS)
+	parser.add_argument('manifest', nargs='?', help='CSV file with columns segment1, segment2 and optionally case')
+	parser.add_argument('results', nargs='?', help='CSV file where result rows are appended')
+	parser.add_argument('--slicer', default=os.environ.get('SLICER_EXECUTABLE', 'Slicer'), help='Slicer executable (with SlicerRT installed)')
+	parser.add_argument('--backend', choices=BACKENDS, default='slicer', help='compute cases in Slicer or with MyModuleLib/Core.py without Slicer')
+	parser.add_argument('--workers', type=int, default=None, help='number of cases computed in parallel (default: number of cores)')
+	parser.add_argument('--timeout', type=float, default=None, help='maximum time per case in seconds')
+	parser.add_argument('--retry-failed', action='store_true', help='compute again cases that failed in a previous run')
+	parser.add_argument('--alignment', choices=['fixed', 'automatic', 'file'], default='fixed', help='alignment of segment 2 onto segment 1')
+	parser.add_argument('--database', default=None, help='SQLite results store where the metrics of each case are also added')
+	parser.add_argument('--software', default='', help='software that created the segment 2 files (stored in the database)')
+	args = parser.parse_args(argv)
+
+	if args.worker:
+		runWorker(*args.worker, alignmentMode=args.alignment)
+		return 0
+	if not args.manifest or not args.results:
+		parser.error('manifest and results files are required')
+	numberOfFailures = runBatch(args.manifest, args.results, args.slicer, args.workers, args.retry_failed, args.timeout, args.alignment,
+		args.database, args.software, args.backend)
+	return 1 if numberOfFailures else 0
+
+if __name__ == '__main__':
+	sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,83 @@
+#
+# MyModuleLib: all-pairs comparison of segments (N x M matrices)
+#
+# Every segment is prepared once: its binary mask on a grid shared by all segments, and a distance
+# engine (cell locator) built on its surface. Every pair then only costs a mask intersection on the
+# overlap of both bounding boxes and two distance queries with already built locators.
+#
+#   - dice:             Dice coefficient of the masks
+#   - hausdorffMaxMm:   symmetric Hausdorff distance between the surfaces (vertices to surface)
+#   - hausdorff95Mm:    95th percentile of the distances of both surfaces to the other one
+#   - hausdorffMeanMm:  mean of the same distances
+#
+
+import numpy as np
+
+from MyModuleLib import DistanceEngines
+from MyModuleLib import Labelmaps
+from MyModuleLib import SurfaceHausdorff
+
+MATRIX_METRICS = ['dice', 'hausdorffMaxMm', 'hausdorff95Mm', 'hausdorffMeanMm']
+
+class PreparedSegment(object):
+
+	def __init__(self, name, polyData, grid, engineName):
+
+		self.name = name
+		self.polyData = polyData
+		self.points = DistanceEngines.polyDataPoints(polyData)
+		self.mask = Labelmaps.rasterizeSurface(polyData, grid)
+		self.engine = SurfaceHausdorff.createEngine(polyData, engineName)
+
+def prepareSegments(namedPolyData, grid, engineName='auto', progressCallback=None):
+
+	# namedPolyData: list of (name, closed surface). A surface appearing several times is prepared once.
+	prepared = {}
+	for index, (name, polyData) in enumerate(namedPolyData):
+		if id(polyData) not in prepared:
+			prepared[id(polyData)] = PreparedSegment(name, polyData, grid, engineName)
+		if progressCallback is not None:
+			progressCallback((index + 1) / float(len(namedPolyData)))
+	return prepared
+
+def compareSegments(segment1, segment2):
+
+	if segment1 is segment2:
+		return {'dice': 1.0, 'hausdorffMaxMm': 0.0, 'hausdorff95Mm': 0.0, 'hausdorffMeanMm': 0.0}
+	distances = np.concatenate([segment2.engine.computeDistances(segment1.points), segment1.engine.computeDistances(segment2.points)])
+	return {
+		'dice': Labelmaps.diceCoefficient(segment1.mask, segment2.mask),
+		'hausdorffMaxMm': float(distances.max()) if len(distances) else float('nan'),
+		'hausdorff95Mm': float(np.percentile(distances, 95)) if len(distances) else float('nan'),
+		'hausdorffMeanMm': float(distances.mean()) if len(distances) else float('nan')}
+
+def computeComparisonMatrix(rowSegments, columnSegments, voxelSizeMm=Labelmaps.DEFAULT_VOXEL_SIZE_MM, engineName='auto', progressCallback=None):
+
+	# rowSegments, columnSegments: lists of (name, closed surface); a surface object present in both lists
+	# is prepared only once. Returns the names, a (N, M) array per metric and the segment volumes.
+	allSegments = rowSegments + columnSegments
+	grid = Labelmaps.gridForSurfaces([polyData for name, polyData in allSegments], voxelSizeMm)
+
+	# Preparation: 40% of the progress
+	def preparationProgress(fraction):
+		if progressCallback is not None:
+			progressCallback(0.4 * fraction)
+	prepared = prepareSegments(allSegments, grid, engineName, preparationProgress)
+
+	matrices = {metric: np.zeros((len(rowSegments), len(columnSegments))) for metric in MATRIX_METRICS}
+	numberOfPairs = len(rowSegments) * len(columnSegments)
+	pairResults = {}  # all metrics are symmetric, so (a, b) and (b, a) are computed once
+	for row, (rowName, rowPolyData) in enumerate(rowSegments):
+		for column, (columnName, columnPolyData) in enumerate(columnSegments):
+			pairKey = tuple(sorted([id(rowPolyData), id(columnPolyData)]))
+			if pairKey not in pairResults:
+				pairResults[pairKey] = compareSegments(prepared[id(rowPolyData)], prepared[id(columnPolyData)])
+			result = pairResults[pairKey]
+			for metric in MATRIX_METRICS:
+				matrices[metric][row, column] = result[metric]
+			if progressCallback is not None:
+				progressCallback(0.4 + 0.6 * (row * len(columnSegments) + column + 1) / float(numberOfPairs))
+
+	return {'rowNames': [name for name, polyData in rowSegments], 'columnNames': [name for name, polyData in columnSegments],
+		'matrices': matrices, 'volumesCc': {segment.name: segment.mask.volumeCc for segment in prepared.values()},
+		'voxelSizeMm': voxelSizeMm}
@@ -0,0 +1,106 @@
+#
+# MyModuleLib: comparison of two surfaces without Qt, MRML or the Slicer application
+#
+# The functions below give the same metrics as MyModuleLogic.compareCase (packed masks for the Dice
+# coefficient, surface distances for the Hausdorff distances) and can be used from any Python with
+# NumPy and VTK, e.g. by batch workers:
+#
+#   from MyModuleLib import Core
+#   row = Core.compareFiles('reference.stl', 'compare.stl', alignmentMode='automatic')
+#
+# Importing this module only imports NumPy. The computation modules (and VTK through them) are
+# imported by the first call, and optional backends (SciPy, see Backends.py) when they are first
+# needed, so a process that imports MyModuleLib does not pay for what it does not use.
+#
+
+import os
+
+import numpy as np
+
+ALIGNMENT_MODES = ['none', 'fixed', 'automatic', 'file']
+
+def readSurface(path):
+
+	# Closed surface of an STL file, in RAS coordinates (as slicer.util.loadSegmentation)
+	from MyModuleLib import STLFiles
+	if not os.path.exists(path):
+		raise IOError('Segment file not found: ' + path)
+	return STLFiles.readSTLPolyData(path, 'RAS')
+
+def alignmentMatrix(fixedPolyData, movingPolyData, alignmentMode='fixed', seed=0, transformPath=None, progressCallback=None):
+
+	# 4x4 matrix moving the moving surface onto the fixed one, and the registration result (None
+	# unless automatic). See Alignments.py.
+	from MyModuleLib import Alignments, DistanceEngines, Registration
+	if alignmentMode not in ALIGNMENT_MODES:
+		raise ValueError('Unknown alignment mode: ' + str(alignmentMode))
+	if alignmentMode == 'none':
+		return np.eye(4), None
+	if alignmentMode == 'fixed':
+		return Alignments.FIXED_ALIGNMENT.copy(), None
+	if alignmentMode == 'file':
+		return Alignments.readITKTransform(transformPath or Alignments.DEFAULT_TRANSFORM_PATH), None
+	registrationResult = Registration.rigidRegistration(DistanceEngines.polyDataPoints(movingPolyData),
+		DistanceEngines.polyDataPoints(fixedPolyData), seed=seed, progressCallback=progressCallback)
+	return registrationResult['matrix'], registrationResult
+
+def alignSurfaces(fixedPolyData, movingPolyData, alignmentMode='fixed', seed=0, progressCallback=None, transformPath=None):
+
+	# Moving surface aligned onto the fixed surface (sharing the cells of the moving surface), 4x4
+	# matrix and registration result
+	from MyModuleLib import Alignments
+	matrix, registrationResult = alignmentMatrix(fixedPolyData, movingPolyData, alignmentMode, seed, transformPath, progressCallback)
+	return Alignments.transformedPolyData(movingPolyData, matrix), matrix, registrationResult
+
+def compareSurfaces(polyData1, polyData2, engineName='auto', numberOfWorkers=1, voxelSizeMm=None, cache=None, progressCallback=None):
+
+	# Overlap (packed masks) and surface distance metrics of two aligned surfaces
+	return compareSurfacesWithDistances(polyData1, polyData2, engineName, numberOfWorkers, voxelSizeMm, cache, progressCallback)['metrics']
+
+def compareSurfacesWithDistances(polyData1, polyData2, engineName='auto', numberOfWorkers=1, voxelSizeMm=None, cache=None, progressCallback=None,
+	histogramBinWidthMm=None, histogramBins=None):
+
+	# Metrics of compareSurfaces with the distance maps they come from (surface 1 to 2 and 2 to 1,
+	# 'Distance' point arrays) and their statistics (see DistanceStatistics.bidirectionalStatistics)
+	from MyModuleLib import DistanceEngines, DistanceStatistics, PackedMasks
+
+	def setProgress(fraction):
+		if progressCallback is not None:
+			progressCallback(fraction)
+
+	setProgress(0.0)
+	diceResult = PackedMasks.computeDice(polyData1, polyData2, voxelSizeMm, cache)
+	dice = diceResult['dice']
+	metrics = {'dice': dice, 'jaccard': dice / (2.0 - dice),
+		'referenceVolumeCc': diceResult['referenceVolumeCc'], 'compareVolumeCc': diceResult['compareVolumeCc'],
+		'voxelSizeMm': diceResult['voxelSizeMm'], 'estimatedDiceError': diceResult['estimatedDiceError']}
+
+	# Distances in both directions, progress in proportion to the number of points
+	setProgress(0.3)
+	fraction12 = polyData1.GetNumberOfPoints() / float(max(1, polyData1.GetNumberOfPoints() + polyData2.GetNumberOfPoints()))
+	distancePolyData12 = DistanceEngines.computeDistancePolyData(polyData1, polyData2, engineName, numberOfWorkers,
+		lambda fraction: setProgress(0.3 + 0.7 * fraction12 * fraction))
+	distancePolyData21 = DistanceEngines.computeDistancePolyData(polyData2, polyData1, engineName, numberOfWorkers,
+		lambda fraction: setProgress(0.3 + 0.7 * (fraction12 + (1.0 - fraction12) * fraction)))
+	statistics = DistanceStatistics.bidirectionalStatistics(distancePolyData12, distancePolyData21,
+		histogramBinWidthMm or DistanceStatistics.DEFAULT_HISTOGRAM_BIN_WIDTH_MM, histogramBins or DistanceStatistics.DEFAULT_HISTOGRAM_BINS)
+	metrics['hausdorffMaxMm'] = statistics['symmetric']['maxMm']
+	metrics['hausdorff95Mm'] = statistics['symmetric']['percentile95Mm']
+	metrics['hausdorffMeanMm'] = statistics['symmetric']['meanMm']
+	metrics['distanceMeanMm'] = statistics['1->2']['meanMm']
+	metrics['distanceMaxMm'] = statistics['1->2']['maxMm']
+	setProgress(1.0)
+	return {'metrics': metrics, 'distancePolyData': distancePolyData12, 'reverseDistancePolyData': distancePolyData21, 'statistics': statistics}
+
+def compareFiles(segment1_path, segment2_path, alignmentMode='fixed', engineName='auto', numberOfWorkers=1, voxelSizeMm=None,
+	cache=None, seed=0, transformPath=None):
+
+	# Result row of one pair of STL files (the fields of BatchComparison.RESULT_FIELDS)
+	polyData1 = readSurface(segment1_path)
+	polyData2 = readSurface(segment2_path)
+	alignedPolyData2, matrix, registrationResult = alignSurfaces(polyData1, polyData2, alignmentMode, seed, transformPath=transformPath)
+	row = compareSurfaces(polyData1, alignedPolyData2, engineName, numberOfWorkers, voxelSizeMm, cache)
+	if registrationResult is not None:
+		row['alignmentRmsMm'] = registrationResult['rmsResidual']
+		row['alignmentIterations'] = registrationResult['iterations']
+	return row
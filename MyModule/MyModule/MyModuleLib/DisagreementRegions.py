@@ -0,0 +1,126 @@
+#
+# MyModuleLib: connected regions of a distance map where both surfaces disagree
+#
+# The vertices of a distance map (the 'Distance' point array of DistanceEngines.computeDistancePolyData)
+# at thresholdMm or more from the other surface are grouped into regions connected by the edges of
+# the mesh. Regions are found by a union-find over the edges whose two vertices are above the
+# threshold, run on all edges at once: every root is hooked to the smallest root of its edges, then
+# paths are compressed by pointer jumping, until no edge joins two roots (a few iterations, the
+# number grows with the logarithm of the region size).
+#
+# Each vertex carries a third of the area of its triangles. The area of a region is the area of its
+# vertices, its mean distance and centroid are weighted by these areas, and the maximum distance is
+# reported with the vertex where it is reached. All statistics are computed with bincount and sort
+# operations on the vertex arrays, without loops over vertices or regions.
+#
+#   regions = findRegions(distancePolyData, thresholdMm=2.0)
+#   regions['areaMm2'][0], regions['centroid'][0]   # largest region first
+#
+
+import numpy as np
+
+from MyModuleLib import DistanceEngines
+from MyModuleLib import DistanceStatistics
+
+DEFAULT_THRESHOLD_MM = 2.0
+
+# Regions smaller than this area are not reported (isolated vertices of noisy surfaces)
+DEFAULT_MINIMUM_AREA_MM2 = 0.0
+
+# Region orders of the table
+REGION_ORDERS = ['areaMm2', 'maxMm', 'meanMm']
+
+def vertexAreas(points, triangles):
+
+	# A third of the area of the triangles of each vertex (mm2)
+	a = points[triangles[:, 0]].astype(np.float64)
+	normals = np.cross(points[triangles[:, 1]] - a, points[triangles[:, 2]] - a)
+	thirdAreas = np.sqrt(np.einsum('ij,ij->i', normals, normals)) / 6.0
+	areas = np.zeros(len(points))
+	for corner in range(3):
+		areas += np.bincount(triangles[:, corner], weights=thirdAreas, minlength=len(points))
+	return areas
+
+def connectedComponents(numberOfVertices, edges):
+
+	# Root (smallest vertex index) of the component of every vertex, for (numberOfEdges, 2) edges
+	parent = np.arange(numberOfVertices, dtype=edges.dtype)
+	first, second = edges[:, 0], edges[:, 1]
+	while len(first):
+		firstRoots = parent[first]
+		secondRoots = parent[second]
+		joining = firstRoots != secondRoots
+		if not joining.any():
+			break
+		# Edges within a tree are dropped. The larger root is hooked onto the smaller one (when a root
+		# has several edges one of them wins, the others are joined at the next iteration).
+		first, second, firstRoots, secondRoots = first[joining], second[joining], firstRoots[joining], secondRoots[joining]
+		parent[np.maximum(firstRoots, secondRoots)] = np.minimum(firstRoots, secondRoots)
+		# Pointer jumping until every vertex points to its root
+		while True:
+			grandparent = parent[parent]
+			if not (grandparent != parent).any():
+				break
+			parent = grandparent
+	return parent
+
+def findRegions(distancePolyData, thresholdMm=DEFAULT_THRESHOLD_MM, minimumAreaMm2=DEFAULT_MINIMUM_AREA_MM2, orderBy='areaMm2',
+	arrayName='Distance'):
+
+	# Regions sorted by decreasing orderBy, as arrays with one value per region, and the region
+	# index of every vertex (-1 below the threshold or in a region that is not reported)
+	if orderBy not in REGION_ORDERS:
+		raise ValueError('Unknown region order: ' + str(orderBy))
+	points = DistanceEngines.polyDataPoints(distancePolyData)
+	triangles = DistanceEngines.polyDataTriangles(distancePolyData)
+	distances = DistanceStatistics.distanceArray(distancePolyData, arrayName)
+	above = distances >= thresholdMm
+	vertexLabels = np.full(len(points), -1, dtype=np.int64)
+	selected = np.flatnonzero(above)
+	if len(selected) == 0:
+		return emptyRegions(vertexLabels, thresholdMm)
+
+	# Edges of the triangles between two vertices above the threshold, in the indices of the selected vertices
+	local = np.full(len(points), -1, dtype=np.int32 if len(points) < 2**31 else np.int64)
+	local[selected] = np.arange(len(selected))
+	touching = above[triangles]
+	touchingAny = touching.any(axis=1)
+	triangles = triangles[touchingAny]
+	touching = touching[touchingAny]
+	edges = np.concatenate([local[triangles[touching[:, start] & touching[:, end]][:, [start, end]]]
+		for start, end in [(0, 1), (1, 2), (2, 0)]])
+	roots = connectedComponents(len(selected), edges)
+
+	# Statistics per component
+	componentRoots, components = np.unique(roots, return_inverse=True)
+	numberOfComponents = len(componentRoots)
+	areas = vertexAreas(points, triangles)[selected]
+	selectedDistances = distances[selected].astype(np.float64)
+	areaMm2 = np.bincount(components, weights=areas, minlength=numberOfComponents)
+	weights = np.where(areaMm2 > 0, areaMm2, 1.0)
+	meanMm = np.bincount(components, weights=areas * selectedDistances, minlength=numberOfComponents) / weights
+	centroid = np.stack([np.bincount(components, weights=areas * points[selected, axis], minlength=numberOfComponents) / weights
+		for axis in range(3)], axis=1)
+	# Vertex of maximum distance: last vertex of each component in the order (component, distance)
+	order = np.lexsort((selectedDistances, components))
+	last = np.flatnonzero(np.append(components[order][1:] != components[order][:-1], True))
+	maxVertices = selected[order[last]]
+	maxMm = selectedDistances[order[last]]
+	numberOfVertices = np.bincount(components, minlength=numberOfComponents)
+
+	# Reported regions, by decreasing order value
+	values = {'areaMm2': areaMm2, 'maxMm': maxMm, 'meanMm': meanMm}[orderBy]
+	reported = np.flatnonzero(areaMm2 >= minimumAreaMm2)
+	reported = reported[np.argsort(-values[reported], kind='stable')]
+	regionIndices = np.full(numberOfComponents, -1, dtype=np.int64)
+	regionIndices[reported] = np.arange(len(reported))
+	vertexLabels[selected] = regionIndices[components]
+	return {'thresholdMm': float(thresholdMm), 'numberOfRegions': len(reported), 'areaMm2': areaMm2[reported], 'maxMm': maxMm[reported],
+		'meanMm': meanMm[reported], 'centroid': centroid[reported], 'maxPoint': points[maxVertices[reported]].astype(np.float64),
+		'maxVertex': maxVertices[reported], 'numberOfVertices': numberOfVertices[reported], 'vertexLabels': vertexLabels}
+
+def emptyRegions(vertexLabels, thresholdMm):
+
+	return {'thresholdMm': float(thresholdMm), 'numberOfRegions': 0, 'areaMm2': np.zeros(0), 'maxMm': np.zeros(0), 'meanMm': np.zeros(0),
+		'centroid': np.zeros((0, 3)), 'maxPoint': np.zeros((0, 3)), 'maxVertex': np.zeros(0, dtype=np.int64),
+		'numberOfVertices': np.zeros(0, dtype=np.int64), 'vertexLabels': vertexLabels}
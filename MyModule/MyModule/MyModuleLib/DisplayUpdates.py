@@ -0,0 +1,120 @@
+#
+# MyModuleLib: coalesced display updates for interactive controls
+#
+# Sliders emit one signal per pixel of mouse movement, much faster than a large model can be
+# rendered. A DisplayUpdates object keeps only the latest value of each kind of update (color map
+# range, opacity of a segment...) until the owner flushes them, at most once per frame (for instance
+# from a single-shot QTimer started by the first request):
+#
+#   updates.setHandler('range', logic.setDisplayedRange)
+#   updates.request('range', minimum, maximum)   # on every slider tick
+#   updates.flush()                              # on the timer, applies the last range only
+#
+# It counts the requests, the updates actually applied and the coalesced ones, and measures the
+# latency from the first request of an update to the end of its application, so that the
+# responsiveness of the sliders can be checked (statistics()).
+#
+
+import time
+import collections
+
+import numpy as np
+
+# Minimum time between two flushes (one frame at 60 Hz)
+FRAME_SECONDS = 1.0 / 60.0
+
+# Latencies kept for the statistics (the most recent ones)
+LATENCY_HISTORY = 1000
+
+class DisplayUpdates(object):
+
+	def __init__(self, clock=time.perf_counter):
+
+		self.clock = clock
+		self.handlers = {}
+		self.pending = collections.OrderedDict()  # name -> (arguments, time of the first request)
+		self.lastFlushTime = None
+		self.requests = 0
+		self.applied = 0
+		self.coalesced = 0
+		self.flushes = 0
+		self.errors = 0
+		self.latencies = collections.deque(maxlen=LATENCY_HISTORY)
+		self.applySeconds = collections.deque(maxlen=LATENCY_HISTORY)
+
+	def setHandler(self, name, handler):
+
+		self.handlers[name] = handler
+
+	def request(self, name, *arguments):
+
+		# Replaces the pending arguments of the update, keeping the time of its first request
+		if name not in self.handlers:
+			raise KeyError('No handler for display update ' + str(name))
+		self.requests += 1
+		if name in self.pending:
+			self.coalesced += 1
+			self.pending[name] = (arguments, self.pending[name][1])
+		else:
+			self.pending[name] = (arguments, self.clock())
+
+	def hasPending(self):
+
+		return len(self.pending) > 0
+
+	def secondsUntilNextFlush(self):
+
+		# Time the owner should wait before flushing, so that flushes are at least one frame apart
+		if self.lastFlushTime is None:
+			return 0.0
+		return max(0.0, FRAME_SECONDS - (self.clock() - self.lastFlushTime))
+
+	def flush(self):
+
+		# Applies the latest arguments of every pending update; returns the number of updates applied.
+		# A failing handler does not prevent the other updates (the first error is raised at the end).
+		pending = self.pending
+		self.pending = collections.OrderedDict()
+		firstError = None
+		for name, (arguments, firstRequestTime) in pending.items():
+			startTime = self.clock()
+			try:
+				self.handlers[name](*arguments)
+			except Exception as e:
+				self.errors += 1
+				firstError = firstError or e
+				continue
+			endTime = self.clock()
+			self.applied += 1
+			self.applySeconds.append(endTime - startTime)
+			self.latencies.append(endTime - firstRequestTime)
+		if pending:
+			self.flushes += 1
+			self.lastFlushTime = self.clock()
+		if firstError is not None:
+			raise firstError
+		return len(pending)
+
+	def discard(self):
+
+		# Pending updates are dropped (e.g. the displayed model was removed)
+		self.pending.clear()
+
+	def statistics(self):
+
+		# Counters and latencies (ms) of the updates applied so far
+		latencies = np.array(self.latencies) * 1000.0
+		applyMs = np.array(self.applySeconds) * 1000.0
+		return {'requests': self.requests, 'applied': self.applied, 'coalesced': self.coalesced,
+			'flushes': self.flushes, 'errors': self.errors,
+			'latencyMeanMs': float(latencies.mean()) if len(latencies) else float('nan'),
+			'latency95Ms': float(np.percentile(latencies, 95)) if len(latencies) else float('nan'),
+			'latencyMaxMs': float(latencies.max()) if len(latencies) else float('nan'),
+			'applyMeanMs': float(applyMs.mean()) if len(applyMs) else float('nan'),
+			'applyMaxMs': float(applyMs.max()) if len(applyMs) else float('nan')}
+
+	def resetStatistics(self):
+
+		self.requests = self.applied = self.coalesced = self.flushes = self.errors = 0
+		self.latencies.clear()
+		self.applySeconds.clear()
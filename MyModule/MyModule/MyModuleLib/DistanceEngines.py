@@ -0,0 +1,440 @@
+#
+# MyModuleLib: surface distance engines
+#
+# A distance engine is built once for a target surface and then returns, for any array of
+# points, the unsigned distance from each point to that surface.
+#
+#   - 'filter':  vtkDistancePolyDataFilter (original implementation of the color map)
+#   - 'locator': vtkImplicitPolyDataDistance (cell locator built once, all points evaluated in C++)
+#   - 'kdtree':  SciPy KD-tree over the triangles + vectorized exact point-triangle distances
+#   - 'auto':    'locator' (fastest on one core in Testing/Python/MyModuleBenchmark.py)
+#
+# With several workers the source points are split in chunks. Thread-safe engines ('kdtree')
+# are shared by a thread pool; the other engines ('locator') run in a process pool where the
+# point arrays are passed in shared memory and every process builds its own locator, only for
+# meshes large enough to pay for starting the processes (MINIMUM_POINTS_PER_PROCESS).
+#
+
+import os
+import multiprocessing
+from multiprocessing import shared_memory
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+
+import numpy as np
+from vtkmodules.vtkCommonCore import vtkDoubleArray, vtkPoints, VTK_ID_TYPE
+from vtkmodules.vtkCommonDataModel import vtkCellArray, vtkPolyData
+from vtkmodules.vtkFiltersCore import vtkImplicitPolyDataDistance, vtkTriangleFilter
+from vtkmodules.vtkFiltersGeneral import vtkDistancePolyDataFilter
+from vtkmodules.util import numpy_support
+
+from MyModuleLib import Backends
+
+DISTANCE_ENGINES = ['auto', 'kdtree', 'locator', 'filter']
+
+MINIMUM_POINTS_PER_WORKER = 20000
+
+# Engines that are not thread-safe run in processes, each of which starts Python, imports VTK and builds
+# its own engine: about 1 s per pool against about 20 us per point for the locator. Below this many
+# points per process the pool is slower than one core (100k points: 2.8 s with 3 processes, 1.8 s on one).
+MINIMUM_POINTS_PER_PROCESS = 250000
+
+# Number of chunks a single-core computation is split into when progress is reported
+PROGRESS_CHUNKS = 20
+
+#
+# Mesh arrays
+#
+
+def polyDataPoints(polyData):
+
+	# Zero-copy view of the point coordinates
+	return numpy_support.vtk_to_numpy(polyData.GetPoints().GetData())
+
+def polyDataTriangles(polyData):
+
+	# Triangle connectivity as a (numberOfTriangles, 3) array (polygons and strips are triangulated)
+	polys = polyData.GetPolys()
+	if polyData.GetNumberOfStrips() > 0 or polys.GetMaxCellSize() > 3:
+		triangleFilter = vtkTriangleFilter()
+		triangleFilter.SetInputData(polyData)
+		triangleFilter.PassVertsOff()
+		triangleFilter.PassLinesOff()
+		triangleFilter.Update()
+		polys = triangleFilter.GetOutput().GetPolys()
+	if polys.GetNumberOfCells() == 0:
+		return np.zeros((0, 3), dtype=np.int64)
+	return numpy_support.vtk_to_numpy(polys.GetConnectivityArray()).reshape(-1, 3)
+
+def polyDataFromArrays(points, triangles):
+
+	# Surface from a (numberOfPoints, 3) point array (not copied) and a (numberOfTriangles, 3) triangle array
+	pointData = numpy_support.numpy_to_vtk(points, deep=0)
+	surfacePoints = vtkPoints()
+	surfacePoints.SetData(pointData)
+	idType = numpy_support.get_vtk_to_numpy_typemap()[VTK_ID_TYPE]
+	offsets = np.arange(0, 3 * len(triangles) + 1, 3, dtype=idType)
+	connectivity = np.asarray(triangles, dtype=idType).ravel()
+	cellArray = vtkCellArray()
+	cellArray.SetData(numpy_support.numpy_to_vtkIdTypeArray(offsets, deep=1), numpy_support.numpy_to_vtkIdTypeArray(connectivity, deep=1))
+	polyData = vtkPolyData()
+	polyData.SetPoints(surfacePoints)
+	polyData.SetPolys(cellArray)
+	return polyData
+
+def squaredDistancesToTriangles(p, a, b, c):
+
+	# Squared distance from points p to triangles (a, b, c), all arrays broadcastable to (..., 3).
+	# Closest point regions as in Ericson, Real-Time Collision Detection, 5.1.5.
+	def dot(u, v):
+		return np.einsum('...i,...i->...', u, v)
+
+	ab = b - a
+	ac = c - a
+	ap = p - a
+	bp = p - b
+	cp = p - c
+	d1 = dot(ab, ap)
+	d2 = dot(ac, ap)
+	d3 = dot(ab, bp)
+	d4 = dot(ac, bp)
+	d5 = dot(ab, cp)
+	d6 = dot(ac, cp)
+	va = d3 * d6 - d5 * d4
+	vb = d5 * d2 - d1 * d6
+	vc = d1 * d4 - d3 * d2
+
+	with np.errstate(divide='ignore', invalid='ignore'):
+		# Face region (barycentric coordinates v, w), then edge and vertex regions by increasing priority
+		denominator = va + vb + vc
+		v = vb / denominator
+		w = vc / denominator
+		s = 1.0 - v - w
+		# Edge BC
+		region = (va <= 0) & (d4 - d3 >= 0) & (d5 - d6 >= 0)
+		t = (d4 - d3) / ((d4 - d3) + (d5 - d6))
+		s, v, w = np.where(region, 0.0, s), np.where(region, 1.0 - t, v), np.where(region, t, w)
+		# Edge AC
+		region = (vb <= 0) & (d2 >= 0) & (d6 <= 0)
+		t = d2 / (d2 - d6)
+		s, v, w = np.where(region, 1.0 - t, s), np.where(region, 0.0, v), np.where(region, t, w)
+		# Vertex C
+		region = (d6 >= 0) & (d5 <= d6)
+		s, v, w = np.where(region, 0.0, s), np.where(region, 0.0, v), np.where(region, 1.0, w)
+		# Edge AB
+		region = (vc <= 0) & (d1 >= 0) & (d3 <= 0)
+		t = d1 / (d1 - d3)
+		s, v, w = np.where(region, 1.0 - t, s), np.where(region, t, v), np.where(region, 0.0, w)
+		# Vertex B
+		region = (d3 >= 0) & (d4 <= d3)
+		s, v, w = np.where(region, 0.0, s), np.where(region, 1.0, v), np.where(region, 0.0, w)
+		# Vertex A
+		region = (d1 <= 0) & (d2 <= 0)
+		s, v, w = np.where(region, 1.0, s), np.where(region, 0.0, v), np.where(region, 0.0, w)
+
+		closest = s[..., None] * a + v[..., None] * b + w[..., None] * c
+		squaredDistances = dot(p - closest, p - closest)
+
+	# Degenerate triangles: fall back to the closest vertex
+	invalid = ~np.isfinite(squaredDistances)
+	if np.any(invalid):
+		vertexDistances = np.minimum(np.minimum(dot(ap, ap), dot(bp, bp)), dot(cp, cp))
+		squaredDistances = np.where(invalid, vertexDistances, squaredDistances)
+	return squaredDistances
+
+#
+# Engines
+#
+
+class DistanceEngine(object):
+
+	name = ''
+	threadSafe = False  # computeDistances can be called from several threads at the same time
+
+	def setTarget(self, polyData):
+
+		raise NotImplementedError
+
+	def computeDistances(self, points, distances=None):
+
+		# points: (N, 3) array. Distances are written into 'distances' if given (no extra copy).
+		raise NotImplementedError
+
+class LocatorDistanceEngine(DistanceEngine):
+
+	name = 'locator'
+
+	def __init__(self):
+
+		self.implicitDistance = None
+
+	def setTarget(self, polyData):
+
+		# The cell locator of the target is built here, once
+		self.implicitDistance = vtkImplicitPolyDataDistance()
+		self.implicitDistance.SetInput(polyData)
+
+	def computeDistances(self, points, distances=None):
+
+		points = np.ascontiguousarray(points, dtype=np.float64)
+		if distances is None:
+			distances = np.empty(len(points))
+		# Evaluate all points in one C++ call, writing directly into the output buffer
+		self.implicitDistance.FunctionValue(numpy_support.numpy_to_vtk(points, deep=0), numpy_support.numpy_to_vtk(distances, deep=0))
+		np.abs(distances, out=distances)
+		return distances
+
+class KDTreeDistanceEngine(DistanceEngine):
+
+	# Candidate triangles are the ones with the closest centroids. A result is exact when no other
+	# triangle can be closer (distance to the last candidate centroid minus the largest triangle radius);
+	# the remaining points are resolved with a radius search. In the radius search, a triangle is only
+	# evaluated if its lower bound (distance to its plane combined with the in-plane distance to its
+	# circumscribing disc) is below the current best distance.
+
+	name = 'kdtree'
+	threadSafe = True
+
+	def __init__(self, numberOfCandidates=8, chunkSize=32768):
+
+		if Backends.kdTreeClass() is None:
+			raise ImportError('SciPy is required by the kdtree distance engine')
+		self.numberOfCandidates = numberOfCandidates
+		self.chunkSize = chunkSize
+		self.vertices = None
+		self.triangles = None
+		self.centroids = None
+		self.normals = None
+		self.radii = None
+		self.tree = None
+		self.maxRadius = 0.0
+
+	def setTarget(self, polyData):
+
+		self.vertices = np.asarray(polyDataPoints(polyData), dtype=np.float64)
+		self.triangles = polyDataTriangles(polyData)
+		if len(self.triangles) == 0:
+			raise ValueError('Target surface has no triangles')
+		corners = self.vertices[self.triangles]
+		self.centroids = corners.mean(axis=1)
+		self.radii = np.sqrt(((corners - self.centroids[:, None, :]) ** 2).sum(axis=2).max(axis=1))
+		self.maxRadius = self.radii.max()
+		normals = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+		normalLengths = np.linalg.norm(normals, axis=1)
+		self.normals = normals / np.where(normalLengths > 0, normalLengths, 1.0)[:, None]
+		self.tree = Backends.kdTreeClass()(self.centroids)
+
+	def computeDistances(self, points, distances=None):
+
+		if distances is None:
+			distances = np.empty(len(points))
+		for start in range(0, len(points), self.chunkSize):
+			stop = min(start + self.chunkSize, len(points))
+			distances[start:stop] = self._chunkDistances(np.asarray(points[start:stop], dtype=np.float64))
+		return distances
+
+	def _triangleSquaredDistances(self, points, triangleIds):
+
+		corners = self.vertices[self.triangles[triangleIds]]
+		return squaredDistancesToTriangles(points, corners[..., 0, :], corners[..., 1, :], corners[..., 2, :])
+
+	def _chunkDistances(self, points):
+
+		numberOfCandidates = min(self.numberOfCandidates, len(self.triangles))
+		centroidDistances, candidates = self.tree.query(points, numberOfCandidates)
+		if numberOfCandidates == 1:
+			centroidDistances = centroidDistances[:, None]
+			candidates = candidates[:, None]
+		distances = np.sqrt(self._triangleSquaredDistances(points[:, None, :], candidates).min(axis=1))
+		if numberOfCandidates == len(self.triangles):
+			return distances
+
+		uncertain = np.nonzero(distances > centroidDistances[:, -1] - self.maxRadius)[0]
+		if len(uncertain):
+			distances[uncertain] = self._radiusSearchDistances(points[uncertain], distances[uncertain])
+		return distances
+
+	def _radiusSearchDistances(self, points, upperBounds):
+
+		# Any triangle closer than the upper bound has its centroid within upperBound + maxRadius
+		neighbours = self.tree.query_ball_point(points, upperBounds + self.maxRadius, return_sorted=False)
+		counts = np.array([len(triangleIds) for triangleIds in neighbours])
+		pointIds = np.repeat(np.arange(len(points)), counts)
+		triangleIds = np.concatenate(neighbours).astype(np.int64)
+
+		# Discard triangles whose lower bound is not below the upper bound
+		offsets = points[pointIds] - self.centroids[triangleIds]
+		planeDistances = np.einsum('ij,ij->i', offsets, self.normals[triangleIds])
+		inPlaneDistances = np.sqrt(np.maximum(np.einsum('ij,ij->i', offsets, offsets) - planeDistances ** 2, 0.0))
+		lowerBounds = planeDistances ** 2 + np.maximum(inPlaneDistances - self.radii[triangleIds], 0.0) ** 2
+		squaredDistances = np.square(upperBounds)
+		keep = lowerBounds < squaredDistances[pointIds]
+		pointIds = pointIds[keep]
+		triangleIds = triangleIds[keep]
+
+		np.minimum.at(squaredDistances, pointIds, self._triangleSquaredDistances(points[pointIds], triangleIds))
+		return np.sqrt(squaredDistances)
+
+def createDistanceEngine(engineName='auto'):
+
+	if engineName == 'auto':
+		engineName = 'locator'
+	if engineName == 'kdtree':
+		return KDTreeDistanceEngine()
+	if engineName == 'locator':
+		return LocatorDistanceEngine()
+	raise ValueError('Unknown distance engine: ' + str(engineName))
+
+#
+# Parallel computation
+#
+
+def chunkBoundaries(numberOfPoints, numberOfWorkers, chunksPerWorker=4):
+
+	# Contiguous [start, stop) ranges; several chunks per worker to balance the load
+	numberOfChunks = max(1, min(numberOfPoints, numberOfWorkers * chunksPerWorker))
+	bounds = np.linspace(0, numberOfPoints, numberOfChunks + 1).astype(np.int64)
+	return [(int(start), int(stop)) for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start]
+
+def waitForChunks(futures, progressCallback=None):
+
+	# progressCallback(fraction) is called as chunks complete. If it raises (cancellation),
+	# chunks that have not started yet are dropped.
+	try:
+		for numberOfCompletedChunks, future in enumerate(as_completed(futures), 1):
+			future.result()
+			if progressCallback is not None:
+				progressCallback(numberOfCompletedChunks / float(len(futures)))
+	except BaseException:
+		for future in futures:
+			future.cancel()
+		raise
+
+def computeDistancesWithThreads(engine, points, distances, numberOfWorkers, progressCallback=None):
+
+	# Threads share the engine and write into disjoint slices of the output array
+	def computeChunk(bounds):
+		start, stop = bounds
+		engine.computeDistances(points[start:stop], distances[start:stop])
+	with ThreadPoolExecutor(max_workers=numberOfWorkers) as executor:
+		waitForChunks([executor.submit(computeChunk, bounds) for bounds in chunkBoundaries(len(points), numberOfWorkers)], progressCallback)
+	return distances
+
+def _createSharedArray(shape, dtype):
+
+	dtype = np.dtype(dtype)
+	sharedMemory = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(shape)) * dtype.itemsize))
+	sharedArray = np.ndarray(shape, dtype=dtype, buffer=sharedMemory.buf)
+	return sharedMemory, sharedArray, (sharedMemory.name, shape, dtype.str)
+
+def _attachSharedArray(description):
+
+	name, shape, dtype = description
+	sharedMemory = shared_memory.SharedMemory(name=name)
+	return sharedMemory, np.ndarray(shape, dtype=np.dtype(dtype), buffer=sharedMemory.buf)
+
+_distanceWorker = {}
+
+def _initializeDistanceWorker(engineName, targetPointsDescription, targetTrianglesDescription, pointsDescription, distancesDescription):
+
+	# Runs once in every worker process: attach the shared arrays and build the engine
+	sharedArrays = [_attachSharedArray(description) for description in
+		[targetPointsDescription, targetTrianglesDescription, pointsDescription, distancesDescription]]
+	targetPoints, targetTriangles, points, distances = [sharedArray for sharedMemory, sharedArray in sharedArrays]
+	engine = createDistanceEngine(engineName)
+	engine.setTarget(polyDataFromArrays(targetPoints, targetTriangles))
+	_distanceWorker.update({'engine': engine, 'points': points, 'distances': distances, 'sharedMemory': sharedArrays})
+
+def _computeDistanceChunk(bounds):
+
+	start, stop = bounds
+	_distanceWorker['engine'].computeDistances(_distanceWorker['points'][start:stop], _distanceWorker['distances'][start:stop])
+
+def computeDistancesWithProcesses(engineName, targetPolyData, points, distances, numberOfWorkers, progressCallback=None):
+
+	# Engines that are not thread-safe: every process builds its own engine from shared arrays.
+	# Processes are spawned (not forked) so that it is safe inside the Slicer application.
+	# The input arrays are converted straight into the shared blocks, and the workers write into a
+	# shared distances block, copied once into distances (allocated here if None) before the shared
+	# memory is released.
+	sources = [polyDataPoints(targetPolyData), polyDataTriangles(targetPolyData), points]
+	layouts = [(sources[0].shape, np.float64), (sources[1].shape, np.int64), ((len(points), 3), np.float64), ((len(points),), np.float64)]
+	sharedMemories = []
+	sharedArrays = []
+	sharedArray = None
+	try:
+		descriptions = []
+		for shape, dtype in layouts:
+			sharedMemory, sharedArray, description = _createSharedArray(shape, dtype)
+			sharedMemories.append(sharedMemory)
+			sharedArrays.append(sharedArray)
+			descriptions.append(description)
+		for source, sharedArray in zip(sources, sharedArrays):
+			sharedArray[...] = source
+		del sources[:]
+		with ProcessPoolExecutor(max_workers=numberOfWorkers, mp_context=multiprocessing.get_context('spawn'),
+			initializer=_initializeDistanceWorker, initargs=[engineName] + descriptions) as executor:
+			waitForChunks([executor.submit(_computeDistanceChunk, bounds) for bounds in chunkBoundaries(len(points), numberOfWorkers)], progressCallback)
+		if distances is None:
+			distances = sharedArrays[-1].copy()
+		else:
+			distances[:] = sharedArrays[-1]
+	finally:
+		# Views must be released before the shared memory is closed
+		del sharedArray, sharedArrays[:]
+		for sharedMemory in sharedMemories:
+			sharedMemory.close()
+			sharedMemory.unlink()
+	return distances
+
+def computeDistances(engineName, targetPolyData, points, distances=None, numberOfWorkers=1, progressCallback=None):
+
+	# Distance from every point to the target surface, using numberOfWorkers cores.
+	# Results do not depend on the number of workers. progressCallback(fraction) is called after
+	# every chunk of points; an exception raised by it stops the computation.
+	# Starting workers is not worth it for small meshes
+	numberOfWorkers = numberOfWorkers or os.cpu_count() or 1
+	numberOfWorkers = max(1, min(numberOfWorkers, len(points) // MINIMUM_POINTS_PER_WORKER))
+	engine = createDistanceEngine(engineName)
+	if not engine.threadSafe:
+		numberOfWorkers = max(1, min(numberOfWorkers, len(points) // MINIMUM_POINTS_PER_PROCESS))
+	if numberOfWorkers > 1 and not engine.threadSafe:
+		return computeDistancesWithProcesses(engine.name, targetPolyData, points, distances, numberOfWorkers, progressCallback)
+	if distances is None:
+		distances = np.empty(len(points))
+	engine.setTarget(targetPolyData)
+	if numberOfWorkers > 1:
+		return computeDistancesWithThreads(engine, points, distances, numberOfWorkers, progressCallback)
+	if progressCallback is None:
+		return engine.computeDistances(points, distances)
+	chunks = chunkBoundaries(len(points), 1, PROGRESS_CHUNKS)
+	for chunkIndex, (start, stop) in enumerate(chunks, 1):
+		engine.computeDistances(points[start:stop], distances[start:stop])
+		progressCallback(chunkIndex / float(len(chunks)))
+	return distances
+
+#
+# Distance map
+#
+
+def computeDistancePolyData(sourcePolyData, targetPolyData, engineName='auto', numberOfWorkers=1, progressCallback=None):
+
+	# Copy of the source surface with a 'Distance' point array (distance to the target surface)
+	if engineName == 'filter':
+		distanceFilter = vtkDistancePolyDataFilter()
+		distanceFilter.SetInputData(0, sourcePolyData)
+		distanceFilter.SetInputData(1, targetPolyData)
+		distanceFilter.SignedDistanceOff()
+		distanceFilter.Update()
+		return distanceFilter.GetOutput()
+
+	# The engine writes into the memory of the VTK array
+	distanceArray = vtkDoubleArray()
+	distanceArray.SetName('Distance')
+	distanceArray.SetNumberOfTuples(sourcePolyData.GetNumberOfPoints())
+	computeDistances(engineName, targetPolyData, polyDataPoints(sourcePolyData), numpy_support.vtk_to_numpy(distanceArray), numberOfWorkers, progressCallback)
+
+	outputPolyData = vtkPolyData()
+	outputPolyData.ShallowCopy(sourcePolyData)
+	outputPolyData.GetPointData().AddArray(distanceArray)
+	outputPolyData.GetPointData().SetActiveScalars('Distance')
+	return outputPolyData
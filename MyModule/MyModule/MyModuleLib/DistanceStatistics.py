@@ -0,0 +1,99 @@
+#
+# MyModuleLib: statistics of surface distance arrays
+#
+# Statistics are computed on NumPy views of the 'Distance' arrays of the distance maps (no copy of the
+# VTK arrays), chunk by chunk, so the arrays of both directions are never concatenated:
+#   - maximum, mean and root mean square: running sums over the chunks
+#   - percentiles: a histogram of the values locates the bin of each rank, then only the values of
+#     that bin are gathered and sorted (same result as np.percentile on the concatenated arrays)
+#   - fixed-bin histogram: bins of binWidthMm from 0, the last bin also counts larger distances
+#
+
+import numpy as np
+from vtkmodules.util import numpy_support
+
+CHUNK_SIZE = 1 << 20
+
+# Bins of the histogram used to locate percentiles
+SELECTION_BINS = 4096
+
+DEFAULT_HISTOGRAM_BIN_WIDTH_MM = 0.5
+DEFAULT_HISTOGRAM_BINS = 40
+
+def distanceArray(polyData, arrayName='Distance'):
+
+	# NumPy view of the point array (shares the memory of the VTK array)
+	return numpy_support.vtk_to_numpy(polyData.GetPointData().GetArray(arrayName))
+
+def chunks(arrays):
+
+	for array in arrays:
+		for start in range(0, len(array), CHUNK_SIZE):
+			yield array[start:start + CHUNK_SIZE]
+
+def orderStatistics(arrays, ranks, minimum, maximum):
+
+	# Values of the given ranks (0-based) in the sorted union of the arrays
+	if maximum <= minimum:
+		return [float(minimum) for rank in ranks]
+	scale = SELECTION_BINS / (maximum - minimum)
+	def binIndices(chunk):
+		return np.minimum(((chunk - minimum) * scale).astype(np.int64), SELECTION_BINS - 1)
+	counts = np.zeros(SELECTION_BINS, dtype=np.int64)
+	for chunk in chunks(arrays):
+		counts += np.bincount(binIndices(chunk), minlength=SELECTION_BINS)
+	cumulativeCounts = np.cumsum(counts)
+	values = []
+	for rank in ranks:
+		binIndex = int(np.searchsorted(cumulativeCounts, rank, side='right'))
+		countBefore = int(cumulativeCounts[binIndex - 1]) if binIndex > 0 else 0
+		selected = np.concatenate([chunk[binIndices(chunk) == binIndex] for chunk in chunks(arrays)])
+		selected.sort()
+		values.append(float(selected[rank - countBefore]))
+	return values
+
+def percentile(arrays, fraction, minimum, maximum):
+
+	# Linear interpolation between the closest ranks, as np.percentile
+	count = sum(len(array) for array in arrays)
+	position = fraction * (count - 1)
+	lowerRank = int(np.floor(position))
+	upperRank = min(lowerRank + 1, count - 1)
+	lower, upper = orderStatistics(arrays, [lowerRank, upperRank], minimum, maximum)
+	return lower + (upper - lower) * (position - lowerRank)
+
+def distanceStatistics(arrays, histogramBinWidthMm=DEFAULT_HISTOGRAM_BIN_WIDTH_MM, histogramBins=DEFAULT_HISTOGRAM_BINS):
+
+	# Statistics of the union of one or several distance arrays (unsigned distances)
+	count = sum(len(array) for array in arrays)
+	if count == 0:
+		nan = float('nan')
+		return {'count': 0, 'maxMm': nan, 'percentile95Mm': nan, 'meanMm': nan, 'rmsMm': nan,
+			'histogramCounts': np.zeros(histogramBins, dtype=np.int64)}
+	total = 0.0
+	squares = 0.0
+	minimum, maximum = np.inf, -np.inf
+	histogramCounts = np.zeros(histogramBins, dtype=np.int64)
+	for chunk in chunks(arrays):
+		total += float(chunk.sum())
+		squares += float(np.dot(chunk, chunk))
+		minimum = min(minimum, float(chunk.min()))
+		maximum = max(maximum, float(chunk.max()))
+		bins = np.clip((chunk / histogramBinWidthMm).astype(np.int64), 0, histogramBins - 1)
+		histogramCounts += np.bincount(bins, minlength=histogramBins)
+	return {'count': count, 'maxMm': maximum, 'percentile95Mm': percentile(arrays, 0.95, minimum, maximum),
+		'meanMm': total / count, 'rmsMm': float(np.sqrt(squares / count)), 'histogramCounts': histogramCounts}
+
+def histogramEdges(histogramBinWidthMm=DEFAULT_HISTOGRAM_BIN_WIDTH_MM, histogramBins=DEFAULT_HISTOGRAM_BINS):
+
+	return np.arange(histogramBins + 1) * histogramBinWidthMm
+
+def bidirectionalStatistics(distancePolyData12, distancePolyData21, histogramBinWidthMm=DEFAULT_HISTOGRAM_BIN_WIDTH_MM,
+	histogramBins=DEFAULT_HISTOGRAM_BINS):
+
+	# Statistics of both directed distance maps and of their union (symmetric Hausdorff distances)
+	distances12 = distanceArray(distancePolyData12)
+	distances21 = distanceArray(distancePolyData21)
+	return {'1->2': distanceStatistics([distances12], histogramBinWidthMm, histogramBins),
+		'2->1': distanceStatistics([distances21], histogramBinWidthMm, histogramBins),
+		'symmetric': distanceStatistics([distances12, distances21], histogramBinWidthMm, histogramBins)}
@@ -0,0 +1,177 @@
+#
+# MyModuleLib: Hausdorff and surface distances from Euclidean distance transforms of binary masks
+#
+# Both closed surfaces are rasterized on a common grid cropped to the union of their bounding boxes
+# (the packed masks of PackedMasks.py, so masks already in the cache are not rasterized again). The
+# boundary voxels of each mask are the voxels of the mask with a 6-neighbour outside of it. The
+# distance from every voxel to the closest boundary voxel of the other mask is an exact Euclidean
+# distance transform, and the surface distances are read from it at the boundary voxels. Voxels may be
+# anisotropic: distances are measured in mm with the spacing of each axis.
+#
+# The transform is separable (Felzenszwalb and Huttenlocher): the squared distance to the closest
+# feature voxel along the first axis comes from running maxima and minima of the feature indices,
+# then each further axis takes the lower envelope of the parabolas of its lines. The lower envelope is
+# computed for all lines of the axis at once, one position of the axis at a time, so the Python loop
+# runs over the axis length and every step is a NumPy operation on all lines. With SciPy, the same
+# exact transform of scipy.ndimage is used instead (compiled, about twice as fast).
+#
+# Distances are between voxel centers: they differ from the surface distances of SurfaceHausdorff.py
+# by up to about one voxel diagonal.
+#
+
+import numpy as np
+
+from MyModuleLib import Backends
+from MyModuleLib import DistanceStatistics
+from MyModuleLib import PackedMasks
+
+DEFAULT_VOXEL_SPACING_MM = (0.5, 0.5, 0.5)
+
+def boundaryVoxels(mask):
+
+	# Voxels of the mask with at least one of their 6 neighbours outside (voxels outside the array are outside)
+	interior = mask.copy()
+	for axis in range(3):
+		lower = [slice(None)] * 3
+		upper = [slice(None)] * 3
+		lower[axis] = slice(0, -1)
+		upper[axis] = slice(1, None)
+		interior[tuple(upper)] &= mask[tuple(lower)]
+		interior[tuple(lower)] &= mask[tuple(upper)]
+		edge = [slice(None)] * 3
+		edge[axis] = [0, mask.shape[axis] - 1]
+		interior[tuple(edge)] = False
+	return mask & ~interior
+
+def squaredDistancesAlongLines(features, spacing):
+
+	# Squared distance to the closest feature voxel of the same line (features: (numberOfPositions, numberOfLines))
+	numberOfPositions = features.shape[0]
+	positions = np.arange(numberOfPositions, dtype=np.int64)[:, np.newaxis]
+	previous = np.maximum.accumulate(np.where(features, positions, -numberOfPositions), axis=0)
+	following = np.minimum.accumulate(np.where(features, positions, 2 * numberOfPositions)[::-1], axis=0)[::-1]
+	closest = np.minimum(positions - previous, following - positions)
+	squaredDistances = (closest * spacing) ** 2
+	squaredDistances[closest >= numberOfPositions] = np.inf  # no feature on the line
+	return squaredDistances
+
+def lowerEnvelope(squaredDistances, spacing):
+
+	# min over q of squaredDistances[q] + ((p - q) * spacing)^2 for every position p, for all lines
+	# (columns) at once. Infinite values are positions without a feature in their plane.
+	numberOfPositions = squaredDistances.shape[0]
+	finite = np.isfinite(squaredDistances)
+	lines = np.flatnonzero(finite.any(axis=0))
+	result = np.full(squaredDistances.shape, np.inf)
+	if len(lines) == 0:
+		return result
+	f = squaredDistances[:, lines]
+	finite = finite[:, lines]
+	numberOfLines = len(lines)
+	heights = f + (np.arange(numberOfPositions)[:, np.newaxis] * spacing) ** 2
+
+	# Parabolas of the lower envelope of each line (stack of positions v) and the abscissas z (mm) where
+	# each one starts; both are indexed by stack level * numberOfLines + line
+	v = np.zeros(numberOfPositions * numberOfLines, dtype=np.int64)
+	z = np.empty((numberOfPositions + 1) * numberOfLines)
+	top = np.full(numberOfLines, -1, dtype=np.int64)
+	flatHeights = heights.ravel()
+
+	def intersection(topIndices, q, lineIndices):
+		# Abscissa where the parabola of position q equals the parabola on top of the stack of the lines
+		r = v[topIndices]
+		return (flatHeights[q * numberOfLines + lineIndices] - flatHeights[r * numberOfLines + lineIndices]) / (2.0 * spacing * (q - r))
+
+	for q in range(numberOfPositions):
+		active = np.flatnonzero(finite[q])
+		if len(active) == 0:
+			continue
+		first = active[top[active] < 0]
+		others = active[top[active] >= 0]
+		# Parabolas hidden by the new one are removed (the first parabola of a line never is, z = -inf)
+		candidates = others
+		while len(candidates):
+			topIndices = top[candidates] * numberOfLines + candidates
+			candidates = candidates[intersection(topIndices, q, candidates) <= z[topIndices]]
+			top[candidates] -= 1
+		if len(others):
+			crossing = intersection(top[others] * numberOfLines + others, q, others)
+			top[others] += 1
+			topIndices = top[others] * numberOfLines + others
+			v[topIndices] = q
+			z[topIndices] = crossing
+		top[first] = 0
+		v[first] = q
+		z[first] = -np.inf
+
+	# Stack level of the parabola above each position: number of the starts z (after the first) that
+	# are before the position, counted at the first position after each start
+	levels = np.arange(1, numberOfPositions)[:, np.newaxis]
+	used = levels <= top
+	startLevels, startLines = np.nonzero(used)
+	startPositions = np.clip(np.floor(z[(startLevels + 1) * numberOfLines + startLines] / spacing).astype(np.int64) + 1, 0, numberOfPositions)
+	counts = np.bincount(startPositions * numberOfLines + startLines, minlength=(numberOfPositions + 1) * numberOfLines)
+	current = np.cumsum(counts.reshape(numberOfPositions + 1, numberOfLines)[:numberOfPositions], axis=0)
+	closest = v.reshape(numberOfPositions, numberOfLines)[current, np.arange(numberOfLines)]
+	result[:, lines] = np.take_along_axis(f, closest, axis=0) + ((np.arange(numberOfPositions)[:, np.newaxis] - closest) * spacing) ** 2
+	return result
+
+def squaredDistanceTransform(features, spacing):
+
+	# Squared Euclidean distance (mm2) from every voxel to the closest feature voxel; features is a
+	# boolean array indexed [k, j, i], spacing is (i, j, k) as the grid spacing. The axis i is processed
+	# first, with running maxima and minima, then j and k with lower envelopes.
+	spacing = [float(value) for value in spacing]
+	squaredDistances = np.moveaxis(squaredDistancesAlongLines(np.moveaxis(features, 2, 0).reshape(features.shape[2], -1),
+		spacing[0]).reshape(features.shape[2], features.shape[0], features.shape[1]), 0, 2)
+	for axis, axisSpacing in [(1, spacing[1]), (0, spacing[2])]:
+		lines = np.moveaxis(squaredDistances, axis, 0)
+		shape = lines.shape
+		squaredDistances = np.moveaxis(lowerEnvelope(np.ascontiguousarray(lines).reshape(shape[0], -1), axisSpacing).reshape(shape), 0, axis)
+	return np.ascontiguousarray(squaredDistances)
+
+def distanceTransform(features, spacing, useSciPy=True):
+
+	# Euclidean distance (mm) from every voxel to the closest feature voxel
+	distanceTransformFunction = Backends.distanceTransformFunction() if useSciPy else None
+	if distanceTransformFunction is not None:
+		return distanceTransformFunction(~features, sampling=[float(value) for value in spacing[::-1]])
+	return np.sqrt(squaredDistanceTransform(features, spacing))
+
+def boundaryDistances(sourceBoundary, targetBoundary, spacing, useSciPy=True):
+
+	# Distances (mm) from the voxels of sourceBoundary to the closest voxel of targetBoundary
+	if not targetBoundary.any():
+		return np.full(int(np.count_nonzero(sourceBoundary)), np.inf)
+	return distanceTransform(targetBoundary, spacing, useSciPy)[sourceBoundary]
+
+def maskBoundaryDistances(polyData1, polyData2, voxelSpacingMm=DEFAULT_VOXEL_SPACING_MM, cache=None, progressCallback=None, useSciPy=True):
+
+	# Distances of the boundary voxels of each mask to the boundary of the other one (1 -> 2, 2 -> 1)
+	(packedMask1, packedMask2), cacheHits = PackedMasks.packedMasksForPair(polyData1, polyData2, voxelSpacingMm, cache)
+	spacing = packedMask1.grid.spacing
+	boundary1 = boundaryVoxels(packedMask1.toArray())
+	boundary2 = boundaryVoxels(packedMask2.toArray())
+	if progressCallback is not None:
+		progressCallback(0.2)
+	distances12 = boundaryDistances(boundary1, boundary2, spacing, useSciPy)
+	if progressCallback is not None:
+		progressCallback(0.6)
+	distances21 = boundaryDistances(boundary2, boundary1, spacing, useSciPy)
+	if progressCallback is not None:
+		progressCallback(1.0)
+	masksInfo = {'voxelSpacing': [float(value) for value in spacing], 'gridDimensions': list(boundary1.shape[::-1]),
+		'boundaryVoxels': len(distances12) + len(distances21), 'cacheHits': cacheHits}
+	return distances12, distances21, masksInfo
+
+def distanceTransformHausdorff(polyData1, polyData2, voxelSpacingMm=DEFAULT_VOXEL_SPACING_MM, cache=None, progressCallback=None, useSciPy=True):
+
+	# Hausdorff distances: maximum, 95th percentile and mean of the distances of the boundary voxels of
+	# both masks (as SegmentComparison), and maximum of each direction
+	distances12, distances21, masksInfo = maskBoundaryDistances(polyData1, polyData2, voxelSpacingMm, cache, progressCallback, useSciPy)
+	statistics = DistanceStatistics.distanceStatistics([distances12, distances21])
+	result = {'hausdorffMaxMm': statistics['maxMm'], 'hausdorff95Mm': statistics['percentile95Mm'], 'hausdorffMeanMm': statistics['meanMm'],
+		'hausdorffDirected12Mm': float(distances12.max()) if len(distances12) else float('nan'),
+		'hausdorffDirected21Mm': float(distances21.max()) if len(distances21) else float('nan')}
+	result.update(masksInfo)
+	return result
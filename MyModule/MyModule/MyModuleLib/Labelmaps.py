@@ -0,0 +1,116 @@
+#
+# MyModuleLib: binary masks of closed surfaces on a common voxel grid
+#
+# All masks compared with each other share one grid (origin and spacing), so that two masks can be
+# compared voxel by voxel without resampling. Each mask only stores the voxels of its own bounding box
+# (extent in grid indices), which keeps many small segments (vessels, lesions) cheap.
+#
+
+import numpy as np
+from vtkmodules.vtkImagingStencil import vtkImageStencilToImage, vtkPolyDataToImageStencil
+from vtkmodules.util import numpy_support
+
+DEFAULT_VOXEL_SIZE_MM = 1.0
+
+class VoxelGrid(object):
+
+	# Axis-aligned grid: voxel (i, j, k) is centered at origin + (i, j, k) * spacing
+
+	def __init__(self, origin, spacing):
+
+		self.origin = np.asarray(origin, dtype=np.float64)
+		self.spacing = np.asarray(spacing, dtype=np.float64)
+
+	@property
+	def voxelVolumeMm3(self):
+
+		return float(np.prod(self.spacing))
+
+	def extentFromBounds(self, bounds):
+
+		# Smallest extent [i0, i1, j0, j1, k0, k1] containing the bounds (xmin, xmax, ymin, ymax, zmin, zmax)
+		bounds = np.asarray(bounds, dtype=np.float64).reshape(3, 2)
+		lower = np.floor((bounds[:, 0] - self.origin) / self.spacing).astype(int)
+		upper = np.ceil((bounds[:, 1] - self.origin) / self.spacing).astype(int)
+		return [int(value) for pair in zip(lower, upper) for value in pair]
+
+def gridForSurfaces(polyDataList, voxelSizeMm=DEFAULT_VOXEL_SIZE_MM):
+
+	# Grid aligned with the lowest corner of all surfaces (one voxel of margin). voxelSizeMm is one size
+	# or the (x, y, z) spacing of anisotropic voxels.
+	spacing = np.broadcast_to(np.asarray(voxelSizeMm, dtype=np.float64), (3,))
+	bounds = np.array([polyData.GetBounds() for polyData in polyDataList])
+	origin = bounds[:, [0, 2, 4]].min(axis=0) - spacing
+	return VoxelGrid(origin, spacing)
+
+class BinaryMask(object):
+
+	# Voxels of a bounding box of the grid; array indexed [k, j, i] like VTK image scalars
+
+	def __init__(self, grid, extent, array):
+
+		self.grid = grid
+		self.extent = [int(value) for value in extent]
+		self.array = array
+		self._count = None
+
+	@property
+	def count(self):
+
+		if self._count is None:
+			self._count = int(np.count_nonzero(self.array))
+		return self._count
+
+	@property
+	def volumeCc(self):
+
+		return self.count * self.grid.voxelVolumeMm3 / 1000.0
+
+	def subArray(self, extent):
+
+		# Voxels of this mask inside extent (which must be contained in the mask extent)
+		i0, j0, k0 = extent[0] - self.extent[0], extent[2] - self.extent[2], extent[4] - self.extent[4]
+		return self.array[k0:k0 + extent[5] - extent[4] + 1, j0:j0 + extent[3] - extent[2] + 1, i0:i0 + extent[1] - extent[0] + 1]
+
+def rasterizeSurface(polyData, grid):
+
+	# Voxels whose center is inside the closed surface
+	extent = grid.extentFromBounds(polyData.GetBounds())
+	stencilSource = vtkPolyDataToImageStencil()
+	stencilSource.SetInputData(polyData)
+	stencilSource.SetOutputOrigin(grid.origin)
+	stencilSource.SetOutputSpacing(grid.spacing)
+	stencilSource.SetOutputWholeExtent(extent)
+	stencilToImage = vtkImageStencilToImage()
+	stencilToImage.SetInputConnection(stencilSource.GetOutputPort())
+	stencilToImage.SetInsideValue(1)
+	stencilToImage.SetOutsideValue(0)
+	stencilToImage.SetOutputScalarTypeToUnsignedChar()
+	stencilToImage.Update()
+	image = stencilToImage.GetOutput()
+	dimensions = image.GetDimensions()
+	array = numpy_support.vtk_to_numpy(image.GetPointData().GetScalars()).reshape(dimensions[2], dimensions[1], dimensions[0]).astype(bool)
+	return BinaryMask(grid, extent, array)
+
+def intersectExtents(extent1, extent2):
+
+	extent = [max(extent1[0], extent2[0]), min(extent1[1], extent2[1]),
+		max(extent1[2], extent2[2]), min(extent1[3], extent2[3]),
+		max(extent1[4], extent2[4]), min(extent1[5], extent2[5])]
+	if extent[0] > extent[1] or extent[2] > extent[3] or extent[4] > extent[5]:
+		return None
+	return extent
+
+def intersectionCount(mask1, mask2):
+
+	extent = intersectExtents(mask1.extent, mask2.extent)
+	if extent is None:
+		return 0
+	return int(np.count_nonzero(mask1.subArray(extent) & mask2.subArray(extent)))
+
+def diceCoefficient(mask1, mask2):
+
+	total = mask1.count + mask2.count
+	if total == 0:
+		return float('nan')  # both masks are empty
+	return 2.0 * intersectionCount(mask1, mask2) / total
@@ -0,0 +1,95 @@
+#
+# MyModuleLib: decimated display meshes for the distance color map
+#
+# Large surfaces are replaced for display by a mesh of at most triangleBudget triangles, obtained by
+# vertex clustering on a cubic grid (vtkQuadricClustering, linear time). The 'Distance' values of the
+# full-resolution surface are interpolated at the decimated vertices (inverse distance weighting of
+# the closest full-resolution vertices), so the colors match the full mesh while statistics keep
+# using the full-resolution values.
+#
+
+import logging
+
+import numpy as np
+from vtkmodules.vtkCommonDataModel import vtkPolyData, vtkStaticPointLocator
+from vtkmodules.vtkFiltersCore import vtkQuadricClustering
+from vtkmodules.vtkFiltersPoints import vtkPointInterpolator, vtkShepardKernel
+
+from MyModuleLib import DistanceEngines
+
+DEFAULT_TRIANGLE_BUDGET = 200000
+
+# Triangles produced by clustering a closed surface per squared cell size and unit area (measured on
+# spheres); used to choose the first cell size, which is then corrected with the obtained count
+TRIANGLES_PER_CELL_AREA = 2.6
+
+# Full-resolution vertices used to interpolate each decimated vertex
+INTERPOLATION_POINTS = 4
+
+def surfaceArea(polyData):
+
+	points = DistanceEngines.polyDataPoints(polyData)
+	triangles = DistanceEngines.polyDataTriangles(polyData)
+	a, b, c = points[triangles[:, 0]], points[triangles[:, 1]], points[triangles[:, 2]]
+	return 0.5 * float(np.linalg.norm(np.cross(b - a, c - a), axis=1).sum())
+
+def clusterSurface(polyData, cellSizeMm):
+
+	bounds = np.array(polyData.GetBounds()).reshape(3, 2)
+	divisions = [max(1, int(np.ceil((upper - lower) / cellSizeMm))) for lower, upper in bounds]
+	clustering = vtkQuadricClustering()
+	clustering.SetInputData(polyData)
+	clustering.AutoAdjustNumberOfDivisionsOff()
+	clustering.SetNumberOfDivisions(divisions)
+	clustering.Update()
+	return clustering.GetOutput()
+
+def decimateToBudget(polyData, triangleBudget=DEFAULT_TRIANGLE_BUDGET, maximumAttempts=4):
+
+	# Geometry only (no point data); the surface itself if it is already within the budget. If the budget
+	# is still exceeded after maximumAttempts, a warning is logged and the last mesh is returned.
+	numberOfTriangles = polyData.GetNumberOfPolys() + polyData.GetNumberOfStrips()
+	if numberOfTriangles <= triangleBudget:
+		return polyData
+	cellSizeMm = np.sqrt(TRIANGLES_PER_CELL_AREA * surfaceArea(polyData) / triangleBudget)
+	for attempt in range(maximumAttempts):
+		decimated = clusterSurface(polyData, cellSizeMm)
+		if decimated.GetNumberOfPolys() <= triangleBudget:
+			break
+		# The number of triangles scales with the inverse squared cell size
+		cellSizeMm *= 1.02 * np.sqrt(decimated.GetNumberOfPolys() / float(triangleBudget))
+	else:
+		logging.warning('Decimated surface has %d triangles after %d attempts, above the budget of %d triangles'
+			% (decimated.GetNumberOfPolys(), maximumAttempts, triangleBudget))
+	return decimated
+
+def interpolatePointArray(polyData, sourcePolyData, arrayName='Distance'):
+
+	# Copy of polyData with arrayName interpolated from the vertices of sourcePolyData
+	source = vtkPolyData()
+	source.SetPoints(sourcePolyData.GetPoints())
+	source.GetPointData().AddArray(sourcePolyData.GetPointData().GetArray(arrayName))
+	locator = vtkStaticPointLocator()
+	locator.SetDataSet(source)
+	locator.BuildLocator()
+	kernel = vtkShepardKernel()
+	kernel.SetKernelFootprintToNClosest()
+	kernel.SetNumberOfPoints(INTERPOLATION_POINTS)
+	kernel.SetPowerParameter(2.0)
+	interpolator = vtkPointInterpolator()
+	interpolator.SetInputData(polyData)
+	interpolator.SetSourceData(source)
+	interpolator.SetKernel(kernel)
+	interpolator.SetLocator(locator)
+	interpolator.Update()
+	output = vtkPolyData()
+	output.ShallowCopy(interpolator.GetOutput())
+	output.GetPointData().RemoveArray(interpolator.GetValidPointsMaskArrayName())
+	return output
+
+def decimateDistancePolyData(distancePolyData, triangleBudget=DEFAULT_TRIANGLE_BUDGET, arrayName='Distance'):
+
+	# Display mesh of a distance map: decimated geometry with the interpolated distances
+	if distancePolyData.GetNumberOfPolys() + distancePolyData.GetNumberOfStrips() <= triangleBudget:
+		return distancePolyData
+	return interpolatePointArray(decimateToBudget(distancePolyData, triangleBudget), distancePolyData, arrayName)
@@ -0,0 +1,280 @@
+#
+# MyModuleLib: content-addressed cache of surfaces and labelmaps
+#
+# Entries are keyed by a hash of the content they were computed from (file bytes or surface
+# geometry) and of the conversion parameters. They are kept in memory (least recently used
+# entries are evicted above memoryLimitBytes) and, if a cache directory is given, on disk
+# (surfaces as .vtp, arrays as .npz; oldest files are removed above diskLimitBytes). Mapped arrays
+# are saved as .npy and memory-mapped from disk, so they do not count in the memory limit.
+#
+
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from vtkmodules.vtkCommonDataModel import vtkPolyData
+from vtkmodules.vtkIOXML import vtkXMLPolyDataReader, vtkXMLPolyDataWriter
+from vtkmodules.util import numpy_support
+
+POLYDATA = 'polydata'
+ARRAYS = 'arrays'
+MAPPED = 'mapped'
+
+def copyPolyData(polyData):
+
+	polyDataCopy = vtkPolyData()
+	polyDataCopy.DeepCopy(polyData)
+	return polyDataCopy
+
+def polyDataHash(polyData):
+
+	# Hash of the geometry and topology of a surface
+	sha = hashlib.sha1()
+	if polyData.GetPoints() is not None:
+		sha.update(numpy_support.vtk_to_numpy(polyData.GetPoints().GetData()).tobytes())
+	for cellArray in [polyData.GetPolys(), polyData.GetStrips()]:
+		if cellArray.GetNumberOfCells() > 0:
+			# 64-bit copies, so that the hash does not depend on the storage type of the cell arrays
+			for array in [cellArray.GetOffsetsArray(), cellArray.GetConnectivityArray()]:
+				sha.update(numpy_support.vtk_to_numpy(array).astype(np.int64).tobytes())
+	return sha.hexdigest()
+
+def makeKey(contentHash, kind, parameters=None):
+
+	text = contentHash + '|' + kind + '|' + json.dumps(parameters or {}, sort_keys=True)
+	return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+class MeshCache(object):
+
+	def __init__(self, cacheDirectory=None, memoryLimitBytes=1024**3, diskLimitBytes=8 * 1024**3):
+
+		self.cacheDirectory = cacheDirectory
+		if cacheDirectory and not os.path.exists(cacheDirectory):
+			os.makedirs(cacheDirectory)
+		self.memoryLimitBytes = memoryLimitBytes
+		self.diskLimitBytes = diskLimitBytes
+		self.lock = threading.RLock()
+
+		# key -> (kind, value, size in bytes), most recently used last
+		self.memoryEntries = OrderedDict()
+		self.memorySize = 0
+
+		# path -> ((size, modification time), hash), so that unchanged files are hashed only once
+		self.fileHashes = {}
+
+		# Counters
+		self.memoryHits = 0
+		self.diskHits = 0
+		self.misses = 0
+		self.evictions = 0
+
+	#
+	# Keys
+	#
+
+	def fileHash(self, path):
+
+		stat = os.stat(path)
+		signature = (stat.st_size, stat.st_mtime_ns)
+		with self.lock:
+			cached = self.fileHashes.get(path)
+			if cached is not None and cached[0] == signature:
+				return cached[1]
+		sha = hashlib.sha1()
+		with open(path, 'rb') as f:
+			for block in iter(lambda: f.read(1 << 20), b''):
+				sha.update(block)
+		with self.lock:
+			self.fileHashes[path] = (signature, sha.hexdigest())
+		return sha.hexdigest()
+
+	def fileKey(self, path, kind, parameters=None):
+
+		return makeKey(self.fileHash(path), kind, parameters)
+
+	def polyDataKey(self, polyData, kind, parameters=None):
+
+		return makeKey(polyDataHash(polyData), kind, parameters)
+
+	#
+	# Access
+	#
+
+	def getPolyData(self, key):
+
+		# Returns a copy, so that the cached surface is never modified by the caller
+		polyData = self._get(key, POLYDATA)
+		return copyPolyData(polyData) if polyData is not None else None
+
+	def putPolyData(self, key, polyData):
+
+		self._put(key, POLYDATA, copyPolyData(polyData))
+
+	def getArrays(self, key):
+
+		# Dictionary of NumPy arrays (read-only in the cache, copied here)
+		arrays = self._get(key, ARRAYS)
+		return {name: array.copy() for name, array in arrays.items()} if arrays is not None else None
+
+	def putArrays(self, key, arrays):
+
+		self._put(key, ARRAYS, {name: np.array(array) for name, array in arrays.items()})
+
+	def getMappedArray(self, key):
+
+		# Read-only array, memory-mapped when the cache has a directory
+		return self._get(key, MAPPED)
+
+	def putMappedArray(self, key, array):
+
+		# Returns the array to use instead of the given one: the memory-mapped file if it could be written
+		self._writeToDisk(key, MAPPED, array)
+		mapped = self._readFromDisk(key, MAPPED)
+		value = mapped if mapped is not None else np.array(array)
+		value.flags.writeable = False
+		with self.lock:
+			self._putInMemory(key, MAPPED, value)
+		return value
+
+	def statistics(self):
+
+		with self.lock:
+			return {'memoryHits': self.memoryHits, 'diskHits': self.diskHits, 'misses': self.misses,
+				'evictions': self.evictions, 'memoryEntries': len(self.memoryEntries), 'memoryBytes': self.memorySize}
+
+	def clear(self, disk=False):
+
+		with self.lock:
+			self.memoryEntries.clear()
+			self.memorySize = 0
+			if disk and self.cacheDirectory:
+				for fileName in os.listdir(self.cacheDirectory):
+					os.remove(os.path.join(self.cacheDirectory, fileName))
+
+	#
+	# Memory level
+	#
+
+	def _get(self, key, kind):
+
+		with self.lock:
+			entry = self.memoryEntries.get(key)
+			if entry is not None:
+				self.memoryEntries.move_to_end(key)
+				self.memoryHits += 1
+				return entry[1]
+		value = self._readFromDisk(key, kind)
+		with self.lock:
+			if value is None:
+				self.misses += 1
+				return None
+			self.diskHits += 1
+			self._putInMemory(key, kind, value)
+		return value
+
+	def _put(self, key, kind, value):
+
+		with self.lock:
+			self._putInMemory(key, kind, value)
+		self._writeToDisk(key, kind, value)
+
+	def _putInMemory(self, key, kind, value):
+
+		if key in self.memoryEntries:
+			self.memorySize -= self.memoryEntries.pop(key)[2]
+		size = self._sizeInBytes(kind, value)
+		if size > self.memoryLimitBytes:
+			return
+		self.memoryEntries[key] = (kind, value, size)
+		self.memorySize += size
+		while self.memorySize > self.memoryLimitBytes:
+			evictedKey, (evictedKind, evictedValue, evictedSize) = self.memoryEntries.popitem(last=False)
+			self.memorySize -= evictedSize
+			self.evictions += 1
+
+	def _sizeInBytes(self, kind, value):
+
+		if kind == POLYDATA:
+			return value.GetActualMemorySize() * 1024
+		if kind == MAPPED:
+			return 0 if isinstance(value, np.memmap) else value.nbytes
+		return sum(array.nbytes for array in value.values())
+
+	#
+	# Disk level
+	#
+
+	def _filePath(self, key, kind):
+
+		return os.path.join(self.cacheDirectory, key + {POLYDATA: '.vtp', ARRAYS: '.npz', MAPPED: '.npy'}[kind])
+
+	def _readFromDisk(self, key, kind):
+
+		if not self.cacheDirectory:
+			return None
+		filePath = self._filePath(key, kind)
+		if not os.path.exists(filePath):
+			return None
+		try:
+			os.utime(filePath)  # mark as recently used
+			if kind == POLYDATA:
+				reader = vtkXMLPolyDataReader()
+				reader.SetFileName(filePath)
+				reader.Update()
+				return reader.GetOutput()
+			if kind == MAPPED:
+				return np.load(filePath, mmap_mode='r')
+			with np.load(filePath) as npzFile:
+				return {name: npzFile[name] for name in npzFile.files}
+		except (OSError, ValueError):
+			return None  # evicted by another process meanwhile
+
+	def _writeToDisk(self, key, kind, value):
+
+		if not self.cacheDirectory:
+			return
+		filePath = self._filePath(key, kind)
+		# Several processes (batch workers) may share the cache directory
+		temporaryPath = filePath + '.%d.%d.tmp' % (os.getpid(), threading.get_ident())
+		if kind == POLYDATA:
+			writer = vtkXMLPolyDataWriter()
+			writer.SetFileName(temporaryPath)
+			writer.SetInputData(value)
+			writer.SetDataModeToAppended()
+			writer.SetCompressorTypeToNone()  # faster to read back than compressed data
+			writer.Write()
+		elif kind == MAPPED:
+			with open(temporaryPath, 'wb') as f:
+				np.save(f, value)
+		else:
+			with open(temporaryPath, 'wb') as f:
+				np.savez(f, **value)
+		os.replace(temporaryPath, filePath)
+		self._limitDiskSize()
+
+	def _limitDiskSize(self):
+
+		with self.lock:
+			entries = []
+			for fileName in os.listdir(self.cacheDirectory):
+				if fileName.endswith('.tmp'):
+					continue
+				filePath = os.path.join(self.cacheDirectory, fileName)
+				try:
+					stat = os.stat(filePath)
+				except OSError:
+					continue  # removed by another process
+				entries.append((stat.st_mtime, stat.st_size, filePath))
+			totalSize = sum(entry[1] for entry in entries)
+			for modificationTime, size, filePath in sorted(entries):
+				if totalSize <= self.diskLimitBytes:
+					break
+				try:
+					os.remove(filePath)
+				except OSError:
+					pass
+				totalSize -= size
+				self.evictions += 1
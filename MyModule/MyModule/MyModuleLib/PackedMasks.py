@@ -0,0 +1,309 @@
+#
+# MyModuleLib: bit-packed binary masks for Dice and volumes
+#
+# The masks of a pair of segments are rasterized on a common grid (see Labelmaps.py), cropped to the
+# union of both bounding boxes and stored with one bit per voxel: 8 times less memory than a byte
+# labelmap. Both masks of a pair then have the same layout, so the intersection is a bitwise AND
+# followed by a population count, computed slab by slab without unpacking.
+#
+# Packed masks can be kept in a MeshCache: with a cache directory they are saved as .npy files and
+# memory-mapped back, so a revisited case reads only the pages it needs and rasterizes nothing.
+#
+# Surfaces are rasterized slab by slab straight into the packed rows, so the memory used is the packed
+# masks plus a few slabs. Without an explicit voxel size, the resolution is adapted to the segments:
+# the first voxel size is a fraction of the smaller segment thickness (volume / area), then voxels are
+# halved until the Dice coefficient changes by less than a target or the next masks would not fit in a
+# memory budget. The discretization error reported with each result is the change of the Dice
+# coefficient from voxels twice as large; the error decreases at least with the square of the voxel
+# size, so this overestimates the error of the result. Each level costs 8 times less than the next.
+#
+
+import numpy as np
+from vtkmodules.vtkFiltersCore import vtkMassProperties
+from vtkmodules.vtkImagingStencil import vtkImageStencilToImage, vtkPolyDataToImageStencil
+from vtkmodules.util import numpy_support
+
+from MyModuleLib import DistanceEngines
+from MyModuleLib import Labelmaps
+
+# Slices processed at once by rasterizing, packing and counting (bounds temporary memory)
+SLAB_BYTES = 16 * 1024**2
+
+# Temporary memory of the slab-wise rasterization (stencil image, boolean slab, packed rows)
+RASTERIZATION_BYTES = 3 * SLAB_BYTES
+
+# Automatic voxel size
+DEFAULT_MEMORY_BUDGET_BYTES = 512 * 1024**2
+DEFAULT_TARGET_DICE_ERROR = 0.001
+MINIMUM_VOXEL_SIZE_MM = 0.02
+MAXIMUM_VOXEL_SIZE_MM = 2.0
+VOXELS_PER_THICKNESS = 4  # first voxel size: thickness (volume / area) of the smaller segment / 4
+
+if hasattr(np, 'bitwise_count'):
+	def popcount(bits):
+		return int(np.bitwise_count(bits).sum(dtype=np.int64))
+else:
+	POPCOUNT_TABLE = np.array([bin(value).count('1') for value in range(256)], dtype=np.uint8)
+	def popcount(bits):
+		return int(POPCOUNT_TABLE[bits.view(np.uint8)].sum(dtype=np.int64))
+
+class PackedMask(object):
+
+	# Voxels of an extent of the grid, one row of bits per slice k. Each row holds the (j, i) voxels of
+	# the slice in order, padded with zeros to a multiple of 64 bits.
+
+	def __init__(self, grid, extent, bits):
+
+		self.grid = grid
+		self.extent = [int(value) for value in extent]
+		self.bits = bits
+		self._count = None
+
+	@property
+	def shape(self):
+
+		return (self.extent[5] - self.extent[4] + 1, self.extent[3] - self.extent[2] + 1, self.extent[1] - self.extent[0] + 1)
+
+	@property
+	def nbytes(self):
+
+		return self.bits.nbytes
+
+	@property
+	def count(self):
+
+		if self._count is None:
+			self._count = sum(popcount(slab) for slab in slabs(self.bits))
+		return self._count
+
+	@property
+	def volumeCc(self):
+
+		return self.count * self.grid.voxelVolumeMm3 / 1000.0
+
+	def toArray(self):
+
+		# Unpacked boolean array indexed [k, j, i]
+		numberOfSlices, rows, columns = self.shape
+		return np.unpackbits(np.asarray(self.bits), axis=1)[:, :rows * columns].reshape(self.shape).astype(bool)
+
+def slabs(bits):
+
+	# Consecutive groups of slices of about SLAB_BYTES
+	slicesPerSlab = max(1, SLAB_BYTES // max(1, bits.shape[1]))
+	for start in range(0, bits.shape[0], slicesPerSlab):
+		yield bits[start:start + slicesPerSlab]
+
+def bytesPerSlice(extent):
+
+	voxels = (extent[1] - extent[0] + 1) * (extent[3] - extent[2] + 1)
+	return (voxels + 63) // 64 * 8
+
+def unionExtent(extent1, extent2):
+
+	return [min(extent1[0], extent2[0]), max(extent1[1], extent2[1]),
+		min(extent1[2], extent2[2]), max(extent1[3], extent2[3]),
+		min(extent1[4], extent2[4]), max(extent1[5], extent2[5])]
+
+def emptyBits(extent):
+
+	return np.zeros((extent[5] - extent[4] + 1, bytesPerSlice(extent)), dtype=np.uint8)
+
+def packSlab(bits, extent, subExtent, array):
+
+	# Writes the voxels of array (indexed [k, j, i] over subExtent, contained in extent) into the rows of bits
+	rows, columns = extent[3] - extent[2] + 1, extent[1] - extent[0] + 1
+	k0, j0, i0 = subExtent[4] - extent[4], subExtent[2] - extent[2], subExtent[0] - extent[0]
+	slab = np.zeros((array.shape[0], rows, columns), dtype=bool)
+	slab[:, j0:j0 + array.shape[1], i0:i0 + array.shape[2]] = array
+	packed = np.packbits(slab.reshape(array.shape[0], rows * columns), axis=1)
+	bits[k0:k0 + array.shape[0], :packed.shape[1]] = packed
+
+def slicesPerSlab(extent):
+
+	return max(1, SLAB_BYTES // max(1, (extent[3] - extent[2] + 1) * (extent[1] - extent[0] + 1)))
+
+def packMask(mask, extent=None):
+
+	# Packed copy of a BinaryMask in extent (which must contain the mask extent)
+	extent = mask.extent if extent is None else [int(value) for value in extent]
+	bits = emptyBits(extent)
+	numberOfSlices = mask.extent[5] - mask.extent[4] + 1
+	for start in range(0, numberOfSlices, slicesPerSlab(extent)):
+		stop = min(numberOfSlices, start + slicesPerSlab(extent))
+		subExtent = mask.extent[:4] + [mask.extent[4] + start, mask.extent[4] + stop - 1]
+		packSlab(bits, extent, subExtent, mask.array[start:stop])
+	return PackedMask(mask.grid, extent, bits)
+
+def rasterizePacked(polyData, grid, extent):
+
+	# Packed mask of a closed surface in extent (which must contain its bounding box), rasterized by
+	# slabs of slices so that no full byte labelmap is created. One stencil pipeline is used for all
+	# slabs, and each slab only gets the triangles spanning its z range: the stencil cuts every
+	# triangle of its input at each slice, so the whole surface would be cut at every slice otherwise.
+	surfaceExtent = grid.extentFromBounds(polyData.GetBounds())
+	bits = emptyBits(extent)
+	singleSlab = surfaceExtent[5] - surfaceExtent[4] + 1 <= slicesPerSlab(extent)
+	if not singleSlab:
+		points = DistanceEngines.polyDataPoints(polyData)
+		triangles = DistanceEngines.polyDataTriangles(polyData)
+		triangleZ = points[:, 2][triangles]
+		triangleMinimumZ, triangleMaximumZ = triangleZ.min(axis=1), triangleZ.max(axis=1)
+	stencilSource = vtkPolyDataToImageStencil()
+	stencilSource.SetOutputOrigin(grid.origin)
+	stencilSource.SetOutputSpacing(grid.spacing)
+	stencilToImage = vtkImageStencilToImage()
+	stencilToImage.SetInputConnection(stencilSource.GetOutputPort())
+	stencilToImage.SetInsideValue(1)
+	stencilToImage.SetOutsideValue(0)
+	stencilToImage.SetOutputScalarTypeToUnsignedChar()
+	for sliceStart in range(surfaceExtent[4], surfaceExtent[5] + 1, slicesPerSlab(extent)):
+		subExtent = surfaceExtent[:4] + [sliceStart, min(surfaceExtent[5], sliceStart + slicesPerSlab(extent) - 1)]
+		if singleSlab:
+			stencilSource.SetInputData(polyData)
+		else:
+			# Triangles reaching the slice planes of the slab (with a margin for rounding)
+			margin = 1e-3 * grid.spacing[2]
+			lowerZ = grid.origin[2] + subExtent[4] * grid.spacing[2] - margin
+			upperZ = grid.origin[2] + subExtent[5] * grid.spacing[2] + margin
+			slabTriangles = triangles[(triangleMaximumZ >= lowerZ) & (triangleMinimumZ <= upperZ)]
+			if len(slabTriangles) == 0:
+				continue
+			stencilSource.SetInputData(DistanceEngines.polyDataFromArrays(points, slabTriangles))
+		stencilSource.SetOutputWholeExtent(subExtent)
+		stencilToImage.Update()
+		image = stencilToImage.GetOutput()
+		dimensions = image.GetDimensions()
+		array = numpy_support.vtk_to_numpy(image.GetPointData().GetScalars()).reshape(dimensions[2], dimensions[1], dimensions[0])
+		packSlab(bits, extent, subExtent, array)
+	return PackedMask(grid, extent, bits)
+
+def intersectionCount(mask1, mask2):
+
+	if mask1.extent != mask2.extent or mask1.bits.shape != mask2.bits.shape:
+		raise ValueError('Packed masks must have the same extent')
+	total = 0
+	for slab1, slab2 in zip(slabs(mask1.bits), slabs(mask2.bits)):
+		total += popcount(np.bitwise_and(slab1.view(np.uint64), slab2.view(np.uint64)))
+	return total
+
+def diceCoefficient(mask1, mask2):
+
+	total = mask1.count + mask2.count
+	if total == 0:
+		return float('nan')  # both masks are empty
+	return 2.0 * intersectionCount(mask1, mask2) / total
+
+#
+# Voxel size
+#
+
+def surfaceProperties(polyData):
+
+	# Area (mm2) and enclosed volume (mm3) of a closed surface
+	massProperties = vtkMassProperties()
+	massProperties.SetInputData(polyData)
+	massProperties.Update()
+	return massProperties.GetSurfaceArea(), massProperties.GetVolume()
+
+def pairGeometry(polyData1, polyData2, voxelSizeMm):
+
+	# Grid shared by both masks and their common extent (union of both bounding boxes)
+	grid = Labelmaps.gridForSurfaces([polyData1, polyData2], voxelSizeMm)
+	extent = unionExtent(grid.extentFromBounds(polyData1.GetBounds()), grid.extentFromBounds(polyData2.GetBounds()))
+	return grid, extent
+
+def pairMaskBytes(polyData1, polyData2, voxelSizeMm):
+
+	# Memory of both packed masks
+	grid, extent = pairGeometry(polyData1, polyData2, voxelSizeMm)
+	return 2 * (extent[5] - extent[4] + 1) * bytesPerSlice(extent)
+
+def pairBytes(polyData1, polyData2, voxelSizeMm):
+
+	# Memory of both packed masks and of the rasterization
+	return pairMaskBytes(polyData1, polyData2, voxelSizeMm) + RASTERIZATION_BYTES
+
+def initialVoxelSize(surfaceAreasAndVolumes, memoryBudgetBytes, polyData1, polyData2):
+
+	# The rasterization memory does not depend on the voxel size: only the masks are compared with
+	# what the budget leaves for them, and voxels grow up to MAXIMUM_VOXEL_SIZE_MM
+	maskBudgetBytes = memoryBudgetBytes - RASTERIZATION_BYTES
+	thickness = min(volume / max(area, 1e-12) for area, volume in surfaceAreasAndVolumes)
+	voxelSizeMm = float(np.clip(thickness / VOXELS_PER_THICKNESS, MINIMUM_VOXEL_SIZE_MM, MAXIMUM_VOXEL_SIZE_MM))
+	while pairMaskBytes(polyData1, polyData2, voxelSizeMm) > maskBudgetBytes:
+		if voxelSizeMm >= MAXIMUM_VOXEL_SIZE_MM:
+			raise ValueError('Memory budget of %g MB too small: the masks need %g MB with %g mm voxels, plus %g MB for the rasterization'
+				% (memoryBudgetBytes / 1024.0**2, pairMaskBytes(polyData1, polyData2, voxelSizeMm) / 1024.0**2, voxelSizeMm,
+				RASTERIZATION_BYTES / 1024.0**2))
+		voxelSizeMm = min(voxelSizeMm * 1.25, MAXIMUM_VOXEL_SIZE_MM)
+	return voxelSizeMm
+
+#
+# Pairs of surfaces
+#
+
+def packedMasksForPair(polyData1, polyData2, voxelSizeMm=Labelmaps.DEFAULT_VOXEL_SIZE_MM, cache=None):
+
+	# Packed masks of both closed surfaces in the union of their bounding boxes. Returns the masks and
+	# the number of them found in the cache.
+	grid, extent = pairGeometry(polyData1, polyData2, voxelSizeMm)
+	parameters = {'origin': [float(value) for value in grid.origin], 'spacing': [float(value) for value in grid.spacing], 'extent': extent}
+	masks = []
+	cacheHits = 0
+	for polyData in [polyData1, polyData2]:
+		bits = None
+		if cache is not None:
+			cacheKey = cache.polyDataKey(polyData, 'packedMask', parameters)
+			bits = cache.getMappedArray(cacheKey)
+		if bits is not None:
+			cacheHits += 1
+		else:
+			bits = rasterizePacked(polyData, grid, extent).bits
+			if cache is not None:
+				bits = cache.putMappedArray(cacheKey, bits)
+		masks.append(PackedMask(grid, extent, bits))
+	return masks, cacheHits
+
+def diceAtVoxelSize(polyData1, polyData2, voxelSizeMm, cache):
+
+	(mask1, mask2), cacheHits = packedMasksForPair(polyData1, polyData2, voxelSizeMm, cache)
+	return {'dice': diceCoefficient(mask1, mask2), 'referenceVolumeCc': mask1.volumeCc, 'compareVolumeCc': mask2.volumeCc,
+		'voxelSizeMm': voxelSizeMm, 'roiExtent': mask1.extent, 'maskBytes': mask1.nbytes + mask2.nbytes, 'cacheHits': cacheHits}
+
+def computeDice(polyData1, polyData2, voxelSizeMm=None, cache=None, memoryBudgetBytes=DEFAULT_MEMORY_BUDGET_BYTES,
+	targetDiceError=DEFAULT_TARGET_DICE_ERROR, progressCallback=None):
+
+	# Dice and volumes, with the voxel size, the estimated discretization error of the Dice coefficient,
+	# and the difference between the mask volumes and the volumes enclosed by the surfaces. With
+	# voxelSizeMm, only that size and twice that size (for the error) are computed.
+	surfaceAreasAndVolumes = [surfaceProperties(polyData) for polyData in [polyData1, polyData2]]
+	if voxelSizeMm is not None:
+		coarse = diceAtVoxelSize(polyData1, polyData2, 2.0 * voxelSizeMm, cache)
+		result = diceAtVoxelSize(polyData1, polyData2, voxelSizeMm, cache)
+		memoryLimited = False
+	else:
+		result = diceAtVoxelSize(polyData1, polyData2, initialVoxelSize(surfaceAreasAndVolumes, memoryBudgetBytes, polyData1, polyData2), cache)
+		coarse = None
+		memoryLimited = False
+		while True:
+			if coarse is not None and abs(result['dice'] - coarse['dice']) <= targetDiceError:
+				break
+			if result['voxelSizeMm'] / 2.0 < MINIMUM_VOXEL_SIZE_MM:
+				break
+			if pairBytes(polyData1, polyData2, result['voxelSizeMm'] / 2.0) > memoryBudgetBytes:
+				memoryLimited = True
+				break
+			if progressCallback is not None:
+				progressCallback(result['voxelSizeMm'] / 2.0)
+			coarse, result = result, diceAtVoxelSize(polyData1, polyData2, result['voxelSizeMm'] / 2.0, cache)
+		if coarse is None:
+			# No finer level fits: the error is estimated from a coarser one (8 times cheaper)
+			coarse = diceAtVoxelSize(polyData1, polyData2, 2.0 * result['voxelSizeMm'], cache)
+	result['oversamplingFactor'] = Labelmaps.DEFAULT_VOXEL_SIZE_MM / result['voxelSizeMm']
+	result['estimatedDiceError'] = abs(result['dice'] - coarse['dice'])
+	result['memoryLimited'] = memoryLimited
+	result['referenceVolumeErrorCc'] = result['referenceVolumeCc'] - surfaceAreasAndVolumes[0][1] / 1000.0
+	result['compareVolumeErrorCc'] = result['compareVolumeCc'] - surfaceAreasAndVolumes[1][1] / 1000.0
+	result['cacheHits'] += coarse['cacheHits']
+	return result
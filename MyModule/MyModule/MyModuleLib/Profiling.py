@@ -0,0 +1,195 @@
+#
+# MyModuleLib: stage-level profiling
+#
+# A Profiler records named spans (wall time, resident memory delta, thread and attributes such as
+# mesh sizes) and exports them as JSON or as a Chrome trace (chrome://tracing, Perfetto):
+#
+#   with profiler.span('distance', engine='locator') as span:
+#       ...
+#       span.setAttributes(points=n)
+#
+# When the profiler is disabled, span() returns a shared object that does nothing.
+#
+# The environment variable MYMODULE_PROFILE enables profiling: '1' only records spans, a directory
+# also writes MyModuleProfile_<pid>.json and MyModuleProfile_<pid>.trace.json there at exit.
+#
+
+import os
+import json
+import time
+import atexit
+import threading
+
+from MyModuleLib.ResourceUsage import currentRSS
+
+ENVIRONMENT_VARIABLE = 'MYMODULE_PROFILE'
+
+class NullSpan(object):
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, excType, excValue, traceback):
+		return False
+
+	def setAttributes(self, **attributes):
+		pass
+
+NULL_SPAN = NullSpan()
+
+class Span(object):
+
+	def __init__(self, profiler, name, attributes):
+
+		self.profiler = profiler
+		self.name = name
+		self.attributes = attributes
+		self.start = 0.0
+		self.duration = 0.0
+		self.memoryDelta = 0
+		self.depth = 0
+		self.threadId = 0
+		self.error = None
+
+	def setAttributes(self, **attributes):
+
+		self.attributes.update(attributes)
+
+	def __enter__(self):
+
+		stack = self.profiler._threadStack()
+		self.depth = len(stack)
+		stack.append(self)
+		self.threadId = threading.get_ident()
+		self._startRSS = currentRSS()
+		self.start = time.perf_counter()
+		return self
+
+	def __exit__(self, excType, excValue, traceback):
+
+		self.duration = time.perf_counter() - self.start
+		self.memoryDelta = currentRSS() - self._startRSS
+		if excType is not None:
+			self.error = excType.__name__
+		self.profiler._threadStack().pop()
+		self.profiler._record(self)
+		return False
+
+class Profiler(object):
+
+	def __init__(self, enabled=False):
+
+		self.enabled = enabled
+		self.spans = []
+		self.lock = threading.Lock()
+		self.local = threading.local()
+		self.origin = time.perf_counter()
+
+	def span(self, name, **attributes):
+
+		if not self.enabled:
+			return NULL_SPAN
+		return Span(self, name, attributes)
+
+	def clear(self):
+
+		with self.lock:
+			self.spans = []
+		self.origin = time.perf_counter()
+
+	def _threadStack(self):
+
+		stack = getattr(self.local, 'stack', None)
+		if stack is None:
+			stack = self.local.stack = []
+		return stack
+
+	def _record(self, span):
+
+		with self.lock:
+			self.spans.append(span)
+
+	#
+	# Export
+	#
+
+	def records(self):
+
+		with self.lock:
+			spans = sorted(self.spans, key=lambda span: span.start)
+		records = []
+		for span in spans:
+			record = {'name': span.name, 'startSeconds': span.start - self.origin, 'seconds': span.duration,
+				'memoryDeltaMB': span.memoryDelta / 1e6, 'depth': span.depth, 'thread': span.threadId}
+			if span.error:
+				record['error'] = span.error
+			record['attributes'] = dict(span.attributes)
+			records.append(record)
+		return records
+
+	def summary(self):
+
+		# Count, total and maximum time of every span name
+		summary = {}
+		for record in self.records():
+			entry = summary.setdefault(record['name'], {'count': 0, 'totalSeconds': 0.0, 'maxSeconds': 0.0, 'maxMemoryDeltaMB': 0.0})
+			entry['count'] += 1
+			entry['totalSeconds'] += record['seconds']
+			entry['maxSeconds'] = max(entry['maxSeconds'], record['seconds'])
+			entry['maxMemoryDeltaMB'] = max(entry['maxMemoryDeltaMB'], record['memoryDeltaMB'])
+		return summary
+
+	def writeJSON(self, path):
+
+		with open(path, 'w') as jsonFile:
+			json.dump({'summary': self.summary(), 'spans': self.records()}, jsonFile, indent=1, default=str)
+
+	def writeChromeTrace(self, path):
+
+		# Complete events ('X') in microseconds, one track per thread
+		processId = os.getpid()
+		events = []
+		for record in self.records():
+			arguments = dict(record['attributes'])
+			arguments['memoryDeltaMB'] = record['memoryDeltaMB']
+			if 'error' in record:
+				arguments['error'] = record['error']
+			events.append({'name': record['name'], 'cat': 'MyModule', 'ph': 'X', 'pid': processId, 'tid': record['thread'],
+				'ts': record['startSeconds'] * 1e6, 'dur': record['seconds'] * 1e6, 'args': arguments})
+		with open(path, 'w') as traceFile:
+			json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, traceFile, default=str)
+
+	def printSummary(self):
+
+		for name, entry in sorted(self.summary().items(), key=lambda item: -item[1]['totalSeconds']):
+			print('%-32s %5d x %9.3f s (max %8.3f s, max memory delta %8.1f MB)' % (name, entry['count'],
+				entry['totalSeconds'], entry['maxSeconds'], entry['maxMemoryDeltaMB']))
+
+def meshSize(polyData):
+
+	# Attributes describing a surface
+	if polyData is None:
+		return {}
+	return {'points': polyData.GetNumberOfPoints(), 'cells': polyData.GetNumberOfCells()}
+
+def profilerFromEnvironment():
+
+	value = os.environ.get(ENVIRONMENT_VARIABLE, '')
+	if value.lower() in ['', '0', 'false', 'off']:
+		return Profiler(False)
+	profiler = Profiler(True)
+	if value.lower() not in ['1', 'true', 'on']:
+		outputDirectory = value
+		def writeProfile():
+			if not profiler.spans:
+				return
+			if not os.path.isdir(outputDirectory):
+				os.makedirs(outputDirectory)
+			prefix = os.path.join(outputDirectory, 'MyModuleProfile_%d' % os.getpid())
+			profiler.writeJSON(prefix + '.json')
+			profiler.writeChromeTrace(prefix + '.trace.json')
+		atexit.register(writeProfile)
+	return profiler
+
+# Profiler shared by the module logic
+defaultProfiler = profilerFromEnvironment()
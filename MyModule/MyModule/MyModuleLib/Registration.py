@@ -0,0 +1,145 @@
+#
+# MyModuleLib: rigid registration of surfaces
+#
+# Initial pose from the principal axes of both point sets, then point-to-point ICP from coarse to
+# fine random point samples. Nearest neighbours are found with a SciPy KD-tree when available, or
+# with blockwise NumPy distance computations otherwise.
+#
+
+import numpy as np
+
+from MyModuleLib import Backends
+
+# Number of moving points used at each resolution level (smaller samples without SciPy). The fixed
+# points are sampled once, four times the finest level, so that candidate poses are compared on a
+# dense fixed surface.
+DEFAULT_LEVELS = (2000, 8000, 32000)
+BRUTE_FORCE_LEVELS = (500, 1000, 2000)
+
+class NearestNeighbourSearch(object):
+
+	def __init__(self, points, blockSize=1024):
+
+		self.points = points
+		self.blockSize = blockSize
+		kdTree = Backends.kdTreeClass()
+		self.tree = kdTree(points) if kdTree is not None else None
+		self.squaredNorms = (points ** 2).sum(axis=1)
+
+	def query(self, queryPoints):
+
+		# Distance and index of the closest point for every query point
+		if self.tree is not None:
+			return self.tree.query(queryPoints)
+		distances = np.empty(len(queryPoints))
+		indices = np.empty(len(queryPoints), dtype=np.int64)
+		for start in range(0, len(queryPoints), self.blockSize):
+			block = queryPoints[start:start + self.blockSize]
+			squaredDistances = (block ** 2).sum(axis=1)[:, None] - 2.0 * block.dot(self.points.T) + self.squaredNorms[None, :]
+			blockIndices = squaredDistances.argmin(axis=1)
+			indices[start:start + len(block)] = blockIndices
+			distances[start:start + len(block)] = np.sqrt(np.maximum(squaredDistances[np.arange(len(block)), blockIndices], 0.0))
+		return distances, indices
+
+def matrixFromRotationTranslation(rotation, translation):
+
+	matrix = np.eye(4)
+	matrix[:3, :3] = rotation
+	matrix[:3, 3] = translation
+	return matrix
+
+def transformPoints(matrix, points):
+
+	return points.dot(matrix[:3, :3].T) + matrix[:3, 3]
+
+def bestRigidTransform(sourcePoints, targetPoints):
+
+	# Least-squares rotation and translation mapping source onto target (Kabsch)
+	sourceCenter = sourcePoints.mean(axis=0)
+	targetCenter = targetPoints.mean(axis=0)
+	covariance = (sourcePoints - sourceCenter).T.dot(targetPoints - targetCenter)
+	u, s, vt = np.linalg.svd(covariance)
+	correction = np.diag([1.0, 1.0, np.sign(np.linalg.det(vt.T.dot(u.T)))])
+	rotation = vt.T.dot(correction).dot(u.T)
+	return matrixFromRotationTranslation(rotation, targetCenter - rotation.dot(sourceCenter))
+
+def principalAxes(points):
+
+	# Centroid and principal axes (columns, decreasing variance) forming a right-handed frame
+	center = points.mean(axis=0)
+	eigenvalues, eigenvectors = np.linalg.eigh(np.cov((points - center).T))
+	axes = eigenvectors[:, ::-1]
+	if np.linalg.det(axes) < 0:
+		axes[:, 2] = -axes[:, 2]
+	return center, axes
+
+def initialTransforms(movingPoints, fixedPoints):
+
+	# Identity plus the four proper rotations aligning the principal axes (axis signs are ambiguous)
+	movingCenter, movingAxes = principalAxes(movingPoints)
+	fixedCenter, fixedAxes = principalAxes(fixedPoints)
+	transforms = [np.eye(4)]
+	for signs in [(1, 1, 1), (1, -1, -1), (-1, 1, -1), (-1, -1, 1)]:
+		rotation = fixedAxes.dot(np.diag(signs)).dot(movingAxes.T)
+		transforms.append(matrixFromRotationTranslation(rotation, fixedCenter - rotation.dot(movingCenter)))
+	return transforms
+
+def icp(movingPoints, fixedSearch, initialMatrix, maxIterations=50, tolerance=1e-6, inlierFraction=0.9):
+
+	# Point-to-point ICP; the worst (1 - inlierFraction) pairs are ignored at each iteration
+	matrix = initialMatrix
+	previousRMS = np.inf
+	rms = np.inf
+	iteration = 0
+	numberOfInliers = max(3, int(inlierFraction * len(movingPoints)))
+	for iteration in range(1, maxIterations + 1):
+		transformedPoints = transformPoints(matrix, movingPoints)
+		distances, indices = fixedSearch.query(transformedPoints)
+		rms = np.sqrt(np.mean(distances ** 2))
+		if previousRMS - rms < tolerance * max(previousRMS, 1.0) and iteration > 1:
+			break
+		previousRMS = rms
+		inliers = np.argpartition(distances, numberOfInliers - 1)[:numberOfInliers]
+		update = bestRigidTransform(transformedPoints[inliers], fixedSearch.points[indices[inliers]])
+		matrix = update.dot(matrix)
+	return matrix, rms, iteration
+
+def samplePoints(points, numberOfSamples, randomState):
+
+	if len(points) <= numberOfSamples:
+		return np.asarray(points, dtype=np.float64)
+	return np.asarray(points[randomState.choice(len(points), numberOfSamples, replace=False)], dtype=np.float64)
+
+def rigidRegistration(movingPoints, fixedPoints, levels=None, maxIterations=50, tolerance=1e-6, seed=0, progressCallback=None):
+
+	# Rigid transform (4x4 matrix) mapping movingPoints onto fixedPoints.
+	# Results only depend on the inputs and the seed. progressCallback(fraction) is called after
+	# every ICP run; an exception raised by it stops the registration.
+	levels = levels or (DEFAULT_LEVELS if Backends.kdTreeClass() is not None else BRUTE_FORCE_LEVELS)
+	randomState = np.random.RandomState(seed)
+	totalIterations = 0
+
+	fixedSearch = NearestNeighbourSearch(samplePoints(fixedPoints, 4 * levels[-1], randomState))
+
+	# Coarsest level: run every initial pose and keep the best one
+	movingSample = samplePoints(movingPoints, levels[0], randomState)
+	bestMatrix, bestRMS = None, np.inf
+	initialMatrices = initialTransforms(movingSample, fixedSearch.points)
+	numberOfRuns = float(len(initialMatrices) + len(levels) - 1)
+	for runIndex, initialMatrix in enumerate(initialMatrices, 1):
+		matrix, rms, iterations = icp(movingSample, fixedSearch, initialMatrix, maxIterations, tolerance)
+		totalIterations += iterations
+		if rms < bestRMS:
+			bestMatrix, bestRMS = matrix, rms
+		if progressCallback is not None:
+			progressCallback(runIndex / numberOfRuns)
+
+	# Finer levels refine the best pose
+	for levelIndex, numberOfSamples in enumerate(levels[1:], 1):
+		movingSample = samplePoints(movingPoints, numberOfSamples, randomState)
+		bestMatrix, bestRMS, iterations = icp(movingSample, fixedSearch, bestMatrix, maxIterations, tolerance)
+		totalIterations += iterations
+		if progressCallback is not None:
+			progressCallback((len(initialMatrices) + levelIndex) / numberOfRuns)
+
+	return {'matrix': bestMatrix, 'rmsResidual': float(bestRMS), 'iterations': totalIterations}
@@ -0,0 +1,71 @@
+#
+# MyModuleLib: process time and memory usage helpers
+#
+
+import os
+import sys
+import time
+import threading
+
+try:
+	import psutil
+except ImportError:
+	psutil = None
+
+def currentRSS():
+
+	# Resident memory of this process in bytes
+	if psutil is not None:
+		return psutil.Process().memory_info().rss
+	if os.path.exists('/proc/self/statm'):
+		with open('/proc/self/statm') as statmFile:
+			return int(statmFile.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+	try:
+		import resource
+	except ImportError:
+		return 0
+	# Only the peak is available here (kB on Linux, bytes on macOS)
+	maxRSS = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	return maxRSS if sys.platform == 'darwin' else maxRSS * 1024
+
+class PeakMemorySampler(object):
+
+	# Context manager measuring wall time and the peak resident memory above the starting point.
+	# Memory is sampled from a background thread, so allocations made by VTK/C++ code are included.
+
+	def __init__(self, interval=0.005):
+
+		self.interval = interval
+		self.startRSS = 0
+		self.peakRSS = 0
+		self.elapsedSeconds = 0.0
+		self._stopEvent = threading.Event()
+		self._thread = None
+
+	@property
+	def peakDelta(self):
+
+		return max(0, self.peakRSS - self.startRSS)
+
+	def _sample(self):
+
+		while not self._stopEvent.wait(self.interval):
+			self.peakRSS = max(self.peakRSS, currentRSS())
+
+	def __enter__(self):
+
+		self.startRSS = self.peakRSS = currentRSS()
+		self._stopEvent.clear()
+		self._thread = threading.Thread(target=self._sample)
+		self._thread.daemon = True
+		self._thread.start()
+		self._startTime = time.perf_counter()
+		return self
+
+	def __exit__(self, excType, excValue, traceback):
+
+		self.elapsedSeconds = time.perf_counter() - self._startTime
+		self._stopEvent.set()
+		self._thread.join()
+		self.peakRSS = max(self.peakRSS, currentRSS())
+		return False
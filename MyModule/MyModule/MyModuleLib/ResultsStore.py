@@ -0,0 +1,165 @@
+#
+# MyModuleLib: indexed store of comparison results (SQLite)
+#
+# Every result is one row: case, segment pair, metric, value, and the engine and parameters that
+# produced it (plus the software that created the compared segment, and the time). A result computed
+# again with the same key replaces the previous one. The database uses write-ahead logging, so that
+# readers (queries, CSV export) do not block a running batch.
+#
+#   store = ResultsStore('results.sqlite')
+#   store.addMetrics('case1', 'liver/ref', 'liver/auto', {'dice': 0.93, 'hausdorff95Mm': 2.1}, engine='segmentComparison')
+#   store.query(metric='dice', maxValue=0.9)               # cases with Dice < 0.9
+#   store.trend('hausdorff95Mm', software='SoftwareX')     # HD95 over time for one software
+#   store.exportCSV('results.csv', metric='dice')
+#
+
+import os
+import csv
+import json
+import time
+import sqlite3
+import threading
+
+RESULT_COLUMNS = ['caseId', 'segment1', 'segment2', 'metric', 'value', 'engine', 'parameters', 'software', 'createdAt']
+
+SCHEMA = [
+	'''CREATE TABLE IF NOT EXISTS results (
+		caseId TEXT NOT NULL,
+		segment1 TEXT NOT NULL,
+		segment2 TEXT NOT NULL,
+		metric TEXT NOT NULL,
+		value REAL,
+		engine TEXT NOT NULL,
+		parameters TEXT NOT NULL,
+		software TEXT NOT NULL,
+		createdAt REAL NOT NULL,
+		PRIMARY KEY (caseId, segment1, segment2, metric, engine, parameters))''',
+	'CREATE INDEX IF NOT EXISTS resultsMetricValue ON results (metric, value)',
+	'CREATE INDEX IF NOT EXISTS resultsSoftwareMetric ON results (software, metric, createdAt)',
+	'CREATE INDEX IF NOT EXISTS resultsCase ON results (caseId)']
+
+def parametersKey(parameters):
+
+	# Canonical text of the parameters, so that equal dictionaries give the same key
+	return json.dumps(parameters or {}, sort_keys=True, separators=(',', ':'), default=str)
+
+class ResultsStore(object):
+
+	def __init__(self, path):
+
+		self.path = path
+		directory = os.path.dirname(os.path.abspath(path))
+		if not os.path.isdir(directory):
+			os.makedirs(directory, exist_ok=True)
+		# The connection is shared by the main thread and background tasks, serialized by the lock
+		self.connection = sqlite3.connect(path, timeout=30.0, check_same_thread=False)
+		self.lock = threading.Lock()
+		with self.lock:
+			self.connection.execute('PRAGMA journal_mode=WAL')
+			self.connection.execute('PRAGMA synchronous=NORMAL')
+			with self.connection:
+				for statement in SCHEMA:
+					self.connection.execute(statement)
+
+	def close(self):
+
+		with self.lock:
+			self.connection.close()
+
+	#
+	# Insertion
+	#
+
+	def addResults(self, rows):
+
+		# rows: dictionaries with the keys of RESULT_COLUMNS (engine, parameters, software and createdAt
+		# are optional). All rows are written in one transaction.
+		now = time.time()
+		values = []
+		for row in rows:
+			value = row.get('value')
+			values.append((str(row['caseId']), str(row['segment1']), str(row['segment2']), row['metric'],
+				None if value is None else float(value), row.get('engine') or '', parametersKey(row.get('parameters')),
+				row.get('software') or '', row.get('createdAt') or now))
+		with self.lock, self.connection:
+			self.connection.executemany('INSERT OR REPLACE INTO results (%s) VALUES (%s)' % (', '.join(RESULT_COLUMNS),
+				', '.join(['?'] * len(RESULT_COLUMNS))), values)
+		return len(values)
+
+	def addMetrics(self, caseId, segment1, segment2, metrics, engine='', parameters=None, software=''):
+
+		# One row per numeric metric of a result dictionary (other entries are ignored)
+		rows = []
+		for metric, value in metrics.items():
+			if isinstance(value, bool) or not isinstance(value, (int, float)):
+				continue
+			rows.append({'caseId': caseId, 'segment1': segment1, 'segment2': segment2, 'metric': metric, 'value': value,
+				'engine': engine, 'parameters': parameters, 'software': software})
+		return self.addResults(rows)
+
+	#
+	# Queries
+	#
+
+	def query(self, metric=None, caseId=None, software=None, engine=None, minValue=None, maxValue=None, since=None, orderBy='createdAt'):
+
+		# Rows matching all given filters; minValue and maxValue are strict bounds
+		if orderBy not in RESULT_COLUMNS:
+			raise ValueError('Unknown result column: ' + str(orderBy))
+		conditions, arguments = [], []
+		for column, value in [('metric', metric), ('caseId', caseId), ('software', software), ('engine', engine)]:
+			if value is not None:
+				conditions.append(column + ' = ?')
+				arguments.append(value)
+		if minValue is not None:
+			conditions.append('value > ?')
+			arguments.append(minValue)
+		if maxValue is not None:
+			conditions.append('value < ?')
+			arguments.append(maxValue)
+		if since is not None:
+			conditions.append('createdAt >= ?')
+			arguments.append(since)
+		statement = 'SELECT %s FROM results' % ', '.join(RESULT_COLUMNS)
+		if conditions:
+			statement += ' WHERE ' + ' AND '.join(conditions)
+		statement += ' ORDER BY %s, caseId, segment1, segment2' % orderBy
+		with self.lock:
+			rows = self.connection.execute(statement, arguments).fetchall()
+		results = []
+		for row in rows:
+			result = dict(zip(RESULT_COLUMNS, row))
+			result['parameters'] = json.loads(result['parameters'])
+			results.append(result)
+		return results
+
+	def trend(self, metric, software=None, engine=None):
+
+		# (time, case, value) of a metric in chronological order
+		return [(row['createdAt'], row['caseId'], row['value']) for row in self.query(metric=metric, software=software, engine=engine)]
+
+	def cases(self):
+
+		with self.lock:
+			return [row[0] for row in self.connection.execute('SELECT DISTINCT caseId FROM results ORDER BY caseId')]
+
+	def numberOfResults(self):
+
+		with self.lock:
+			return self.connection.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+
+	#
+	# Export
+	#
+
+	def exportCSV(self, path, **filters):
+
+		# One line per result; filters are those of query()
+		rows = self.query(**filters)
+		with open(path, 'w', newline='') as csvFile:
+			writer = csv.DictWriter(csvFile, fieldnames=RESULT_COLUMNS)
+			writer.writeheader()
+			for row in rows:
+				row['parameters'] = parametersKey(row['parameters'])
+				writer.writerow(row)
+		return len(rows)
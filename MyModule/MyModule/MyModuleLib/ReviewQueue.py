@@ -0,0 +1,183 @@
+#
+# MyModuleLib: case-by-case review of a case list, with the next case prepared in the background
+#
+# A ReviewQueue walks through a list of cases (the rows of a BatchComparison manifest). The current
+# case is prepared (surfaces read, segment 2 aligned, metrics and distance maps computed, see
+# prepareCase) on a worker thread, and as soon as it is ready the next case of the list is prepared
+# while the reviewer inspects the current one, so that moving to it only has to display it:
+#
+#   queue = ReviewQueue(BatchComparison.readManifest('manifest.csv'), prepareCase)
+#   queue.moveTo(0)
+#   queue.poll()                 # from a timer: collects the prepared case, starts the next prefetch
+#   queue.currentCase()          # prepared case, or None while it is being prepared
+#   queue.next(), queue.previous()
+#
+# Only the current case and the prefetched one are kept: moving to another case drops every other
+# prepared case and cancels a prefetch that is no longer needed, so memory stays bounded to about two
+# cases. Going back to a dropped case prepares it again (its surfaces are usually still in the mesh
+# cache). Errors of a case are kept in its prepared case ('error'), they do not stop the review.
+#
+
+import time
+
+from MyModuleLib import Core
+from MyModuleLib.Tasks import BackgroundTask
+
+def prepareCase(case, progressCallback=None, alignmentMode='fixed', engineName='auto', numberOfWorkers=1, voxelSizeMm=None, cache=None,
+	seed=0, transformPath=None, readSurface=Core.readSurface, histogramBinWidthMm=None, histogramBins=None, alignmentMatrix=None):
+
+	# Surfaces of a case, the alignment matrix of segment 2, its metrics and both distance maps (the
+	# surfaces are not modified, segment 2 is aligned on the fly as in Core.compareFiles). A matrix
+	# given by the caller (e.g. read from a transform file once for all cases) replaces the alignment.
+	from MyModuleLib import Alignments
+
+	def setProgress(fraction, message=None):
+		if progressCallback is not None:
+			progressCallback(fraction, message)
+
+	setProgress(0.0, 'Loading ' + case['case'] + '...')
+	polyData1 = readSurface(case['segment1'])
+	polyData2 = readSurface(case['segment2'])
+	setProgress(0.1, 'Aligning ' + case['case'] + '...')
+	if alignmentMatrix is not None:
+		matrix, registrationResult = alignmentMatrix, None
+	else:
+		matrix, registrationResult = Core.alignmentMatrix(polyData1, polyData2, alignmentMode, seed, transformPath,
+			lambda fraction: setProgress(0.1 + 0.2 * fraction))
+	setProgress(0.3, 'Comparing ' + case['case'] + '...')
+	comparison = Core.compareSurfacesWithDistances(polyData1, Alignments.transformedPolyData(polyData2, matrix), engineName,
+		numberOfWorkers, voxelSizeMm, cache, lambda fraction: setProgress(0.3 + 0.7 * fraction), histogramBinWidthMm, histogramBins)
+	metrics = comparison['metrics']
+	if registrationResult is not None:
+		metrics['alignmentRmsMm'] = registrationResult['rmsResidual']
+		metrics['alignmentIterations'] = registrationResult['iterations']
+	prepared = dict(comparison)
+	prepared.update({'case': case, 'polyData1': polyData1, 'polyData2': polyData2, 'alignmentMode': alignmentMode, 'matrix': matrix,
+		'registrationResult': registrationResult, 'error': None})
+	return prepared
+
+class ReviewQueue(object):
+
+	def __init__(self, cases, prepare):
+
+		self.cases = list(cases)
+		self.prepare = prepare  # prepare(case, progressCallback) -> prepared case, runs on the worker thread
+		self.index = None
+		self.prepared = {}  # case index -> prepared case (current and prefetched only)
+		self.task = None
+		self.taskIndex = None
+
+		# Cases that were ready when the reviewer moved to them, and the time spent waiting for the others
+		self.hits = 0
+		self.misses = 0
+		self.waitSeconds = 0.0
+		self.moveTime = None
+
+	def __len__(self):
+
+		return len(self.cases)
+
+	def case(self, index=None):
+
+		return self.cases[self.index if index is None else index]
+
+	def moveTo(self, index):
+
+		# Current case; the other prepared cases are dropped (the next one is prefetched again by poll)
+		if not 0 <= index < len(self.cases):
+			raise IndexError('No case %d in a review of %d cases' % (index, len(self.cases)))
+		self.index = index
+		for preparedIndex in list(self.prepared):
+			if preparedIndex != index:
+				del self.prepared[preparedIndex]
+		if index in self.prepared:
+			self.hits += 1
+			self.moveTime = None
+		else:
+			self.misses += 1
+			self.moveTime = time.time()
+		if self.taskIndex is not None and self.taskIndex not in (index, index + 1):
+			self.cancel()
+		self.poll()
+		return self.currentCase()
+
+	def next(self):
+
+		return self.moveTo(self.index + 1) if self.hasNext() else self.currentCase()
+
+	def previous(self):
+
+		return self.moveTo(self.index - 1) if self.hasPrevious() else self.currentCase()
+
+	def hasNext(self):
+
+		return self.index is not None and self.index + 1 < len(self.cases)
+
+	def hasPrevious(self):
+
+		return self.index is not None and self.index > 0
+
+	def currentCase(self):
+
+		return self.prepared.get(self.index)
+
+	def poll(self):
+
+		# Collects the finished preparation and starts the next one: the current case first, then the
+		# following one. Returns True when the current case is ready.
+		if self.task is not None and self.task.isDone():
+			task, taskIndex = self.task, self.taskIndex
+			self.task = None
+			self.taskIndex = None
+			if not task.cancelled and taskIndex in (self.index, self.index + 1):
+				if task.error is not None:
+					self.prepared[taskIndex] = {'case': self.cases[taskIndex], 'error': task.error, 'traceback': task.errorTraceback}
+				else:
+					self.prepared[taskIndex] = task.finish()
+				if taskIndex == self.index and self.moveTime is not None:
+					self.waitSeconds += time.time() - self.moveTime
+					self.moveTime = None
+		if self.task is None and self.index is not None:
+			for index in [self.index, self.index + 1]:
+				if index < len(self.cases) and index not in self.prepared:
+					self.start(index)
+					break
+		return self.index in self.prepared
+
+	def start(self, index):
+
+		case = self.cases[index]
+
+		def compute(task):
+			return self.prepare(case, task.setProgress)
+
+		self.task = BackgroundTask('Prepare case ' + case['case'], compute)
+		self.taskIndex = index
+		self.task.start()
+
+	def status(self):
+
+		# Progress and message of the running preparation, and whether it prepares the current case
+		if self.task is None:
+			return None
+		progress, message = self.task.status()
+		return progress, message, self.taskIndex == self.index
+
+	def cancel(self):
+
+		# The cancelled task is left to finish its current step on its own thread
+		if self.task is not None:
+			self.task.cancel()
+		self.task = None
+		self.taskIndex = None
+
+	def close(self):
+
+		self.cancel()
+		self.prepared.clear()
+		self.index = None
+
+	def statistics(self):
+
+		return {'cases': len(self.cases), 'hits': self.hits, 'misses': self.misses, 'waitSeconds': self.waitSeconds,
+			'prepared': sorted(self.prepared)}
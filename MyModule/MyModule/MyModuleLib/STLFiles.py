@@ -0,0 +1,238 @@
+#
+# MyModuleLib: STL reader without VTK readers or MRML nodes
+#
+# Binary files are memory-mapped as an array of 50-byte triangle records, so the file is read by the
+# operating system page by page, only the vertex coordinates are copied, and the pages are released
+# chunk by chunk. ASCII files are mapped too and parsed by blocks of whole facets (about 4 times
+# slower than the C++ parser of vtkSTLReader, so MyModuleLogic reads them with Slicer).
+#
+# The 3 vertices of every triangle are merged with NumPy only: the coordinates of each vertex are
+# hashed into one 64-bit key, the keys are sorted, and equal keys are checked to have equal
+# coordinates (a hash collision falls back to an exact lexicographic sort). Merged points keep the
+# order of their first occurrence in the file, and triangles that become degenerate are dropped, as
+# vtkSTLReader does: points and triangles are identical to those of vtkSTLReader.
+#
+# Coordinates are returned as stored in the file. Slicer writes the coordinate system in the header
+# ('SPACE=LPS' or 'SPACE=RAS') and reads files without it as LPS; fileCoordinateSystem and
+# lpsToRas give the same RAS coordinates as slicer.util.loadSegmentation.
+#
+#   points, faces = readSTL('liver.stl')      # float32 (numberOfPoints, 3), int32 (numberOfTriangles, 3)
+#   polyData = readSTLPolyData('liver.stl')   # vtkPolyData sharing the memory of both arrays
+#
+
+import re
+import mmap
+
+import numpy as np
+from vtkmodules.vtkCommonCore import vtkPoints, VTK_TYPE_INT32
+from vtkmodules.vtkCommonDataModel import vtkCellArray, vtkPolyData
+from vtkmodules.util import numpy_support
+
+BINARY_HEADER_BYTES = 80
+
+# Normal, 3 vertices and attribute byte count of a binary triangle record
+BINARY_TRIANGLE_DTYPE = np.dtype([('normal', '<f4', (3,)), ('vertices', '<f4', (3, 3)), ('attributes', '<u2')])
+
+# Triangles whose vertices are merged at once (bounds the temporary memory of the keys)
+CHUNK_TRIANGLES = 1 << 18
+
+# ASCII files are parsed by blocks of whole facets: keywords are blanked, then the 12 numbers of each
+# facet (normal and vertices) are converted by NumPy
+ASCII_BLOCK_BYTES = 1 << 24
+ASCII_KEYWORDS = [b'endfacet', b'endloop', b'facet', b'normal', b'outer', b'loop', b'vertex']
+
+class STLFormatError(Exception):
+	pass
+
+def isBinarySTL(path):
+
+	# A binary file has exactly the size given by its triangle count (ASCII files start with 'solid',
+	# but so do some binary headers)
+	with open(path, 'rb') as stlFile:
+		header = stlFile.read(BINARY_HEADER_BYTES + 4)
+		stlFile.seek(0, 2)
+		size = stlFile.tell()
+	if len(header) < BINARY_HEADER_BYTES + 4:
+		return False
+	numberOfTriangles = int(np.frombuffer(header[BINARY_HEADER_BYTES:], dtype='<u4')[0])
+	return size == BINARY_HEADER_BYTES + 4 + numberOfTriangles * BINARY_TRIANGLE_DTYPE.itemsize
+
+def fileCoordinateSystem(path, default='LPS'):
+
+	with open(path, 'rb') as stlFile:
+		header = stlFile.read(256)
+	match = re.search(rb'SPACE=(RAS|LPS)', header)
+	return match.group(1).decode() if match else default
+
+def lpsToRas(points):
+
+	# In place (a rotation of 180 degrees around the superior axis, triangle orientation is unchanged)
+	points[:, :2] *= -1.0
+	return points
+
+def releasePages(mappedFile, startBytes, endBytes):
+
+	# Drops the pages of [startBytes, endBytes) from the resident memory (they are read again if needed);
+	# returns the end of the released range
+	endBytes -= endBytes % mmap.PAGESIZE
+	if hasattr(mappedFile, 'madvise') and endBytes > startBytes:
+		mappedFile.madvise(mmap.MADV_DONTNEED, startBytes, endBytes - startBytes)
+		return endBytes
+	return startBytes
+
+def binaryTriangleChunks(path, chunkTriangles):
+
+	# Contiguous (numberOfTriangles, 3, 3) float32 copies of the vertices of the memory-mapped file.
+	# The pages of each chunk are released once copied, so the file does not stay resident.
+	with open(path, 'rb') as stlFile:
+		stlFile.seek(BINARY_HEADER_BYTES)
+		numberOfTriangles = int(np.frombuffer(stlFile.read(4), dtype='<u4')[0])
+		if numberOfTriangles == 0:
+			return
+		mappedFile = mmap.mmap(stlFile.fileno(), 0, access=mmap.ACCESS_READ)
+	records = None
+	try:
+		records = np.frombuffer(mappedFile, dtype=BINARY_TRIANGLE_DTYPE, count=numberOfTriangles, offset=BINARY_HEADER_BYTES + 4)
+		releasedBytes = 0
+		for start in range(0, numberOfTriangles, chunkTriangles):
+			yield np.ascontiguousarray(records['vertices'][start:start + chunkTriangles])
+			releasedBytes = releasePages(mappedFile, releasedBytes,
+				BINARY_HEADER_BYTES + 4 + min(start + chunkTriangles, numberOfTriangles) * BINARY_TRIANGLE_DTYPE.itemsize)
+	finally:
+		# The map cannot be closed while the records view exists (also when the caller stops early)
+		records = None
+		mappedFile.close()
+
+def asciiTriangleChunks(path, chunkTriangles):
+
+	with open(path, 'rb') as stlFile:
+		if stlFile.seek(0, 2) == 0:
+			return
+		mappedFile = mmap.mmap(stlFile.fileno(), 0, access=mmap.ACCESS_READ)
+	try:
+		# Facets are between the 'solid name' line and 'endsolid'
+		start = mappedFile.find(b'\n') + 1
+		stop = mappedFile.rfind(b'endsolid')
+		stop = len(mappedFile) if stop < start else stop
+		releasedBytes = 0
+		while start < stop:
+			end = mappedFile.find(b'endfacet', min(start + ASCII_BLOCK_BYTES, stop), stop)
+			end = stop if end < 0 else end + len(b'endfacet')
+			block = mappedFile[start:end]
+			releasedBytes = releasePages(mappedFile, releasedBytes, end)
+			for keyword in ASCII_KEYWORDS:
+				block = block.replace(keyword, b' ')
+			try:
+				numbers = np.array(block.split(), dtype=np.float32)
+			except ValueError:
+				raise STLFormatError('Invalid number in ' + path)
+			if len(numbers) % 12:
+				raise STLFormatError('Incomplete facet in ' + path)
+			triangleVertices = numbers.reshape(-1, 4, 3)[:, 1:]
+			for chunkStart in range(0, len(triangleVertices), chunkTriangles):
+				yield triangleVertices[chunkStart:chunkStart + chunkTriangles]
+			start = end
+	finally:
+		mappedFile.close()
+
+def triangleChunks(path, chunkTriangles=CHUNK_TRIANGLES):
+
+	if isBinarySTL(path):
+		return binaryTriangleChunks(path, chunkTriangles)
+	return asciiTriangleChunks(path, chunkTriangles)
+
+def vertexKeys(vertices):
+
+	# 64-bit hash of the coordinates of each vertex (adding 0.0 makes -0.0 and 0.0 equal)
+	bits = (vertices + np.float32(0.0)).view(np.uint32)
+	keys = bits[:, 0].astype(np.uint64)
+	keys *= np.uint64(0x9E3779B97F4A7C15)
+	for axis, multiplier in [(1, 0xC2B2AE3D27D4EB4F), (2, 0x165667B19E3779F9)]:
+		axisKeys = bits[:, axis].astype(np.uint64)
+		axisKeys *= np.uint64(multiplier)
+		keys ^= axisKeys
+	return keys
+
+def uniqueVertices(vertices):
+
+	# First occurrence of each distinct vertex (in increasing order), and the index of the distinct
+	# vertex of every vertex
+	keys = vertexKeys(vertices)
+	order = np.argsort(keys)
+	sortedVertices = vertices[order]
+	sortedKeys = keys[order]
+	newKey = np.empty(len(order), dtype=bool)
+	newKey[:1] = True
+	newKey[1:] = sortedKeys[1:] != sortedKeys[:-1]
+	sameVertex = np.all(sortedVertices[1:] == sortedVertices[:-1], axis=1)
+	if not np.all(sameVertex | newKey[1:]):
+		# Hash collision between different coordinates: exact sort of all coordinates
+		order = np.lexsort((vertices[:, 2], vertices[:, 1], vertices[:, 0]))
+		sortedVertices = vertices[order]
+		newKey[1:] = ~np.all(sortedVertices[1:] == sortedVertices[:-1], axis=1)
+
+	# First occurrence: smallest index of each group of sorted vertices
+	firstIndices = np.minimum.reduceat(order, np.flatnonzero(newKey))
+	firstOrder = np.argsort(firstIndices)
+	groupRanks = np.empty(len(firstIndices), dtype=np.int32)
+	groupRanks[firstOrder] = np.arange(len(firstIndices))
+	inverse = np.empty(len(order), dtype=np.int32)
+	inverse[order] = groupRanks[np.cumsum(newKey) - 1]
+	return firstIndices[firstOrder], inverse
+
+def mergeVertices(chunks):
+
+	# Points (float32, in order of first occurrence) and faces (int32) of (numberOfTriangles, 3, 3)
+	# arrays of triangle vertices. Vertices are merged chunk by chunk, then the points of all chunks.
+	chunkPoints = []
+	chunkFaces = []
+	offset = 0
+	for chunk in chunks:
+		vertices = np.ascontiguousarray(chunk, dtype=np.float32).reshape(-1, 3)
+		firstIndices, inverse = uniqueVertices(vertices)
+		chunkPoints.append(vertices[firstIndices])
+		chunkFaces.append(inverse + offset)
+		offset += len(firstIndices)
+	if not chunkPoints:
+		return np.zeros((0, 3), dtype=np.float32), np.zeros((0, 3), dtype=np.int32)
+	points = np.concatenate(chunkPoints) if len(chunkPoints) > 1 else chunkPoints[0]
+	faces = np.concatenate(chunkFaces) if len(chunkFaces) > 1 else chunkFaces[0]
+	if len(chunkPoints) > 1:
+		firstIndices, inverse = uniqueVertices(points)
+		points = points[firstIndices]
+		faces = inverse[faces]
+	faces = faces.reshape(-1, 3)
+
+	# Triangles with two merged vertices
+	valid = (faces[:, 0] != faces[:, 1]) & (faces[:, 1] != faces[:, 2]) & (faces[:, 0] != faces[:, 2])
+	if not np.all(valid):
+		faces = faces[valid]
+	return points, faces
+
+def readSTL(path):
+
+	return mergeVertices(triangleChunks(path))
+
+def polyDataFromMesh(points, faces):
+
+	# Surface sharing the memory of the float32 points and int32 faces (32-bit cell array storage);
+	# the VTK arrays keep references to the NumPy arrays
+	faces = np.ascontiguousarray(faces, dtype=np.int32)
+	surfacePoints = vtkPoints()
+	surfacePoints.SetData(numpy_support.numpy_to_vtk(np.ascontiguousarray(points), deep=0))
+	offsets = np.arange(0, 3 * len(faces) + 1, 3, dtype=np.int32)
+	cellArray = vtkCellArray()
+	cellArray.SetData(numpy_support.numpy_to_vtk(offsets, deep=0, array_type=VTK_TYPE_INT32),
+		numpy_support.numpy_to_vtk(faces.ravel(), deep=0, array_type=VTK_TYPE_INT32))
+	polyData = vtkPolyData()
+	polyData.SetPoints(surfacePoints)
+	polyData.SetPolys(cellArray)
+	return polyData
+
+def readSTLPolyData(path, coordinateSystem=None):
+
+	# With coordinateSystem='RAS', LPS files are converted to RAS
+	points, faces = readSTL(path)
+	if coordinateSystem == 'RAS' and fileCoordinateSystem(path) == 'LPS':
+		lpsToRas(points)
+	return polyDataFromMesh(points, faces)
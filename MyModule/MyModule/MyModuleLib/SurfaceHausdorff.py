@@ -0,0 +1,134 @@
+#
+# MyModuleLib: Hausdorff distances between closed surfaces, computed on their vertices
+#
+# Distances are measured from the vertices of each surface to the other surface (as in
+# ComparisonMatrix.py), in both directions.
+#
+#   - exactHausdorff:   maximum distance. Vertices are visited in random order by batches; a vertex
+#                       that has a vertex of the other surface closer than the current maximum cannot
+#                       raise it and is skipped (early break), so only a small fraction of the vertices
+#                       needs a point-to-surface distance. The result is exact.
+#   - sampledHausdorff: 95th percentile and mean of the distances of a random sample of vertices, with
+#                       confidence intervals (order statistics for the percentile, normal approximation
+#                       for the mean). The sample maximum is a lower bound of the Hausdorff distance.
+#   - screenHausdorff:  sampled estimate, escalated to the exact maximum when the upper bound of the
+#                       95th percentile reaches a threshold.
+#
+# The early break uses a SciPy KD-tree over the vertices; without SciPy every vertex is evaluated.
+#
+
+import math
+from statistics import NormalDist
+
+import numpy as np
+
+from MyModuleLib import Backends
+from MyModuleLib import DistanceEngines
+
+# Modes of MyModuleLogic.hausdorffDist ('distanceTransform' is computed on voxels, see DistanceTransforms.py)
+HAUSDORFF_MODES = ['segmentComparison', 'exact', 'sampled', 'screening', 'distanceTransform']
+
+DEFAULT_SAMPLES = 10000
+
+# Vertices evaluated by the first batch of the exact search (the batch size doubles up to the maximum)
+INITIAL_BATCH = 1000
+MAXIMUM_BATCH = 200000
+
+def createEngine(polyData, engineName):
+
+	# The 'filter' engine only exists for distance maps
+	engine = DistanceEngines.createDistanceEngine('auto' if engineName == 'filter' else engineName)
+	engine.setTarget(polyData)
+	return engine
+
+def directedHausdorff(sourcePoints, targetPoints, targetEngine, randomState, progressCallback=None):
+
+	# Maximum distance from the source vertices to the target surface, and number of vertices whose
+	# distance had to be computed
+	kdTree = Backends.kdTreeClass()
+	tree = kdTree(targetPoints) if kdTree is not None else None
+	order = randomState.permutation(len(sourcePoints))
+	maximum = 0.0
+	evaluations = 0
+	start, batchSize = 0, INITIAL_BATCH
+	while start < len(order):
+		batch = sourcePoints[order[start:start + batchSize]]
+		if tree is not None and maximum > 0.0:
+			# The surface is at most as far as its closest vertex
+			vertexDistances = tree.query(batch, distance_upper_bound=maximum)[0]
+			batch = batch[~np.isfinite(vertexDistances)]
+		if len(batch):
+			maximum = max(maximum, float(targetEngine.computeDistances(batch).max()))
+			evaluations += len(batch)
+		start += batchSize
+		batchSize = min(2 * batchSize, MAXIMUM_BATCH)
+		if progressCallback is not None:
+			progressCallback(min(start, len(order)) / float(len(order)))
+	return maximum, evaluations
+
+def exactHausdorff(polyData1, polyData2, engineName='auto', seed=0, progressCallback=None):
+
+	points1 = DistanceEngines.polyDataPoints(polyData1)
+	points2 = DistanceEngines.polyDataPoints(polyData2)
+	randomState = np.random.RandomState(seed)
+	numberOfPoints = len(points1) + len(points2)
+
+	# Progress is shared by both directions in proportion to their number of vertices
+	def directionProgress(offset, size):
+		if progressCallback is None:
+			return None
+		return lambda fraction: progressCallback((offset + fraction * size) / float(numberOfPoints))
+
+	directed12, evaluations12 = directedHausdorff(points1, points2, createEngine(polyData2, engineName), randomState,
+		directionProgress(0, len(points1)))
+	directed21, evaluations21 = directedHausdorff(points2, points1, createEngine(polyData1, engineName), randomState,
+		directionProgress(len(points1), len(points2)))
+	return {'hausdorffMaxMm': max(directed12, directed21), 'hausdorffDirected12Mm': directed12, 'hausdorffDirected21Mm': directed21,
+		'numberOfPoints': numberOfPoints, 'exactEvaluations': evaluations12 + evaluations21}
+
+def sampledHausdorff(polyData1, polyData2, numberOfSamples=DEFAULT_SAMPLES, confidence=0.95, engineName='auto', seed=0):
+
+	# Vertices of both surfaces are sampled together without replacement, so each direction
+	# contributes in proportion to its number of vertices (as in the full distance set)
+	points1 = DistanceEngines.polyDataPoints(polyData1)
+	points2 = DistanceEngines.polyDataPoints(polyData2)
+	numberOfPoints = len(points1) + len(points2)
+	numberOfSamples = int(min(numberOfSamples, numberOfPoints))
+	samples = np.random.RandomState(seed).choice(numberOfPoints, numberOfSamples, replace=False)
+	samples1 = samples[samples < len(points1)]
+	samples2 = samples[samples >= len(points1)] - len(points1)
+	distances = np.concatenate([createEngine(polyData2, engineName).computeDistances(points1[samples1]),
+		createEngine(polyData1, engineName).computeDistances(points2[samples2])])
+	distances.sort()
+
+	z = NormalDist().inv_cdf(0.5 + confidence / 2.0)
+	percentile95 = float(np.percentile(distances, 95))
+	mean = float(distances.mean())
+	if numberOfSamples == numberOfPoints:
+		# All vertices were evaluated: the values are exact
+		percentileBounds = (percentile95, percentile95)
+		meanHalfWidth = 0.0
+	else:
+		# Ranks of the order statistics bracketing the 95th percentile (binomial, normal approximation)
+		center = 0.95 * numberOfSamples
+		halfWidth = z * math.sqrt(numberOfSamples * 0.95 * 0.05)
+		lowerRank = max(0, int(math.floor(center - halfWidth)) - 1)
+		upperRank = min(numberOfSamples - 1, int(math.ceil(center + halfWidth)))
+		percentileBounds = (float(distances[lowerRank]), float(distances[upperRank]))
+		# Standard error of the mean with the finite population correction
+		standardDeviation = float(distances.std(ddof=1)) if numberOfSamples > 1 else 0.0
+		meanHalfWidth = z * standardDeviation / math.sqrt(numberOfSamples) * math.sqrt(1.0 - numberOfSamples / float(numberOfPoints))
+	return {'hausdorff95Mm': percentile95, 'hausdorff95LowerMm': percentileBounds[0], 'hausdorff95UpperMm': percentileBounds[1],
+		'hausdorffMeanMm': mean, 'hausdorffMeanLowerMm': mean - meanHalfWidth, 'hausdorffMeanUpperMm': mean + meanHalfWidth,
+		'hausdorffMaxLowerBoundMm': float(distances[-1]) if len(distances) else float('nan'),
+		'numberOfSamples': numberOfSamples, 'numberOfPoints': numberOfPoints, 'confidence': confidence}
+
+def screenHausdorff(polyData1, polyData2, thresholdMm, numberOfSamples=DEFAULT_SAMPLES, confidence=0.95, engineName='auto', seed=0,
+	progressCallback=None):
+
+	# Sampled estimate; the exact maximum is computed only if the 95th percentile may reach thresholdMm
+	result = sampledHausdorff(polyData1, polyData2, numberOfSamples, confidence, engineName, seed)
+	result['flagged'] = result['hausdorff95UpperMm'] >= thresholdMm
+	if result['flagged']:
+		result.update(exactHausdorff(polyData1, polyData2, engineName, seed, progressCallback))
+	return result
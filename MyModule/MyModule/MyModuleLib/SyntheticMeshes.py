@@ -0,0 +1,179 @@
+#
+# MyModuleLib: synthetic surface pairs with known ground truth
+#
+# Every case is a pair of closed surfaces (segment 1, segment 2) tessellated with about the requested
+# number of triangles, together with the exact values of the continuous shapes:
+#   - dice:           Dice coefficient of the enclosed volumes
+#   - hausdorffMaxMm: symmetric Hausdorff distance between the surfaces
+#   - distanceMaxMm:  maximum distance from segment 1 to segment 2 (color map)
+#
+#   - 'spheres':    two spheres with different radii and centers (lens volume formula)
+#   - 'ellipsoids': an ellipsoid scaled by k around its center, and the ellipsoid itself
+#   - 'perturbed':  sphere with smooth radial bumps, and the unperturbed sphere
+#   - 'noisy':      sphere with a random smooth radial field (seeded), and the unperturbed sphere
+#
+# Radial displacements are normal to the unperturbed sphere, so point-to-sphere distances are
+# exact; the volume integrals of radial shapes are evaluated by quadrature on a fine grid.
+# Tessellated surfaces lie slightly inside the continuous ones (by about edge length^2 / radius).
+#
+
+import numpy as np
+
+from MyModuleLib.DistanceEngines import polyDataFromArrays
+
+SHAPES = ['spheres', 'ellipsoids', 'perturbed', 'noisy']
+
+SPHERE_RADIUS = 50.0
+
+def sphereTessellation(numberOfTriangles):
+
+	# Latitude/longitude tessellation of the unit sphere with about numberOfTriangles triangles
+	# (outward oriented). Returns unit directions, their polar and azimuthal angles, and triangles.
+	numberOfRings = max(2, int(round(np.sqrt(numberOfTriangles / 4.0))))
+	numberOfSectors = 2 * numberOfRings
+	polar = np.pi * np.arange(1, numberOfRings) / numberOfRings
+	azimuth = 2.0 * np.pi * np.arange(numberOfSectors) / numberOfSectors
+	polarGrid, azimuthGrid = np.meshgrid(polar, azimuth, indexing='ij')
+	polarAngles = np.concatenate([[0.0], polarGrid.ravel(), [np.pi]])
+	azimuthAngles = np.concatenate([[0.0], azimuthGrid.ravel(), [0.0]])
+	directions = np.stack([np.sin(polarAngles) * np.cos(azimuthAngles), np.sin(polarAngles) * np.sin(azimuthAngles), np.cos(polarAngles)], axis=1)
+
+	# Point index of ring i (0-based), sector j
+	def ringPoints(ring):
+		return 1 + ring * numberOfSectors + np.arange(numberOfSectors)
+	southPole = len(directions) - 1
+	triangles = []
+	first = ringPoints(0)
+	triangles.append(np.stack([np.zeros(numberOfSectors, dtype=np.int64), first, np.roll(first, -1)], axis=1))
+	for ring in range(numberOfRings - 2):
+		upper = ringPoints(ring)
+		lower = ringPoints(ring + 1)
+		triangles.append(np.stack([upper, lower, np.roll(lower, -1)], axis=1))
+		triangles.append(np.stack([upper, np.roll(lower, -1), np.roll(upper, -1)], axis=1))
+	last = ringPoints(numberOfRings - 2)
+	triangles.append(np.stack([np.full(numberOfSectors, southPole, dtype=np.int64), np.roll(last, -1), last], axis=1))
+	return directions, polarAngles, azimuthAngles, np.concatenate(triangles).astype(np.int64)
+
+def sphere(radius, center, numberOfTriangles):
+
+	directions, polarAngles, azimuthAngles, triangles = sphereTessellation(numberOfTriangles)
+	return polyDataFromArrays(radius * directions + np.asarray(center, dtype=np.float64), triangles)
+
+def ellipsoid(radii, center, numberOfTriangles):
+
+	directions, polarAngles, azimuthAngles, triangles = sphereTessellation(numberOfTriangles)
+	return polyDataFromArrays(directions * np.asarray(radii, dtype=np.float64) + np.asarray(center, dtype=np.float64), triangles)
+
+def radialSurface(radiusFunction, numberOfTriangles):
+
+	# Star-shaped surface around the origin: radius = radiusFunction(directions)
+	directions, polarAngles, azimuthAngles, triangles = sphereTessellation(numberOfTriangles)
+	return polyDataFromArrays(directions * radiusFunction(directions)[:, None], triangles)
+
+#
+# Radial displacement fields (smooth functions of the unit direction)
+#
+
+def bumpsDisplacement(amplitude, azimuthalOrder=3, polarOrder=4):
+
+	# Re((x + iy)^m) = sin^m(polar) cos(m azimuth) and T_n(z) = cos(n polar) are smooth on the sphere
+	def displacement(directions):
+		x, y, z = directions[:, 0], directions[:, 1], directions[:, 2]
+		horizontal = np.real((x + 1j * y) ** azimuthalOrder)
+		vertical = np.cos(polarOrder * np.arccos(np.clip(z, -1.0, 1.0)))
+		return 0.5 * amplitude * (horizontal + vertical)
+	return displacement
+
+def noiseDisplacement(amplitude, seed=0, degree=8):
+
+	# Random polynomial of the direction coordinates, scaled so that its maximum magnitude is amplitude
+	randomState = np.random.RandomState(seed)
+	exponents = [(a, b, c) for a in range(degree + 1) for b in range(degree + 1 - a) for c in range(degree + 1 - a - b)]
+	coefficients = randomState.uniform(-1.0, 1.0, len(exponents))
+	def polynomial(directions):
+		powers = [np.cumprod(np.vstack([np.ones(len(directions))] + [directions[:, axis]] * degree), axis=0) for axis in range(3)]
+		values = np.zeros(len(directions))
+		for (a, b, c), coefficient in zip(exponents, coefficients):
+			values += coefficient * powers[0][a] * powers[1][b] * powers[2][c]
+		return values
+	scale = amplitude / np.abs(polynomial(quadratureGrid(400)[0])).max()
+	return lambda directions: scale * polynomial(directions)
+
+def quadratureGrid(numberOfPolarSamples=1000):
+
+	# Midpoint rule in cos(polar) and azimuth: directions and solid angle weights
+	numberOfAzimuthSamples = 2 * numberOfPolarSamples
+	cosPolar = -1.0 + (np.arange(numberOfPolarSamples) + 0.5) * 2.0 / numberOfPolarSamples
+	azimuth = (np.arange(numberOfAzimuthSamples) + 0.5) * 2.0 * np.pi / numberOfAzimuthSamples
+	cosGrid, azimuthGrid = np.meshgrid(cosPolar, azimuth, indexing='ij')
+	sinGrid = np.sqrt(1.0 - cosGrid ** 2)
+	directions = np.stack([sinGrid * np.cos(azimuthGrid), sinGrid * np.sin(azimuthGrid), cosGrid], axis=-1).reshape(-1, 3)
+	weight = (2.0 / numberOfPolarSamples) * (2.0 * np.pi / numberOfAzimuthSamples)
+	return directions, weight
+
+#
+# Ground truth
+#
+
+def sphereIntersectionVolume(radius1, radius2, centerDistance):
+
+	if centerDistance >= radius1 + radius2:
+		return 0.0
+	if centerDistance <= abs(radius1 - radius2):
+		return 4.0 / 3.0 * np.pi * min(radius1, radius2) ** 3
+	d, r1, r2 = centerDistance, radius1, radius2
+	return np.pi * (r1 + r2 - d) ** 2 * (d ** 2 + 2 * d * r2 - 3 * r2 ** 2 + 2 * d * r1 + 6 * r1 * r2 - 3 * r1 ** 2) / (12.0 * d)
+
+def sphereDirectedDistance(radius1, radius2, centerDistance):
+
+	# Maximum distance from sphere 1 to sphere 2: |p - c2| ranges over [|r1 - d|, r1 + d]
+	return max(abs(radius1 + centerDistance - radius2), abs(abs(radius1 - centerDistance) - radius2))
+
+def radialGroundTruth(displacement, radius):
+
+	# Radial surface radius + displacement compared with the sphere of that radius
+	directions, weight = quadratureGrid()
+	radii = radius + displacement(directions)
+	volume1 = weight * np.sum(radii ** 3) / 3.0
+	volume2 = 4.0 / 3.0 * np.pi * radius ** 3
+	intersection = weight * np.sum(np.minimum(radii, radius) ** 3) / 3.0
+	maximumDisplacement = float(np.abs(radii - radius).max())
+	return {'dice': float(2.0 * intersection / (volume1 + volume2)), 'hausdorffMaxMm': maximumDisplacement, 'distanceMaxMm': maximumDisplacement}
+
+#
+# Cases
+#
+
+def createCase(shape, numberOfTriangles, seed=0):
+
+	if shape == 'spheres':
+		radius1, center1 = SPHERE_RADIUS, np.array([0.0, 0.0, 0.0])
+		radius2, center2 = 0.96 * SPHERE_RADIUS, np.array([3.0, 1.0, 0.0])
+		centerDistance = float(np.linalg.norm(center2 - center1))
+		surface1 = sphere(radius1, center1, numberOfTriangles)
+		surface2 = sphere(radius2, center2, numberOfTriangles)
+		volume1 = 4.0 / 3.0 * np.pi * radius1 ** 3
+		volume2 = 4.0 / 3.0 * np.pi * radius2 ** 3
+		directed12 = sphereDirectedDistance(radius1, radius2, centerDistance)
+		directed21 = sphereDirectedDistance(radius2, radius1, centerDistance)
+		groundTruth = {'dice': 2.0 * sphereIntersectionVolume(radius1, radius2, centerDistance) / (volume1 + volume2),
+			'hausdorffMaxMm': max(directed12, directed21), 'distanceMaxMm': directed12}
+	elif shape == 'ellipsoids':
+		# Points of the outer ellipsoid are at most (k - 1) * |p| / k from the inner one, with equality at
+		# the end of the major axis, which is also the farthest inner point from the outer surface
+		radii, scale = np.array([60.0, 40.0, 30.0]), 1.05
+		surface1 = ellipsoid(scale * radii, (0.0, 0.0, 0.0), numberOfTriangles)
+		surface2 = ellipsoid(radii, (0.0, 0.0, 0.0), numberOfTriangles)
+		distance = (scale - 1.0) * radii.max()
+		groundTruth = {'dice': 2.0 / (1.0 + scale ** 3), 'hausdorffMaxMm': distance, 'distanceMaxMm': distance}
+	elif shape in ['perturbed', 'noisy']:
+		if shape == 'perturbed':
+			displacement = bumpsDisplacement(0.04 * SPHERE_RADIUS)
+		else:
+			displacement = noiseDisplacement(0.03 * SPHERE_RADIUS, seed)
+		surface1 = radialSurface(lambda directions: SPHERE_RADIUS + displacement(directions), numberOfTriangles)
+		surface2 = sphere(SPHERE_RADIUS, (0.0, 0.0, 0.0), numberOfTriangles)
+		groundTruth = radialGroundTruth(displacement, SPHERE_RADIUS)
+	else:
+		raise ValueError('Unknown synthetic shape: ' + str(shape))
+	return {'name': '%s_%d' % (shape, numberOfTriangles), 'shape': shape, 'surface1': surface1, 'surface2': surface2, 'groundTruth': groundTruth}
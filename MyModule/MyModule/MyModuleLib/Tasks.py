@@ -0,0 +1,144 @@
+#
+# MyModuleLib: background execution of long computations
+#
+# A BackgroundTask runs a compute function on a worker thread and hands its result to an apply
+# function, which must be called from the main thread (it creates MRML nodes). The compute function
+# receives the task and reports progress with setProgress, which is also where cancellation takes
+# effect. The owner polls the task (for instance with a QTimer) and calls finish once it is done.
+# Intermediate results (a coarse preview) can be published with setPartialResult; the owner applies
+# them while polling with applyPartialResult. Synchronous runs only apply the final result.
+#
+
+import threading
+import time
+import traceback
+
+class TaskCancelled(Exception):
+	pass
+
+class BackgroundTask(object):
+
+	def __init__(self, name, compute, apply=None, applyPartial=None):
+
+		self.name = name
+		self.compute = compute  # compute(task) -> result, runs on the worker thread
+		self.apply = apply  # apply(result) -> value, runs on the main thread
+		self.applyPartial = applyPartial  # applyPartial(partialResult), runs on the main thread
+		self.lock = threading.Lock()
+		self.thread = None
+		self.cancelRequested = threading.Event()
+		self.finished = threading.Event()
+
+		# State read by the main thread
+		self.progress = 0.0
+		self.message = ''
+		self.result = None
+		self.partialResult = None
+		self.partialResultPending = False
+		self.error = None
+		self.errorTraceback = ''
+		self.cancelled = False
+		self.startTime = None
+		self.elapsedSeconds = 0.0
+
+	#
+	# Worker side
+	#
+
+	def setProgress(self, fraction, message=None):
+
+		with self.lock:
+			self.progress = min(max(float(fraction), 0.0), 1.0)
+			if message is not None:
+				self.message = message
+		self.checkCancelled()
+
+	def setPartialResult(self, partialResult):
+
+		# Only the latest partial result is kept until the main thread applies it
+		with self.lock:
+			self.partialResult = partialResult
+			self.partialResultPending = True
+		self.checkCancelled()
+
+	def checkCancelled(self):
+
+		if self.cancelRequested.is_set():
+			raise TaskCancelled(self.name + ' cancelled')
+
+	def run(self):
+
+		# Runs compute in the calling thread and stores the result or the error
+		self.startTime = time.time()
+		try:
+			self.checkCancelled()
+			self.result = self.compute(self)
+			self.setProgress(1.0)
+		except TaskCancelled:
+			self.cancelled = True
+		except Exception as e:
+			self.error = e
+			self.errorTraceback = traceback.format_exc()
+		self.elapsedSeconds = time.time() - self.startTime
+		self.finished.set()
+
+	#
+	# Main thread side
+	#
+
+	def start(self):
+
+		self.thread = threading.Thread(target=self.run, name='MyModule ' + self.name)
+		self.thread.daemon = True
+		self.thread.start()
+		return self
+
+	def cancel(self):
+
+		# Takes effect at the next progress report of the compute function
+		self.cancelRequested.set()
+
+	def isDone(self):
+
+		return self.finished.is_set()
+
+	def wait(self, timeout=None):
+
+		return self.finished.wait(timeout)
+
+	def status(self):
+
+		with self.lock:
+			return self.progress, self.message
+
+	def applyPartialResult(self):
+
+		# Applies the pending partial result, if any. Returns True if one was applied.
+		with self.lock:
+			if not self.partialResultPending:
+				return False
+			partialResult = self.partialResult
+			self.partialResult = None
+			self.partialResultPending = False
+		if self.applyPartial is not None:
+			self.applyPartial(partialResult)
+		return True
+
+	def finish(self):
+
+		# Must be called from the main thread once the task is done. Errors of the compute function
+		# are raised again here; cancelled tasks return None without applying anything.
+		self.wait()
+		if self.error is not None:
+			raise self.error
+		if self.cancelled:
+			return None
+		if self.apply is None:
+			return self.result
+		return self.apply(self.result)
+
+	def runSynchronously(self):
+
+		# Same behaviour without a worker thread (scripts, batch mode, tests)
+		self.run()
+		return self.finish()
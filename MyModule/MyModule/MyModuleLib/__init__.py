@@ -0,0 +1,3 @@
+#
+# MyModuleLib: helpers of the MyModule comparison module
+#
@@ -0,0 +1,719 @@
+#
+# MyModule BENCHMARK: timing and accuracy of every logic stage on synthetic surfaces
+#
+# Usage:
+#   Slicer --no-splash --no-main-window --python-script MyModuleBenchmark.py -- suite [options]
+#       all stages (load, align, dice, packedDice, hausdorff, exactHausdorff, edtHausdorff, colorMap, regions) through MyModuleLogic
+#       (SlicerRT is required)
+#   python MyModuleBenchmark.py suite [options]
+#       without Slicer: load (MyModuleLib/STLFiles.py), align, packedDice, exactHausdorff, edtHausdorff, colorMap and regions only,
+#       dice and hausdorff are skipped
+#   python MyModuleBenchmark.py engines [--resolutions 100 200 400] [--engines filter locator kdtree] [--workers 1 8]
+#       surface distance engines on sphere pairs
+#   Slicer --no-splash --python-script MyModuleBenchmark.py -- lifecycle [--runs 100] [--triangles 100000]
+#       repeated comparisons of the same pair (load, align, Dice, Hausdorff, color map): the number of
+#       scene nodes must stay constant and the resident memory flat (exit code 1 otherwise)
+#   python MyModuleBenchmark.py stl [--triangles 2000000 6000000] [--ascii]
+#       parse time and peak memory of STL readers: vtkSTLReader, STLFiles arrays and vtkPolyData, and
+#       slicer.util.loadSegmentation (the path used before STLFiles) when run inside Slicer
+#   python MyModuleBenchmark.py review [--cases 6] [--triangles 100000] [--review-seconds 5]
+#       walks through a case list with the review queue (MyModuleLib/ReviewQueue.py): time from NEXT to
+#       the next case ready (shown inside Slicer), whether it was prefetched, and resident memory
+#   python MyModuleBenchmark.py startup [--triangles 100000] [--runs 5] [--max-import-seconds 0.5]
+#       fresh Python processes importing MyModuleLib.Core and comparing one pair of files: import time,
+#       heavy modules loaded by the import (must not include Qt, Slicer, VTK or SciPy) and time to the
+#       first result (exit code 1 if the import is slower than the limit or loads a heavy module)
+#
+# Suite options:
+#   --shapes spheres ellipsoids perturbed noisy   synthetic pairs (see MyModuleLib/SyntheticMeshes.py)
+#   --triangles 10000 100000 500000 2000000       triangles per surface
+#   --repeat N                                    runs of every stage (the median time is reported)
+#   --voxel-spacing 0.5 0.5 0.5                   voxels (x, y, z) of the edtHausdorff stage (MyModuleLib/DistanceTransforms.py)
+#   --region-threshold 1.0                        distance (mm) of the regions stage (MyModuleLib/DisagreementRegions.py)
+#   --output results.json                         machine-readable results
+#   --compare baseline.json [--tolerance 1.25]    report stages slower than the baseline (exit code 1)
+#
+# Segment 2 is written rotated by 180 degrees around Z, so that the fixed alignment of the module
+# restores it. Every stage records its wall time and peak resident memory above the starting point,
+# and the value it computed next to the ground truth of the continuous shapes. The ground truth
+# assumes the original pose, which the automatic alignment may change for symmetric shapes. The
+# records of stages computing the same value with another method (edtHausdorff) also hold the
+# difference and the time ratio to the stages of STAGE_REFERENCES.
+#
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+
+import numpy as np
+import vtk
+from vtk.util import numpy_support
+
+moduleDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')
+sys.path.insert(0, moduleDir)
+from MyModuleLib import Core
+from MyModuleLib import DisagreementRegions
+from MyModuleLib import DistanceEngines
+from MyModuleLib import DistanceTransforms
+from MyModuleLib import PackedMasks
+from MyModuleLib import STLFiles
+from MyModuleLib import SurfaceHausdorff
+from MyModuleLib import SyntheticMeshes
+from MyModuleLib.ResourceUsage import PeakMemorySampler, currentRSS
+
+try:
+	import slicer
+	if not hasattr(slicer, 'app'):
+		slicer = None
+except ImportError:
+	slicer = None
+
+STAGES = ['load', 'align', 'dice', 'packedDice', 'hausdorff', 'exactHausdorff', 'edtHausdorff', 'colorMap', 'regions']
+
+# Distance (mm) of the disagreement regions of the regions stage
+DEFAULT_REGION_THRESHOLD_MM = 1.0
+
+# Ground truth value compared with the result of each stage
+STAGE_GROUND_TRUTH = {'dice': 'dice', 'packedDice': 'dice', 'hausdorff': 'hausdorffMaxMm', 'exactHausdorff': 'hausdorffMaxMm',
+	'edtHausdorff': 'hausdorffMaxMm', 'colorMap': 'distanceMaxMm'}
+
+# Stages whose value and time are compared with other stages computing the same value
+STAGE_REFERENCES = {'edtHausdorff': ['hausdorff', 'exactHausdorff']}
+
+# Stages faster than this are not reported as regressions (timer noise)
+MINIMUM_COMPARED_SECONDS = 0.05
+
+class StageNotAvailable(Exception):
+	pass
+
+#
+# Stage runners
+#
+
+class SlicerStageRunner(object):
+
+	# Stages computed by MyModuleLogic inside Slicer
+
+	def __init__(self, alignmentMode, distanceEngine, distanceWorkers, useCache, voxelSpacingMm=DistanceTransforms.DEFAULT_VOXEL_SPACING_MM,
+		regionThresholdMm=DEFAULT_REGION_THRESHOLD_MM):
+
+		from MyModule import MyModuleLogic
+		self.logic = MyModuleLogic()
+		self.logic.alignmentMode = alignmentMode
+		self.logic.distanceEngine = distanceEngine
+		self.logic.distanceWorkers = distanceWorkers
+		self.logic.hausdorffVoxelSpacingMm = voxelSpacingMm
+		self.logic.regionThresholdMm = regionThresholdMm
+		if not useCache:
+			self.logic.meshCache = None
+
+	def load(self, segment1_path, segment2_path):
+		self.logic.segment1_path = segment1_path
+		self.logic.segment2_path = segment2_path
+		if not self.logic.loadSegments():
+			raise IOError('Segments could not be loaded')
+
+	def align(self):
+		self.logic.alignSegments()
+
+	def dice(self):
+		self.logic.diceCoeff()
+		return self.logic.segCompNode.GetDiceCoefficient()
+
+	def packedDice(self):
+		return self.logic.computePackedDice()['dice']
+
+	def hausdorff(self):
+		self.logic.hausdorffDist()
+		return self.logic.segCompnode.GetMaximumHausdorffDistanceForBoundaryMm()
+
+	def exactHausdorff(self):
+		self.logic.hausdorffMode = 'exact'
+		try:
+			return self.logic.computeSurfaceHausdorff()['hausdorffMaxMm']
+		finally:
+			self.logic.hausdorffMode = 'segmentComparison'
+
+	def edtHausdorff(self):
+		self.logic.hausdorffMode = 'distanceTransform'
+		try:
+			return self.logic.computeSurfaceHausdorff()['hausdorffMaxMm']
+		finally:
+			self.logic.hausdorffMode = 'segmentComparison'
+
+	def colorMap(self):
+		distancePolyData = self.logic.computeDistanceMap()
+		self.logic.distancePolyData = distancePolyData
+		return float(numpy_support.vtk_to_numpy(distancePolyData.GetPointData().GetArray('Distance')).max())
+
+	def regions(self):
+		return self.logic.findDisagreementRegions()['numberOfRegions']
+
+	def clear(self):
+		self.logic.clearCase()
+
+class StandaloneStageRunner(object):
+
+	# The same stages with VTK and NumPy only (no SegmentComparison outside Slicer)
+
+	def __init__(self, alignmentMode, distanceEngine, distanceWorkers, alignmentSeed=0, voxelSpacingMm=DistanceTransforms.DEFAULT_VOXEL_SPACING_MM,
+		regionThresholdMm=DEFAULT_REGION_THRESHOLD_MM):
+
+		self.alignmentMode = alignmentMode
+		self.distanceEngine = distanceEngine
+		self.distanceWorkers = distanceWorkers
+		self.voxelSpacingMm = voxelSpacingMm
+		self.alignmentSeed = alignmentSeed
+		self.regionThresholdMm = regionThresholdMm
+		self.surface1 = None
+		self.surface2 = None
+		self.distancePolyData = None
+
+	def load(self, segment1_path, segment2_path):
+		self.surface1 = STLFiles.readSTLPolyData(segment1_path)
+		self.surface2 = STLFiles.readSTLPolyData(segment2_path)
+
+	def align(self):
+		# Points of segment 2 transformed by the alignment matrix, cells shared (as MyModuleLogic)
+		self.surface2 = Core.alignSurfaces(self.surface1, self.surface2, self.alignmentMode, self.alignmentSeed)[0]
+
+	def dice(self):
+		raise StageNotAvailable('SegmentComparison (SlicerRT) is only available inside Slicer')
+
+	def packedDice(self):
+		return PackedMasks.computeDice(self.surface1, self.surface2)['dice']
+
+	def hausdorff(self):
+		raise StageNotAvailable('SegmentComparison (SlicerRT) is only available inside Slicer')
+
+	def exactHausdorff(self):
+		return SurfaceHausdorff.exactHausdorff(self.surface1, self.surface2, self.distanceEngine)['hausdorffMaxMm']
+
+	def edtHausdorff(self):
+		return DistanceTransforms.distanceTransformHausdorff(self.surface1, self.surface2, self.voxelSpacingMm)['hausdorffMaxMm']
+
+	def colorMap(self):
+		self.distancePolyData = DistanceEngines.computeDistancePolyData(self.surface1, self.surface2, self.distanceEngine, self.distanceWorkers)
+		return float(numpy_support.vtk_to_numpy(self.distancePolyData.GetPointData().GetArray('Distance')).max())
+
+	def regions(self):
+		if self.distancePolyData is None:
+			raise StageNotAvailable('The regions stage needs the distances of the colorMap stage')
+		return DisagreementRegions.findRegions(self.distancePolyData, self.regionThresholdMm)['numberOfRegions']
+
+	def clear(self):
+		self.surface1 = None
+		self.surface2 = None
+		self.distancePolyData = None
+
+#
+# Suite
+#
+
+def writeSTL(polyData, path, rotationZ=0.0, binary=True):
+
+	transform = vtk.vtkTransform()
+	transform.RotateZ(rotationZ)
+	transformFilter = vtk.vtkTransformPolyDataFilter()
+	transformFilter.SetInputData(polyData)
+	transformFilter.SetTransform(transform)
+	writer = vtk.vtkSTLWriter()
+	writer.SetInputConnection(transformFilter.GetOutputPort())
+	writer.SetFileName(path)
+	if binary:
+		writer.SetFileTypeToBinary()
+	else:
+		writer.SetFileTypeToASCII()
+	writer.Write()
+
+def runStage(runner, stage, arguments=()):
+
+	with PeakMemorySampler() as sampler:
+		value = getattr(runner, stage)(*arguments)
+	return value, sampler.elapsedSeconds, sampler.peakDelta
+
+def runCase(runner, case, workDirectory, repeat):
+
+	segment1_path = os.path.join(workDirectory, case['name'] + '_1.stl')
+	segment2_path = os.path.join(workDirectory, case['name'] + '_2.stl')
+	writeSTL(case['surface1'], segment1_path)
+	writeSTL(case['surface2'], segment2_path, 180.0)
+
+	timings = {stage: [] for stage in STAGES}
+	peakMemory = {stage: 0 for stage in STAGES}
+	values = {}
+	errors = {}
+	for run in range(repeat):
+		for stage in STAGES:
+			if stage in errors:
+				continue
+			try:
+				value, seconds, peakDelta = runStage(runner, stage, (segment1_path, segment2_path) if stage == 'load' else ())
+			except StageNotAvailable as e:
+				errors[stage] = ('skipped', str(e))
+				continue
+			except Exception as e:
+				errors[stage] = ('failed', repr(e))
+				if stage in ['load', 'align']:
+					break  # later stages need the segments
+				continue
+			timings[stage].append(seconds)
+			peakMemory[stage] = max(peakMemory[stage], peakDelta)
+			values[stage] = value
+		runner.clear()
+
+	records = []
+	for stage in STAGES:
+		record = {'case': case['name'], 'shape': case['shape'],
+			'triangles': case['surface1'].GetNumberOfPolys(), 'points': case['surface1'].GetNumberOfPoints(),
+			'stage': stage}
+		if timings[stage]:
+			record['status'] = 'ok'
+			record['seconds'] = float(np.median(timings[stage]))
+			record['allSeconds'] = timings[stage]
+			record['peakMemoryMB'] = peakMemory[stage] / 1e6
+		else:
+			record['status'], record['error'] = errors.get(stage, ('failed', 'not run'))
+		if stage in STAGE_GROUND_TRUTH:
+			record['groundTruth'] = float(case['groundTruth'][STAGE_GROUND_TRUTH[stage]])
+			if stage in values:
+				record['value'] = float(values[stage])
+				record['absoluteError'] = abs(record['value'] - record['groundTruth'])
+		for referenceStage in STAGE_REFERENCES.get(stage, []):
+			if stage in values and referenceStage in values and timings[referenceStage]:
+				record.setdefault('agreement', {})[referenceStage] = {'differenceMm': float(values[stage]) - float(values[referenceStage]),
+					'timeRatio': record['seconds'] / max(float(np.median(timings[referenceStage])), 1e-9)}
+		records.append(record)
+	return records
+
+def environmentDescription():
+
+	description = {'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'platform': platform.platform(), 'processor': platform.processor(),
+		'cpuCount': os.cpu_count(), 'python': platform.python_version(), 'numpy': np.__version__, 'vtk': vtk.vtkVersion.GetVTKVersion()}
+	if slicer is not None:
+		description['slicer'] = slicer.app.applicationVersion
+	try:
+		description['gitRevision'] = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=moduleDir, stderr=subprocess.DEVNULL).decode().strip()
+	except (OSError, subprocess.CalledProcessError):
+		pass
+	return description
+
+def printRecord(record):
+
+	line = '%-22s %-14s' % (record['case'], record['stage'])
+	if record['status'] != 'ok':
+		print(line + ' ' + record['status'] + ': ' + str(record.get('error', '')))
+		return
+	line += ' %9.3f s %9.1f MB' % (record['seconds'], record['peakMemoryMB'])
+	if 'value' in record:
+		line += '   value %.4f  ground truth %.4f  error %.4f' % (record['value'], record['groundTruth'], record['absoluteError'])
+	print(line)
+	for referenceStage, agreement in sorted(record.get('agreement', {}).items()):
+		print('%-22s %-14s   vs %-14s difference %+.4f mm, time x%.2f' % ('', '', referenceStage, agreement['differenceMm'], agreement['timeRatio']))
+
+def runSuite(shapes, triangleCounts, repeat=1, alignmentMode='fixed', distanceEngine='auto', distanceWorkers=1, useCache=False, seed=0,
+	voxelSpacingMm=DistanceTransforms.DEFAULT_VOXEL_SPACING_MM, regionThresholdMm=DEFAULT_REGION_THRESHOLD_MM):
+
+	if slicer is not None:
+		runner = SlicerStageRunner(alignmentMode, distanceEngine, distanceWorkers, useCache, voxelSpacingMm, regionThresholdMm)
+	else:
+		print('Slicer is not available: dice and hausdorff stages are skipped')
+		runner = StandaloneStageRunner(alignmentMode, distanceEngine, distanceWorkers, voxelSpacingMm=voxelSpacingMm, regionThresholdMm=regionThresholdMm)
+	workDirectory = tempfile.mkdtemp(prefix='MyModuleBenchmark')
+	records = []
+	try:
+		for numberOfTriangles in triangleCounts:
+			for shape in shapes:
+				case = SyntheticMeshes.createCase(shape, numberOfTriangles, seed)
+				for record in runCase(runner, case, workDirectory, repeat):
+					printRecord(record)
+					records.append(record)
+	finally:
+		shutil.rmtree(workDirectory, ignore_errors=True)
+	settings = {'shapes': shapes, 'triangles': triangleCounts, 'repeat': repeat, 'alignmentMode': alignmentMode,
+		'distanceEngine': distanceEngine, 'distanceWorkers': distanceWorkers, 'cache': useCache, 'seed': seed,
+		'voxelSpacingMm': list(voxelSpacingMm), 'regionThresholdMm': regionThresholdMm, 'runner': 'slicer' if slicer is not None else 'standalone'}
+	return {'benchmark': 'MyModule', 'environment': environmentDescription(), 'settings': settings, 'results': records}
+
+def compareWithBaseline(report, baselinePath, tolerance):
+
+	# Number of stages slower than tolerance times the baseline
+	with open(baselinePath) as baselineFile:
+		baseline = json.load(baselineFile)
+	baselineSeconds = {(record['case'], record['stage']): record['seconds'] for record in baseline['results'] if record['status'] == 'ok'}
+	numberOfRegressions = 0
+	print('Comparison with ' + baselinePath)
+	for record in report['results']:
+		key = (record['case'], record['stage'])
+		if record['status'] != 'ok' or key not in baselineSeconds:
+			continue
+		ratio = record['seconds'] / max(baselineSeconds[key], 1e-9)
+		regression = ratio > tolerance and record['seconds'] > MINIMUM_COMPARED_SECONDS
+		numberOfRegressions += regression
+		print('%-22s %-14s %9.3f s -> %9.3f s  x%.2f%s' % (key[0], key[1], baselineSeconds[key], record['seconds'], ratio, '  REGRESSION' if regression else ''))
+	return numberOfRegressions
+
+#
+# Distance engines
+#
+
+def createSphere(radius, center, resolution):
+
+	sphereSource = vtk.vtkSphereSource()
+	sphereSource.SetRadius(radius)
+	sphereSource.SetCenter(center)
+	sphereSource.SetThetaResolution(resolution)
+	sphereSource.SetPhiResolution(resolution)
+	sphereSource.Update()
+	return sphereSource.GetOutput()
+
+def benchmarkDistanceEngines(resolutions, engineNames, workerCounts=(1,)):
+
+	results = []
+	for resolution in resolutions:
+		source = createSphere(50.0, (0.0, 0.0, 0.0), resolution)
+		target = createSphere(52.0, (3.0, 1.0, 0.0), resolution)
+		referenceDistances = None
+		for engineName in engineNames:
+			for numberOfWorkers in workerCounts:
+				if engineName == 'filter' and numberOfWorkers > 1:
+					continue
+				startTime = time.perf_counter()
+				distancePolyData = DistanceEngines.computeDistancePolyData(source, target, engineName, numberOfWorkers)
+				elapsedSeconds = time.perf_counter() - startTime
+				distances = numpy_support.vtk_to_numpy(distancePolyData.GetPointData().GetArray('Distance'))
+				if referenceDistances is None:
+					referenceDistances = distances
+				results.append({
+					'engine': engineName,
+					'workers': numberOfWorkers,
+					'triangles': target.GetNumberOfPolys(),
+					'points': source.GetNumberOfPoints(),
+					'seconds': elapsedSeconds,
+					'maxDifference': float(np.abs(distances - referenceDistances).max())})
+				print('%-8s %3d workers %9d triangles %9d points %8.2f s  max difference %.2e' % (engineName, numberOfWorkers,
+					results[-1]['triangles'], results[-1]['points'], elapsedSeconds, results[-1]['maxDifference']))
+	return results
+
+#
+# Scene node lifecycle
+#
+
+def benchmarkLifecycle(numberOfRuns, numberOfTriangles, warmupRuns=5, toleranceMB=20.0):
+
+	# Runs the comparison buttons on the same case numberOfRuns times. Memory growth is the difference
+	# between the median resident memory of the last runs and of the first runs after the warm-up.
+	if slicer is None:
+		print('The lifecycle benchmark needs Slicer (MRML scene)')
+		return None
+	from MyModule import MyModuleLogic
+	logic = MyModuleLogic()
+	logic.meshCache = None
+	logic.resultsStore = None
+	colorMap = slicer.app.layoutManager() is not None
+	if not colorMap:
+		print('No main window: the color map (scalar bar) is skipped')
+	workDirectory = tempfile.mkdtemp(prefix='MyModuleBenchmark')
+	runs = []
+	try:
+		case = SyntheticMeshes.createCase('spheres', numberOfTriangles)
+		segment1_path = os.path.join(workDirectory, 'lifecycle_1.stl')
+		segment2_path = os.path.join(workDirectory, 'lifecycle_2.stl')
+		writeSTL(case['surface1'], segment1_path)
+		writeSTL(case['surface2'], segment2_path, 180.0)
+		for run in range(numberOfRuns):
+			startTime = time.perf_counter()
+			logic.segment1_path = segment1_path
+			logic.segment2_path = segment2_path
+			logic.loadSegments()
+			logic.alignSegments()
+			logic.diceCoeff()
+			logic.hausdorffDist()
+			if colorMap:
+				logic.showColorMap()
+			slicer.app.processEvents()
+			runs.append({'run': run, 'seconds': time.perf_counter() - startTime, 'rssMB': currentRSS() / 1e6,
+				'sceneNodes': slicer.mrmlScene.GetNumberOfNodes()})
+			print('run %3d  %7.2f s  %9.1f MB  %5d scene nodes' % (run, runs[-1]['seconds'], runs[-1]['rssMB'], runs[-1]['sceneNodes']))
+		logic.clearCase()
+	finally:
+		shutil.rmtree(workDirectory, ignore_errors=True)
+
+	window = max(1, min(10, (numberOfRuns - warmupRuns) // 2))
+	firstRuns = runs[warmupRuns:warmupRuns + window]
+	lastRuns = runs[-window:]
+	summary = {'runs': numberOfRuns, 'triangles': numberOfTriangles,
+		'memoryGrowthMB': float(np.median([run['rssMB'] for run in lastRuns]) - np.median([run['rssMB'] for run in firstRuns])),
+		'sceneNodeGrowth': lastRuns[-1]['sceneNodes'] - firstRuns[0]['sceneNodes'],
+		'sceneNodesAfterClear': slicer.mrmlScene.GetNumberOfNodes()}
+	summary['flat'] = summary['sceneNodeGrowth'] == 0 and summary['memoryGrowthMB'] <= toleranceMB
+	print('Memory growth %.1f MB, scene node growth %d (%s)' % (summary['memoryGrowthMB'], summary['sceneNodeGrowth'],
+		'flat' if summary['flat'] else 'GROWING'))
+	return {'summary': summary, 'runs': runs}
+
+#
+# Review queue
+#
+
+def benchmarkReview(numberOfCases, numberOfTriangles, reviewSeconds=2.0, alignmentMode='fixed'):
+
+	# Walks through a case list like a reviewer spending reviewSeconds on every case. The switch time
+	# goes from NEXT to the case being ready (loaded, aligned and compared, and shown inside Slicer):
+	# it only includes the computation when the next case was not prefetched in time.
+	from MyModuleLib import ReviewQueue
+	workDirectory = tempfile.mkdtemp(prefix='MyModuleBenchmark')
+	cases = []
+	switches = []
+	try:
+		for index in range(numberOfCases):
+			shape = SyntheticMeshes.SHAPES[index % len(SyntheticMeshes.SHAPES)]
+			case = SyntheticMeshes.createCase(shape, numberOfTriangles, seed=index)
+			paths = [os.path.join(workDirectory, 'case%d_%d.stl' % (index, segment)) for segment in [1, 2]]
+			writeSTL(case['surface1'], paths[0])
+			writeSTL(case['surface2'], paths[1], 180.0)
+			cases.append({'case': 'case%d_%s' % (index, shape), 'segment1': paths[0], 'segment2': paths[1]})
+
+		if slicer is not None:
+			from MyModule import MyModuleLogic
+			logic = MyModuleLogic()
+			logic.resultsStore = None
+			logic.alignmentMode = alignmentMode
+			logic.startReview(cases)
+			queue = logic.reviewQueue
+
+			def isReady():
+				slicer.app.processEvents()
+				logic.updateReview()
+				return logic.reviewCaseShown == queue.index
+		else:
+			queue = ReviewQueue.ReviewQueue(cases, lambda case, progressCallback: ReviewQueue.prepareCase(case, progressCallback, alignmentMode))
+			queue.moveTo(0)
+			isReady = queue.poll
+
+		startRSS = currentRSS()
+		for index in range(numberOfCases):
+			startTime = time.perf_counter()
+			hits = queue.hits
+			if index > 0:
+				queue.next()
+			while not isReady():
+				time.sleep(0.005)
+			switch = {'case': cases[index]['case'], 'switchSeconds': time.perf_counter() - startTime, 'prefetched': queue.hits > hits}
+
+			# The next case is prepared while the reviewer looks at this one
+			reviewEnd = time.perf_counter() + reviewSeconds
+			while time.perf_counter() < reviewEnd:
+				isReady()
+				time.sleep(0.02)
+			switch['rssDeltaMB'] = (currentRSS() - startRSS) / 1e6
+			switches.append(switch)
+			print('%-24s switch %7.3f s  %-10s  %8.1f MB' % (switch['case'], switch['switchSeconds'],
+				'prefetched' if switch['prefetched'] else 'computed', switch['rssDeltaMB']))
+		if slicer is not None:
+			logic.stopReview()
+			logic.clearCase()
+		else:
+			queue.close()
+	finally:
+		shutil.rmtree(workDirectory, ignore_errors=True)
+
+	laterSwitches = [switch['switchSeconds'] for switch in switches[1:]] or [float('nan')]
+	summary = {'cases': numberOfCases, 'triangles': numberOfTriangles, 'reviewSeconds': reviewSeconds,
+		'firstSwitchSeconds': switches[0]['switchSeconds'], 'medianSwitchSeconds': float(np.median(laterSwitches)),
+		'maxSwitchSeconds': float(np.max(laterSwitches)), 'prefetched': sum(switch['prefetched'] for switch in switches),
+		'maxRssDeltaMB': max(switch['rssDeltaMB'] for switch in switches)}
+	print('First case %.2f s, next cases: median %.3f s, max %.3f s (%d/%d prefetched), memory at most %.1f MB above the first case' % (
+		summary['firstSwitchSeconds'], summary['medianSwitchSeconds'], summary['maxSwitchSeconds'], summary['prefetched'],
+		numberOfCases - 1, summary['maxRssDeltaMB']))
+	return {'summary': summary, 'switches': switches}
+
+#
+# STL readers
+#
+
+def readWithVTK(path):
+
+	reader = vtk.vtkSTLReader()
+	reader.SetFileName(path)
+	reader.Update()
+	return reader.GetOutput()
+
+def readWithSlicer(path):
+
+	# Segmentation node as created by MyModuleLogic before STLFiles (removed after the measurement)
+	node = slicer.util.loadSegmentation(path)
+	polyData = vtk.vtkPolyData()
+	polyData.ShallowCopy(node.GetSegmentation().GetNthSegment(0).GetRepresentation(
+		slicer.vtkSegmentationConverter.GetSegmentationClosedSurfaceRepresentationName()))
+	slicer.mrmlScene.RemoveNode(node)
+	return polyData
+
+def benchmarkSTLReaders(triangleCounts, binary=True, repeat=1):
+
+	readers = [('vtkSTLReader', readWithVTK), ('STLFiles.readSTL', STLFiles.readSTL), ('STLFiles.readSTLPolyData', STLFiles.readSTLPolyData)]
+	if slicer is not None:
+		readers.append(('loadSegmentation', readWithSlicer))
+	workDirectory = tempfile.mkdtemp(prefix='MyModuleBenchmark')
+	results = []
+	try:
+		for numberOfTriangles in triangleCounts:
+			path = os.path.join(workDirectory, 'sphere_%d.stl' % numberOfTriangles)
+			writeSTL(SyntheticMeshes.sphere(SyntheticMeshes.SPHERE_RADIUS, (0.0, 0.0, 0.0), numberOfTriangles), path, binary=binary)
+			fileMB = os.path.getsize(path) / 1e6
+			for readerName, reader in readers:
+				timings = []
+				peakMemory = 0
+				for run in range(repeat):
+					with PeakMemorySampler() as sampler:
+						output = reader(path)
+					timings.append(sampler.elapsedSeconds)
+					peakMemory = max(peakMemory, sampler.peakDelta)
+					numberOfPoints = len(output[0]) if isinstance(output, tuple) else output.GetNumberOfPoints()
+					del output
+				results.append({'reader': readerName, 'format': 'binary' if binary else 'ascii', 'triangles': numberOfTriangles,
+					'fileMB': fileMB, 'points': numberOfPoints, 'seconds': float(np.median(timings)), 'peakMemoryMB': peakMemory / 1e6})
+				print('%-26s %-6s %9d triangles %8.1f MB file %8.2f s %9.1f MB peak' % (readerName, results[-1]['format'],
+					numberOfTriangles, fileMB, results[-1]['seconds'], results[-1]['peakMemoryMB']))
+			os.remove(path)
+	finally:
+		shutil.rmtree(workDirectory, ignore_errors=True)
+	return results
+
+# Run in a fresh interpreter: only MyModuleLib is on the path, as in a batch worker
+STARTUP_SCRIPT = '''
+import sys, time, json
+startTime = time.perf_counter()
+sys.path.insert(0, sys.argv[1])
+from MyModuleLib import Core
+importSeconds = time.perf_counter() - startTime
+loadedModules = [name for name in %r if name in sys.modules]
+row = Core.compareFiles(sys.argv[2], sys.argv[3])
+firstResultSeconds = time.perf_counter() - startTime
+print(json.dumps({'importSeconds': importSeconds, 'firstResultSeconds': firstResultSeconds, 'loadedModules': loadedModules, 'dice': row['dice']}))
+'''
+
+HEAVY_MODULES = ['qt', 'ctk', 'slicer', 'vtk', 'vtkmodules', 'scipy']
+
+def benchmarkStartup(numberOfTriangles, numberOfRuns=5, maximumImportSeconds=0.5):
+
+	workDirectory = tempfile.mkdtemp(prefix='MyModuleBenchmark')
+	runs = []
+	try:
+		case = SyntheticMeshes.createCase('spheres', numberOfTriangles)
+		paths = [os.path.join(workDirectory, 'segment1.stl'), os.path.join(workDirectory, 'segment2.stl')]
+		writeSTL(case['surface1'], paths[0])
+		writeSTL(case['surface2'], paths[1], rotationZ=180.0)
+		for run in range(numberOfRuns):
+			startTime = time.perf_counter()
+			output = subprocess.check_output([sys.executable, '-c', STARTUP_SCRIPT % HEAVY_MODULES, os.path.abspath(moduleDir)] + paths)
+			result = json.loads(output.decode().strip().splitlines()[-1])
+			result['processSeconds'] = time.perf_counter() - startTime
+			runs.append(result)
+			print('run %d: import %.3f s (loaded: %s), first result %.3f s, process %.3f s' % (run + 1, result['importSeconds'],
+				', '.join(result['loadedModules']) or 'no heavy module', result['firstResultSeconds'], result['processSeconds']))
+	finally:
+		shutil.rmtree(workDirectory, ignore_errors=True)
+	summary = {name: float(np.median([run[name] for run in runs])) for name in ['importSeconds', 'firstResultSeconds', 'processSeconds']}
+	summary['loadedModules'] = sorted(set(name for run in runs for name in run['loadedModules']))
+	summary['fast'] = summary['importSeconds'] <= maximumImportSeconds and not summary['loadedModules']
+	print('Median: import %.3f s, first result %.3f s (%s)' % (summary['importSeconds'], summary['firstResultSeconds'],
+		'ok' if summary['fast'] else 'slower than %.2f s or heavy modules loaded' % maximumImportSeconds))
+	return {'summary': summary, 'runs': runs}
+
+def main(argv):
+
+	parser = argparse.ArgumentParser(description='Benchmarks of the MyModule logic.')
+	subparsers = parser.add_subparsers(dest='command')
+
+	suiteParser = subparsers.add_parser('suite', help='time every logic stage on synthetic surfaces')
+	suiteParser.add_argument('--shapes', nargs='+', default=SyntheticMeshes.SHAPES, choices=SyntheticMeshes.SHAPES)
+	suiteParser.add_argument('--triangles', type=int, nargs='+', default=[10000, 100000, 500000, 2000000], help='triangles per surface')
+	suiteParser.add_argument('--repeat', type=int, default=1, help='runs of every stage (median time is reported)')
+	suiteParser.add_argument('--alignment', choices=['fixed', 'automatic'], default='fixed')
+	suiteParser.add_argument('--engine', default='auto', choices=DistanceEngines.DISTANCE_ENGINES, help='color map distance engine')
+	suiteParser.add_argument('--workers', type=int, default=1, help='cores used by the color map distances')
+	suiteParser.add_argument('--cache', action='store_true', help='keep the surface and labelmap cache enabled')
+	suiteParser.add_argument('--seed', type=int, default=0, help='seed of the noisy shapes')
+	suiteParser.add_argument('--voxel-spacing', type=float, nargs=3, default=list(DistanceTransforms.DEFAULT_VOXEL_SPACING_MM),
+		help='voxel spacing (x y z, mm) of the edtHausdorff stage')
+	suiteParser.add_argument('--region-threshold', type=float, default=DEFAULT_REGION_THRESHOLD_MM, help='distance (mm) of the regions stage')
+	suiteParser.add_argument('--output', help='JSON file where results are written')
+	suiteParser.add_argument('--compare', help='JSON results of a previous run')
+	suiteParser.add_argument('--tolerance', type=float, default=1.25, help='slowdown ratio reported as a regression')
+
+	enginesParser = subparsers.add_parser('engines', help='compare surface distance engines on sphere pairs')
+	enginesParser.add_argument('--resolutions', type=int, nargs='+', default=[100, 200, 400, 700], help='sphere theta/phi resolutions')
+	enginesParser.add_argument('--engines', nargs='+', default=['filter', 'locator', 'kdtree'], choices=DistanceEngines.DISTANCE_ENGINES)
+	enginesParser.add_argument('--workers', type=int, nargs='+', default=[1], help='numbers of workers to compare')
+	enginesParser.add_argument('--output', help='JSON file where results are written')
+
+	stlParser = subparsers.add_parser('stl', help='compare STL readers on large sphere files')
+	stlParser.add_argument('--triangles', type=int, nargs='+', default=[2000000, 6000000], help='triangles per file (6M is a 300 MB binary file)')
+	stlParser.add_argument('--ascii', action='store_true', help='write ASCII files instead of binary ones')
+	stlParser.add_argument('--repeat', type=int, default=1, help='runs of every reader (median time is reported)')
+	stlParser.add_argument('--output', help='JSON file where results are written')
+
+	lifecycleParser = subparsers.add_parser('lifecycle', help='check that repeated comparisons do not accumulate scene nodes or memory (Slicer)')
+	lifecycleParser.add_argument('--runs', type=int, default=100, help='comparisons of the same case')
+	lifecycleParser.add_argument('--triangles', type=int, default=100000, help='triangles per surface')
+	lifecycleParser.add_argument('--tolerance', type=float, default=20.0, help='memory growth (MB) still reported as flat')
+	lifecycleParser.add_argument('--output', help='JSON file where results are written')
+
+	startupParser = subparsers.add_parser('startup', help='import and first result times of MyModuleLib.Core in fresh processes')
+	startupParser.add_argument('--triangles', type=int, default=100000, help='triangles per surface')
+	startupParser.add_argument('--runs', type=int, default=5, help='processes started (median times are reported)')
+	startupParser.add_argument('--max-import-seconds', type=float, default=0.5, help='import time still reported as fast')
+	startupParser.add_argument('--output', help='JSON file where results are written')
+
+	reviewParser = subparsers.add_parser('review', help='case switch times of the review queue with prefetch of the next case')
+	reviewParser.add_argument('--cases', type=int, default=6, help='cases of the list')
+	reviewParser.add_argument('--triangles', type=int, default=100000, help='triangles per surface')
+	reviewParser.add_argument('--review-seconds', type=float, default=5.0, help='time spent on every case before NEXT')
+	reviewParser.add_argument('--alignment', choices=['fixed', 'automatic'], default='fixed')
+	reviewParser.add_argument('--output', help='JSON file where results are written')
+
+	args = parser.parse_args(argv)
+	if args.command == 'lifecycle':
+		results = benchmarkLifecycle(args.runs, args.triangles, toleranceMB=args.tolerance)
+		if results is None:
+			return 1
+		report = dict({'benchmark': 'MyModule scene node lifecycle', 'environment': environmentDescription()}, **results)
+	elif args.command == 'startup':
+		report = dict({'benchmark': 'MyModule startup', 'environment': environmentDescription()},
+			**benchmarkStartup(args.triangles, args.runs, args.max_import_seconds))
+	elif args.command == 'review':
+		report = dict({'benchmark': 'MyModule review queue', 'environment': environmentDescription()},
+			**benchmarkReview(args.cases, args.triangles, args.review_seconds, args.alignment))
+	elif args.command == 'stl':
+		report = {'benchmark': 'MyModule STL readers', 'environment': environmentDescription(),
+			'results': benchmarkSTLReaders(args.triangles, not args.ascii, args.repeat)}
+	elif args.command == 'engines':
+		report = {'benchmark': 'MyModule distance engines', 'environment': environmentDescription(),
+			'results': benchmarkDistanceEngines(args.resolutions, args.engines, args.workers)}
+	elif args.command == 'suite':
+		report = runSuite(args.shapes, args.triangles, args.repeat, args.alignment, args.engine, args.workers, args.cache, args.seed,
+			args.voxel_spacing, args.region_threshold)
+	else:
+		parser.print_help()
+		return 1
+
+	if args.output:
+		with open(args.output, 'w') as outputFile:
+			json.dump(report, outputFile, indent=1)
+		print('Results written to ' + args.output)
+	if args.command == 'suite' and args.compare:
+		return 1 if compareWithBaseline(report, args.compare, args.tolerance) else 0
+	if args.command == 'lifecycle':
+		return 0 if report['summary']['flat'] else 1
+	if args.command == 'startup':
+		return 0 if report['summary']['fast'] else 1
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main(sys.argv[1:]))
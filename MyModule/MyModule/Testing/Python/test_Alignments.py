@@ -0,0 +1,90 @@
+#
+# MyModuleLib/Alignments.py: surfaces aligned on the fly, ITK conversion and evaluation of candidate alignments
+#
+
+import os
+import sys
+import unittest
+
+import numpy as np
+from vtkmodules.vtkCommonTransforms import vtkTransform
+from vtkmodules.vtkFiltersGeneral import vtkTransformPolyDataFilter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from MyModuleLib import Alignments
+from MyModuleLib import DistanceEngines
+from MyModuleLib import SyntheticMeshes
+
+def transformedWithVTK(polyData, matrix):
+
+	transform = vtkTransform()
+	transform.SetMatrix(np.asarray(matrix).ravel())
+	transformFilter = vtkTransformPolyDataFilter()
+	transformFilter.SetInputData(polyData)
+	transformFilter.SetTransform(transform)
+	transformFilter.Update()
+	return transformFilter.GetOutput()
+
+class AlignmentsTest(unittest.TestCase):
+
+	def setUp(self):
+
+		self.polyData1 = SyntheticMeshes.ellipsoid((30.0, 20.0, 15.0), (0.0, 0.0, 0.0), 5000)
+		self.polyData2 = SyntheticMeshes.ellipsoid((28.0, 21.0, 14.0), (-2.0, 1.0, 0.5), 4000)
+		self.rigidMatrix = Alignments.FIXED_ALIGNMENT.copy()
+		self.rigidMatrix[:3, 3] = [1.0, -2.0, 3.0]
+		self.affineMatrix = np.diag([1.1, 0.9, 1.0, 1.0])
+
+	def test_transformedPolyDataMatchesVTK(self):
+
+		transformed = Alignments.transformedPolyData(self.polyData2, self.rigidMatrix)
+		np.testing.assert_allclose(DistanceEngines.polyDataPoints(transformed),
+			DistanceEngines.polyDataPoints(transformedWithVTK(self.polyData2, self.rigidMatrix)), atol=1e-4)
+		# The cells are shared, the original points are not modified
+		self.assertIs(transformed.GetPolys(), self.polyData2.GetPolys())
+		self.assertIs(Alignments.transformedPolyData(self.polyData2, np.eye(4)), self.polyData2)
+
+	def test_isRigid(self):
+
+		self.assertTrue(Alignments.isRigid(self.rigidMatrix))
+		self.assertFalse(Alignments.isRigid(self.affineMatrix))
+		self.assertFalse(Alignments.isRigid(np.diag([-1.0, 1.0, 1.0, 1.0])))
+
+	def test_matrixFromITKParameters(self):
+
+		# Translation of the LPS points of the fixed image by (1, 2, 3): segment 2 is moved by (1, 2, -3) in RAS
+		matrix = Alignments.matrixFromITKParameters(list(np.eye(3).ravel()) + [1.0, 2.0, 3.0], [0.0, 0.0, 0.0])
+		expected = np.eye(4)
+		expected[:3, 3] = [1.0, 2.0, -3.0]
+		np.testing.assert_allclose(matrix, expected, atol=1e-12)
+
+	def test_evaluatorMatchesTransformedSurfaces(self):
+
+		# Distances of the rigid (inverse matrix) and non-rigid (transformed surface) paths against the
+		# distances computed between explicitly transformed surfaces
+		evaluator = Alignments.AlignmentEvaluator(self.polyData1, self.polyData2, 'kdtree')
+		for matrix in [self.rigidMatrix, self.affineMatrix]:
+			transformed = transformedWithVTK(self.polyData2, matrix)
+			distances12, distances21 = evaluator.distances(matrix)
+			np.testing.assert_allclose(distances12, DistanceEngines.computeDistances('kdtree', transformed,
+				DistanceEngines.polyDataPoints(self.polyData1)), atol=1e-3)
+			np.testing.assert_allclose(distances21, DistanceEngines.computeDistances('kdtree', self.polyData1,
+				DistanceEngines.polyDataPoints(transformed)), atol=1e-3)
+		self.assertEqual(sorted(evaluator.engines), [1, 2])
+
+	def test_candidates(self):
+
+		candidates = Alignments.AlignmentCandidates()
+		candidates.add('fixed', Alignments.FIXED_ALIGNMENT, 'fixed')
+		candidates.add('automatic', self.rigidMatrix, 'registration', rmsResidual=0.5)
+		candidates.setMetrics('fixed', {'dice': 0.5})
+		candidates.add('fixed', np.eye(4), 'fixed')
+		self.assertEqual(candidates.names(), ['fixed', 'automatic'])
+		self.assertIsNone(candidates.get('fixed')['metrics'])
+		self.assertEqual(candidates.get('automatic')['details'], {'rmsResidual': 0.5})
+		self.assertIn('automatic', candidates)
+		candidates.clear()
+		self.assertEqual(len(candidates), 0)
+
+if __name__ == '__main__':
+	unittest.main()
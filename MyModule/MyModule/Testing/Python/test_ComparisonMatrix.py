@@ -0,0 +1,56 @@
+#
+# MyModuleLib/ComparisonMatrix.py: engine names accepted by the widget, symmetric matrices and
+# surfaces shared between rows and columns
+#
+
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from MyModuleLib import ComparisonMatrix
+from MyModuleLib import Labelmaps
+from MyModuleLib import SyntheticMeshes
+
+class ComparisonMatrixTest(unittest.TestCase):
+
+	def setUp(self):
+
+		self.segments = [
+			('sphere', SyntheticMeshes.sphere(20.0, (0.0, 0.0, 0.0), 2000)),
+			('shifted', SyntheticMeshes.sphere(20.0, (3.0, 0.0, 0.0), 2000)),
+			('ellipsoid', SyntheticMeshes.ellipsoid((24.0, 18.0, 16.0), (0.0, 1.0, 0.0), 2000))]
+
+	def test_filterEngineFallsBackToAuto(self):
+
+		# 'filter' only exists for distance maps: the matrix uses the 'auto' engine instead
+		filterResult = ComparisonMatrix.computeComparisonMatrix(self.segments[:2], self.segments[:2], 2.0, 'filter')
+		autoResult = ComparisonMatrix.computeComparisonMatrix(self.segments[:2], self.segments[:2], 2.0, 'auto')
+		for metric in ComparisonMatrix.MATRIX_METRICS:
+			np.testing.assert_allclose(filterResult['matrices'][metric], autoResult['matrices'][metric])
+
+	def test_sharedSurfacesGiveSymmetricMatrices(self):
+
+		grid = Labelmaps.gridForSurfaces([polyData for name, polyData in self.segments], 2.0)
+		prepared = ComparisonMatrix.prepareSegments(self.segments + self.segments, grid)
+		self.assertEqual(len(prepared), len(self.segments))
+
+		result = ComparisonMatrix.computeComparisonMatrix(self.segments, self.segments, 2.0)
+		self.assertEqual(result['rowNames'], ['sphere', 'shifted', 'ellipsoid'])
+		self.assertEqual(result['columnNames'], result['rowNames'])
+		for metric in ComparisonMatrix.MATRIX_METRICS:
+			matrix = result['matrices'][metric]
+			self.assertEqual(matrix.shape, (3, 3))
+			np.testing.assert_array_equal(matrix, matrix.T)
+		np.testing.assert_array_equal(np.diag(result['matrices']['dice']), 1.0)
+		np.testing.assert_array_equal(np.diag(result['matrices']['hausdorffMaxMm']), 0.0)
+
+		# Off-diagonal pairs: two equal spheres 3 mm apart
+		self.assertAlmostEqual(result['matrices']['hausdorffMaxMm'][0, 1], 3.0, delta=0.5)
+		self.assertLess(result['matrices']['dice'][0, 1], 1.0)
+		self.assertGreater(result['matrices']['dice'][0, 1], 0.8)
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,81 @@
+#
+# MyModuleLib/DisagreementRegions.py: regions of a distance map with known caps above the threshold
+#
+
+import os
+import sys
+import unittest
+
+import numpy as np
+from vtkmodules.util import numpy_support
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from MyModuleLib import DisagreementRegions
+from MyModuleLib import DistanceEngines
+from MyModuleLib import SyntheticMeshes
+
+RADIUS = 20.0
+
+def distanceMap(distanceFunction):
+
+	# Sphere with a 'Distance' point array given by a function of the vertex coordinates
+	polyData = SyntheticMeshes.sphere(RADIUS, (0.0, 0.0, 0.0), 20000)
+	distances = numpy_support.numpy_to_vtk(distanceFunction(DistanceEngines.polyDataPoints(polyData).astype(np.float64)), deep=1)
+	distances.SetName('Distance')
+	polyData.GetPointData().AddArray(distances)
+	return polyData
+
+def capsDistances(points):
+
+	# North cap of height 0.2 R at 3 mm, south cap of height 0.1 R at 5 mm, 0 elsewhere
+	z = points[:, 2]
+	return np.where(z > 0.8 * RADIUS, 3.0, np.where(z < -0.9 * RADIUS, 5.0, 0.0))
+
+class DisagreementRegionsTest(unittest.TestCase):
+
+	def test_capsAreSeparateRegions(self):
+
+		regions = DisagreementRegions.findRegions(distanceMap(capsDistances), thresholdMm=2.0)
+		self.assertEqual(regions['numberOfRegions'], 2)
+		# Largest region first: cap areas are 2 pi R h
+		np.testing.assert_allclose(regions['areaMm2'], [2 * np.pi * RADIUS * 0.2 * RADIUS, 2 * np.pi * RADIUS * 0.1 * RADIUS], rtol=0.1)
+		np.testing.assert_allclose(regions['maxMm'], [3.0, 5.0])
+		np.testing.assert_allclose(regions['meanMm'], [3.0, 5.0])
+		self.assertGreater(regions['centroid'][0, 2], 0.8 * RADIUS)
+		self.assertLess(regions['centroid'][1, 2], -0.9 * RADIUS)
+		np.testing.assert_allclose(regions['centroid'][:, :2], 0.0, atol=0.1)
+
+	def test_vertexLabels(self):
+
+		polyData = distanceMap(capsDistances)
+		z = DistanceEngines.polyDataPoints(polyData)[:, 2]
+		labels = DisagreementRegions.findRegions(polyData, thresholdMm=2.0)['vertexLabels']
+		np.testing.assert_array_equal(labels, np.where(z > 0.8 * RADIUS, 0, np.where(z < -0.9 * RADIUS, 1, -1)))
+
+	def test_orderAndMinimumArea(self):
+
+		polyData = distanceMap(capsDistances)
+		regions = DisagreementRegions.findRegions(polyData, thresholdMm=2.0, orderBy='maxMm')
+		np.testing.assert_allclose(regions['maxMm'], [5.0, 3.0])
+		regions = DisagreementRegions.findRegions(polyData, thresholdMm=2.0, minimumAreaMm2=2 * np.pi * RADIUS * 0.15 * RADIUS)
+		self.assertEqual(regions['numberOfRegions'], 1)
+		self.assertEqual((regions['vertexLabels'] == 0).sum(), regions['numberOfVertices'][0])
+		with self.assertRaises(ValueError):
+			DisagreementRegions.findRegions(polyData, orderBy='unknown')
+
+	def test_noRegionAboveThreshold(self):
+
+		regions = DisagreementRegions.findRegions(distanceMap(capsDistances), thresholdMm=10.0)
+		self.assertEqual(regions['numberOfRegions'], 0)
+		self.assertTrue((regions['vertexLabels'] == -1).all())
+
+	def test_maximumVertex(self):
+
+		# Distance growing towards the north pole: the maximum is reached at the top vertex
+		regions = DisagreementRegions.findRegions(distanceMap(lambda points: points[:, 2]), thresholdMm=RADIUS / 2)
+		self.assertEqual(regions['numberOfRegions'], 1)
+		self.assertAlmostEqual(regions['maxPoint'][0, 2], regions['maxMm'][0], places=4)
+		self.assertGreater(regions['maxMm'][0], 0.99 * RADIUS)
+
+if __name__ == '__main__':
+	unittest.main()
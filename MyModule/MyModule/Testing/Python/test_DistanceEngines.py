@@ -0,0 +1,57 @@
+#
+# MyModuleLib/DistanceEngines.py: every engine gives the same distances, with any number of workers
+#
+
+import os
+import sys
+import unittest
+
+import numpy as np
+from vtkmodules.util import numpy_support
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from MyModuleLib import Backends
+from MyModuleLib import DistanceEngines
+from MyModuleLib import SyntheticMeshes
+
+class DistanceEnginesTest(unittest.TestCase):
+
+	def setUp(self):
+
+		self.source = SyntheticMeshes.sphere(50.0, (3.0, 1.0, 0.0), 20000)
+		self.target = SyntheticMeshes.sphere(48.0, (0.0, 0.0, 0.0), 20000)
+
+	def distances(self, engineName, numberOfWorkers=1):
+
+		distancePolyData = DistanceEngines.computeDistancePolyData(self.source, self.target, engineName, numberOfWorkers)
+		return numpy_support.vtk_to_numpy(distancePolyData.GetPointData().GetArray('Distance'))
+
+	def test_enginesAgree(self):
+
+		reference = self.distances('filter')
+		engineNames = ['locator'] + (['kdtree'] if Backends.kdTreeClass() is not None else [])
+		for engineName in engineNames:
+			np.testing.assert_allclose(self.distances(engineName), reference, atol=1e-4, err_msg=engineName)
+
+	def test_distancesToSphere(self):
+
+		# Vertices of the source sphere against the analytic distance to the (tessellated) target sphere
+		points = DistanceEngines.polyDataPoints(self.source)
+		expected = np.abs(np.linalg.norm(points, axis=1) - 48.0)
+		np.testing.assert_allclose(self.distances('locator'), expected, atol=0.05)
+
+	def test_workersDoNotChangeResults(self):
+
+		points = np.random.RandomState(0).uniform(-60.0, 60.0, (2 * DistanceEngines.MINIMUM_POINTS_PER_WORKER, 3))
+		reference = DistanceEngines.computeDistances('locator', self.target, points)
+		# The locator only uses processes for very large meshes: the process pool is run directly, into a
+		# given array and into its own one
+		distances = np.empty(len(points))
+		self.assertIs(DistanceEngines.computeDistancesWithProcesses('locator', self.target, points, distances, 2), distances)
+		np.testing.assert_array_equal(distances, reference)
+		np.testing.assert_array_equal(DistanceEngines.computeDistancesWithProcesses('locator', self.target, points, None, 2), reference)
+		if Backends.kdTreeClass() is not None:
+			np.testing.assert_allclose(DistanceEngines.computeDistances('kdtree', self.target, points, numberOfWorkers=2), reference, atol=1e-4)
+
+if __name__ == '__main__':
+	unittest.main()
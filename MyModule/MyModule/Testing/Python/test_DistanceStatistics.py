@@ -0,0 +1,81 @@
+#
+# MyModuleLib/DistanceStatistics.py: chunked statistics of several arrays against NumPy on their
+# concatenation, with values on the bin edges of the percentile selection and of the histogram
+#
+
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from MyModuleLib import DistanceStatistics
+
+class DistanceStatisticsTest(unittest.TestCase):
+
+	def setUp(self):
+
+		# Small chunks, so that every array is split and chunks straddle the arrays
+		self.chunkSize = DistanceStatistics.CHUNK_SIZE
+		DistanceStatistics.CHUNK_SIZE = 1000
+		randomState = np.random.RandomState(0)
+		self.arrays = [randomState.gamma(2.0, 1.5, 12345).astype(np.float32), randomState.gamma(1.0, 3.0, 6789).astype(np.float32)]
+
+	def tearDown(self):
+
+		DistanceStatistics.CHUNK_SIZE = self.chunkSize
+
+	def assertMatchesNumPy(self, arrays):
+
+		values = np.concatenate(arrays).astype(np.float64)
+		statistics = DistanceStatistics.distanceStatistics(arrays)
+		self.assertEqual(statistics['count'], len(values))
+		self.assertEqual(statistics['maxMm'], values.max())
+		self.assertAlmostEqual(statistics['meanMm'], values.mean(), places=5)
+		self.assertAlmostEqual(statistics['rmsMm'], np.sqrt(np.mean(values ** 2)), places=5)
+		self.assertAlmostEqual(statistics['percentile95Mm'], np.percentile(values, 95), places=5)
+		minimum, maximum = values.min(), values.max()
+		for fraction in [0.0, 0.25, 0.5, 0.99, 1.0]:
+			self.assertAlmostEqual(DistanceStatistics.percentile(arrays, fraction, minimum, maximum),
+				np.percentile(values, 100 * fraction), places=5)
+		return statistics
+
+	def test_chunkedStatisticsMatchNumPy(self):
+
+		self.assertMatchesNumPy(self.arrays)
+
+	def test_valuesOnBinEdges(self):
+
+		# Values on a 1/SELECTION_BINS grid of the range, with many ties: ranks fall on bin boundaries
+		edges = np.linspace(0.0, 8.0, DistanceStatistics.SELECTION_BINS + 1)
+		randomState = np.random.RandomState(1)
+		arrays = [edges[randomState.randint(0, len(edges), 5000)], np.repeat(edges[[0, 2048, -1]], 700)]
+		self.assertMatchesNumPy(arrays)
+		# A single repeated value
+		self.assertMatchesNumPy([np.full(2500, 3.0)])
+
+	def test_histogramCounts(self):
+
+		binWidthMm, bins = DistanceStatistics.DEFAULT_HISTOGRAM_BIN_WIDTH_MM, DistanceStatistics.DEFAULT_HISTOGRAM_BINS
+		statistics = DistanceStatistics.distanceStatistics(self.arrays)
+		values = np.concatenate(self.arrays)
+		# Bins of binWidthMm from 0, the last bin also counts the larger distances
+		expected, edges = np.histogram(np.minimum(values, (bins - 0.5) * binWidthMm), DistanceStatistics.histogramEdges())
+		np.testing.assert_array_equal(statistics['histogramCounts'], expected)
+		self.assertEqual(statistics['histogramCounts'].sum(), len(values))
+
+		# A distance on an edge counts in the bin above it
+		edgeStatistics = DistanceStatistics.distanceStatistics([np.array([0.0, binWidthMm, 2 * binWidthMm, 100.0])])
+		np.testing.assert_array_equal(edgeStatistics['histogramCounts'][:3], [1, 1, 1])
+		self.assertEqual(edgeStatistics['histogramCounts'][-1], 1)
+
+	def test_emptyArrays(self):
+
+		statistics = DistanceStatistics.distanceStatistics([np.zeros(0, dtype=np.float32)])
+		self.assertEqual(statistics['count'], 0)
+		self.assertTrue(np.isnan(statistics['maxMm']))
+		self.assertEqual(statistics['histogramCounts'].sum(), 0)
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,56 @@
+#
+# MyModuleLib/DistanceTransforms.py: the NumPy distance transform against SciPy, and the boundary
+# Hausdorff distance of two offset spheres
+#
+
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from MyModuleLib import Backends
+from MyModuleLib import DistanceTransforms
+from MyModuleLib import SyntheticMeshes
+
+class DistanceTransformsTest(unittest.TestCase):
+
+	@unittest.skipIf(Backends.distanceTransformFunction() is None, 'SciPy is not available')
+	def test_numpyTransformMatchesSciPy(self):
+
+		randomState = np.random.RandomState(0)
+		for shape, spacing in [((20, 30, 40), (1.0, 1.0, 1.0)), ((17, 9, 23), (0.5, 0.7, 1.3))]:
+			features = randomState.uniform(size=shape) < 0.01
+			features[0, 0, 0] = True
+			np.testing.assert_allclose(DistanceTransforms.distanceTransform(features, spacing, useSciPy=False),
+				DistanceTransforms.distanceTransform(features, spacing, useSciPy=True), atol=1e-9)
+
+	def test_singleFeature(self):
+
+		# Distances to one voxel are the Euclidean distances of the voxel centers (spacing is i, j, k)
+		features = np.zeros((5, 6, 7), dtype=bool)
+		features[2, 3, 4] = True
+		spacing = (0.5, 1.0, 2.0)
+		k, j, i = np.indices(features.shape)
+		expected = np.sqrt(((i - 4) * spacing[0]) ** 2 + ((j - 3) * spacing[1]) ** 2 + ((k - 2) * spacing[2]) ** 2)
+		np.testing.assert_allclose(DistanceTransforms.distanceTransform(features, spacing, useSciPy=False), expected)
+
+	def test_boundaryVoxels(self):
+
+		mask = np.zeros((5, 5, 5), dtype=bool)
+		mask[1:4, 1:4, 1:4] = True
+		boundary = DistanceTransforms.boundaryVoxels(mask)
+		self.assertEqual(int(boundary.sum()), 26)
+		self.assertFalse(boundary[2, 2, 2])
+
+	def test_hausdorffOfOffsetSpheres(self):
+
+		# Concentric spheres 2 mm apart, within a voxel of the spacing
+		sphere1 = SyntheticMeshes.sphere(20.0, (0.0, 0.0, 0.0), 20000)
+		sphere2 = SyntheticMeshes.sphere(18.0, (0.0, 0.0, 0.0), 20000)
+		result = DistanceTransforms.distanceTransformHausdorff(sphere1, sphere2, (0.5, 0.5, 0.5))
+		self.assertAlmostEqual(result['hausdorffMaxMm'], 2.0, delta=0.5)
+
+if __name__ == '__main__':
+	unittest.main()
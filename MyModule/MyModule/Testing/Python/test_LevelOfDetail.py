@@ -0,0 +1,41 @@
+#
+# MyModuleLib/LevelOfDetail.py: triangle budget of the decimated display meshes, and the warning when
+# the budget cannot be reached within the allowed attempts
+#
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from MyModuleLib import LevelOfDetail
+from MyModuleLib import SyntheticMeshes
+
+class LevelOfDetailTest(unittest.TestCase):
+
+	def setUp(self):
+
+		self.surface = SyntheticMeshes.sphere(20.0, (0.0, 0.0, 0.0), 20000)
+
+	def test_surfaceWithinBudgetIsKept(self):
+
+		self.assertIs(LevelOfDetail.decimateToBudget(self.surface, 50000), self.surface)
+
+	def test_decimatedSurfaceMeetsBudget(self):
+
+		for triangleBudget in [500, 2000, 8000]:
+			decimated = LevelOfDetail.decimateToBudget(self.surface, triangleBudget)
+			self.assertLessEqual(decimated.GetNumberOfPolys(), triangleBudget)
+			# Not much coarser than needed
+			self.assertGreater(decimated.GetNumberOfPolys(), triangleBudget // 4)
+
+	def test_budgetNotReachedLogsWarning(self):
+
+		# One attempt is not enough for this budget: the mesh is returned with a warning
+		with self.assertLogs(level='WARNING') as logs:
+			decimated = LevelOfDetail.decimateToBudget(self.surface, 2000, maximumAttempts=1)
+		self.assertGreater(decimated.GetNumberOfPolys(), 2000)
+		self.assertIn('above the budget of 2000 triangles', logs.output[0])
+
+if __name__ == '__main__':
+	unittest.main()
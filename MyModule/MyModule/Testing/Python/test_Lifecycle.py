@@ -0,0 +1,109 @@
+#
+# Repeated comparisons of the same cases do not accumulate memory or objects (MyModuleLib only, without
+# Slicer: the scene node counts are checked inside Slicer by the lifecycle command of MyModuleBenchmark.py)
+#
+
+import gc
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import warnings
+
+import numpy as np
+from vtkmodules.vtkIOGeometry import vtkSTLWriter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from MyModuleLib import Core
+from MyModuleLib import ReviewQueue
+from MyModuleLib import SyntheticMeshes
+from MyModuleLib.MeshCache import MeshCache
+from MyModuleLib.ResourceUsage import currentRSS
+
+NUMBER_OF_RUNS = 45
+WARMUP_RUNS = 5
+WINDOW = 10
+
+# Growth between the first and the last runs still considered flat. Keeping one comparison result per
+# run adds about 20 MB and 230 objects over the runs, flat runs less than 0.2 MB and 10 objects.
+TOLERANCE_MB = 5.0
+TOLERANCE_OBJECTS = 100
+
+class LifecycleTest(unittest.TestCase):
+
+	def setUp(self):
+
+		# Warnings recorded by the test runner (VTK deprecations) would count as growing objects
+		self.warnings = warnings.catch_warnings()
+		self.warnings.__enter__()
+		warnings.simplefilter('ignore', DeprecationWarning)
+		self.directory = tempfile.mkdtemp(prefix='MyModuleTest')
+		self.cases = []
+		for index, (radius, offset) in enumerate([(20.0, 1.0), (15.0, 2.0), (25.0, 0.5)]):
+			paths = [os.path.join(self.directory, 'case%d_%d.stl' % (index, segment)) for segment in [1, 2]]
+			self.writeSTL(SyntheticMeshes.sphere(radius, (0.0, 0.0, 0.0), 5000), paths[0])
+			self.writeSTL(SyntheticMeshes.sphere(radius - 1.0, (offset, 0.0, 0.0), 5000), paths[1])
+			self.cases.append({'case': 'case%d' % index, 'segment1': paths[0], 'segment2': paths[1]})
+
+	def tearDown(self):
+
+		shutil.rmtree(self.directory, ignore_errors=True)
+		self.warnings.__exit__(None, None, None)
+
+	def writeSTL(self, polyData, path):
+
+		writer = vtkSTLWriter()
+		writer.SetInputData(polyData)
+		writer.SetFileName(path)
+		writer.SetFileTypeToBinary()
+		writer.Write()
+
+	def assertFlat(self, samples, tolerance, name):
+
+		# Median of the last runs against the median of the first runs after the warm-up
+		first = np.median(samples[WARMUP_RUNS:WARMUP_RUNS + WINDOW])
+		last = np.median(samples[-WINDOW:])
+		self.assertLessEqual(last - first, tolerance, '%s grew from %g to %g over %d runs' % (name, first, last, len(samples)))
+
+	def test_repeatedComparisons(self):
+
+		# Cases compared in turn with a bounded mesh cache, as a batch or a reviewer going back and forth
+		cache = MeshCache(memoryLimitBytes=64 * 1024**2)
+		rssMB = []
+		objects = []
+		for run in range(NUMBER_OF_RUNS):
+			case = self.cases[run % len(self.cases)]
+			row = Core.compareFiles(case['segment1'], case['segment2'], alignmentMode='none', voxelSizeMm=1.0, cache=cache)
+			self.assertGreater(row['dice'], 0.5)
+			del row
+			gc.collect()
+			rssMB.append(currentRSS() / 1e6)
+			objects.append(len(gc.get_objects()))
+		self.assertFlat(rssMB, TOLERANCE_MB, 'Resident memory (MB)')
+		self.assertFlat(objects, TOLERANCE_OBJECTS, 'Number of Python objects')
+		self.assertLessEqual(cache.statistics()['memoryBytes'], 64 * 1024**2)
+
+	def test_repeatedReview(self):
+
+		# A review going through the cases again and again keeps at most the current and next cases
+		queue = ReviewQueue.ReviewQueue(self.cases * (NUMBER_OF_RUNS // len(self.cases)),
+			lambda case, progressCallback: ReviewQueue.prepareCase(case, progressCallback, alignmentMode='none', voxelSizeMm=1.0))
+		rssMB = []
+		objects = []
+		queue.moveTo(0)
+		for run in range(len(queue)):
+			while not queue.poll():
+				queue.task.finished.wait(0.01)
+			self.assertIsNone(queue.currentCase()['error'])
+			self.assertLessEqual(len(queue.statistics()['prepared']), 2)
+			queue.next()
+			gc.collect()
+			rssMB.append(currentRSS() / 1e6)
+			objects.append(len(gc.get_objects()))
+		queue.close()
+		self.assertFlat(rssMB, TOLERANCE_MB, 'Resident memory (MB)')
+		self.assertFlat(objects, TOLERANCE_OBJECTS, 'Number of Python objects')
+
+if __name__ == '__main__':
+	unittest.main()
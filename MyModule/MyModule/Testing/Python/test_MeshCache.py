@@ -0,0 +1,90 @@
+#
+# MyModuleLib/MeshCache.py: hits, misses and evictions of the memory and disk levels
+#
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from MyModuleLib import DistanceEngines
+from MyModuleLib import STLFiles
+from MyModuleLib import SyntheticMeshes
+from MyModuleLib.MeshCache import MeshCache, polyDataHash
+
+class MeshCacheTest(unittest.TestCase):
+
+	def setUp(self):
+
+		self.directory = tempfile.mkdtemp(prefix='MyModuleTest')
+
+	def tearDown(self):
+
+		shutil.rmtree(self.directory, ignore_errors=True)
+
+	def test_memoryHitsAndMisses(self):
+
+		cache = MeshCache()
+		surface = SyntheticMeshes.sphere(10.0, (0.0, 0.0, 0.0), 2000)
+		key = cache.polyDataKey(surface, 'closedSurface')
+		self.assertIsNone(cache.getPolyData(key))
+		cache.putPolyData(key, surface)
+		cached = cache.getPolyData(key)
+		np.testing.assert_array_equal(DistanceEngines.polyDataPoints(cached), DistanceEngines.polyDataPoints(surface))
+		# The cached surface is a copy: changing the returned one does not change the cache
+		DistanceEngines.polyDataPoints(cached)[:] = 0.0
+		self.assertTrue(DistanceEngines.polyDataPoints(cache.getPolyData(key)).any())
+		statistics = cache.statistics()
+		self.assertEqual((statistics['memoryHits'], statistics['diskHits'], statistics['misses']), (2, 0, 1))
+
+	def test_keysDependOnContentAndParameters(self):
+
+		cache = MeshCache()
+		surface = SyntheticMeshes.sphere(10.0, (0.0, 0.0, 0.0), 2000)
+		moved = SyntheticMeshes.sphere(10.0, (1.0, 0.0, 0.0), 2000)
+		self.assertEqual(cache.polyDataKey(surface, 'labelmap', {'voxel': 1}), cache.polyDataKey(surface, 'labelmap', {'voxel': 1}))
+		self.assertNotEqual(cache.polyDataKey(surface, 'labelmap', {'voxel': 1}), cache.polyDataKey(surface, 'labelmap', {'voxel': 2}))
+		self.assertNotEqual(cache.polyDataKey(surface, 'labelmap'), cache.polyDataKey(moved, 'labelmap'))
+
+	def test_polyDataHashFollowsTopology(self):
+
+		surface = SyntheticMeshes.sphere(10.0, (0.0, 0.0, 0.0), 2000)
+		points = DistanceEngines.polyDataPoints(surface)
+		triangles = DistanceEngines.polyDataTriangles(surface)
+		# Same surface with 32-bit cell arrays: same hash
+		self.assertEqual(polyDataHash(STLFiles.polyDataFromMesh(points, triangles)), polyDataHash(surface))
+		# Same points, reversed triangles: different hash
+		self.assertNotEqual(polyDataHash(DistanceEngines.polyDataFromArrays(points, triangles[:, ::-1])), polyDataHash(surface))
+
+	def test_evictionsAndDiskHits(self):
+
+		# Room for two arrays of 1 MB in memory; evicted entries are read back from disk
+		cache = MeshCache(self.directory, memoryLimitBytes=2 * 1024**2 + 1)
+		arrays = {'key%d' % index: {'values': np.full(1024**2 // 8, float(index))} for index in range(3)}
+		for key, value in arrays.items():
+			cache.putArrays(key, value)
+		statistics = cache.statistics()
+		self.assertEqual(statistics['evictions'], 1)
+		self.assertEqual(statistics['memoryEntries'], 2)
+		np.testing.assert_array_equal(cache.getArrays('key0')['values'], arrays['key0']['values'])
+		statistics = cache.statistics()
+		self.assertEqual((statistics['memoryHits'], statistics['diskHits'], statistics['misses']), (0, 1, 0))
+		self.assertEqual(statistics['evictions'], 2)
+
+	def test_fileKeyFollowsFileContent(self):
+
+		cache = MeshCache()
+		path = os.path.join(self.directory, 'segment.stl')
+		with open(path, 'wb') as segmentFile:
+			segmentFile.write(b'first')
+		firstKey = cache.fileKey(path, 'closedSurface')
+		with open(path, 'wb') as segmentFile:
+			segmentFile.write(b'second content')
+		self.assertNotEqual(cache.fileKey(path, 'closedSurface'), firstKey)
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,97 @@
+#
+# MyModuleLib/PackedMasks.py: packing and Dice of bit-packed masks, and Dice of spheres against the analytic value
+#
+
+import os
+import sys
+import time
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from MyModuleLib import Labelmaps
+from MyModuleLib import PackedMasks
+from MyModuleLib import SyntheticMeshes
+
+class PackedMasksTest(unittest.TestCase):
+
+	def setUp(self):
+
+		self.radius1, self.radius2, self.centerDistance = 20.0, 18.0, 3.0
+		self.polyData1 = SyntheticMeshes.sphere(self.radius1, (0.0, 0.0, 0.0), 20000)
+		self.polyData2 = SyntheticMeshes.sphere(self.radius2, (self.centerDistance, 0.0, 0.0), 20000)
+		volume1 = 4.0 / 3.0 * np.pi * self.radius1**3
+		volume2 = 4.0 / 3.0 * np.pi * self.radius2**3
+		self.dice = 2.0 * SyntheticMeshes.sphereIntersectionVolume(self.radius1, self.radius2, self.centerDistance) / (volume1 + volume2)
+
+	def test_packedMasksMatchByteMasks(self):
+
+		# Random voxels in a grid whose rows are not a multiple of 64 bits, packed into a larger extent
+		grid = Labelmaps.VoxelGrid((0.0, 0.0, 0.0), (1.0, 1.0, 1.0))
+		randomState = np.random.RandomState(0)
+		mask1 = Labelmaps.BinaryMask(grid, [2, 14, 1, 5, 0, 6], randomState.rand(7, 5, 13) > 0.5)
+		mask2 = Labelmaps.BinaryMask(grid, [0, 10, 0, 7, 3, 8], randomState.rand(6, 8, 11) > 0.5)
+		extent = PackedMasks.unionExtent(mask1.extent, mask2.extent)
+		packed1, packed2 = PackedMasks.packMask(mask1, extent), PackedMasks.packMask(mask2, extent)
+		self.assertEqual(packed1.count, mask1.count)
+		np.testing.assert_array_equal(PackedMasks.packMask(mask1).toArray(), mask1.array)
+		self.assertEqual(PackedMasks.intersectionCount(packed1, packed2), Labelmaps.intersectionCount(mask1, mask2))
+		self.assertAlmostEqual(PackedMasks.diceCoefficient(packed1, packed2), Labelmaps.diceCoefficient(mask1, mask2))
+
+	def test_slabsMatchByteMask(self):
+
+		# Many small slabs, each rasterized from the triangles of its z range, give the byte labelmap
+		grid = Labelmaps.gridForSurfaces([self.polyData1], 0.5)
+		extent = grid.extentFromBounds(self.polyData1.GetBounds())
+		slabBytes = PackedMasks.SLAB_BYTES
+		PackedMasks.SLAB_BYTES = 64 * 1024
+		try:
+			self.assertGreater(extent[5] - extent[4] + 1, PackedMasks.slicesPerSlab(extent) * 4)
+			packed = PackedMasks.rasterizePacked(self.polyData1, grid, extent)
+		finally:
+			PackedMasks.SLAB_BYTES = slabBytes
+		np.testing.assert_array_equal(packed.bits, PackedMasks.packMask(Labelmaps.rasterizeSurface(self.polyData1, grid), extent).bits)
+
+	def test_diceOfSpheres(self):
+
+		result = PackedMasks.computeDice(self.polyData1, self.polyData2, voxelSizeMm=0.5)
+		self.assertAlmostEqual(result['dice'], self.dice, delta=0.005)
+		self.assertAlmostEqual(result['referenceVolumeCc'], 4.0 / 3.0 * np.pi * self.radius1**3 / 1000.0, delta=0.5)
+		self.assertLess(result['estimatedDiceError'], 0.01)
+
+	def test_automaticVoxelSize(self):
+
+		result = PackedMasks.computeDice(self.polyData1, self.polyData2, targetDiceError=0.002)
+		self.assertAlmostEqual(result['dice'], self.dice, delta=0.005)
+		self.assertLessEqual(result['estimatedDiceError'], 0.002)
+		self.assertFalse(result['memoryLimited'])
+
+	def test_memoryBudgetLimitsVoxelSize(self):
+
+		budget = PackedMasks.RASTERIZATION_BYTES + 64 * 1024
+		result = PackedMasks.computeDice(self.polyData1, self.polyData2, memoryBudgetBytes=budget, targetDiceError=1e-9)
+		self.assertTrue(result['memoryLimited'])
+		self.assertLessEqual(PackedMasks.pairBytes(self.polyData1, self.polyData2, result['voxelSizeMm']), budget)
+	def test_budgetBelowRasterizationMemory(self):
+
+		# No voxel size fits: an error instead of growing voxels forever
+		startTime = time.time()
+		for budget in [PackedMasks.RASTERIZATION_BYTES // 2, PackedMasks.RASTERIZATION_BYTES]:
+			with self.assertRaises(ValueError):
+				PackedMasks.computeDice(self.polyData1, self.polyData2, memoryBudgetBytes=budget)
+		self.assertLess(time.time() - startTime, 10.0)
+		# A fixed voxel size does not use the budget
+		self.assertGreater(PackedMasks.computeDice(self.polyData1, self.polyData2, voxelSizeMm=1.0,
+			memoryBudgetBytes=PackedMasks.RASTERIZATION_BYTES)['dice'], 0.0)
+
+	def test_budgetTooSmallForLargeSegments(self):
+
+		# Masks of 2 mm voxels that do not fit in a budget of 64 kB above the rasterization memory
+		large1 = SyntheticMeshes.sphere(1000.0, (0.0, 0.0, 0.0), 2000)
+		large2 = SyntheticMeshes.sphere(990.0, (0.0, 0.0, 0.0), 2000)
+		with self.assertRaises(ValueError):
+			PackedMasks.computeDice(large1, large2, memoryBudgetBytes=PackedMasks.RASTERIZATION_BYTES + 64 * 1024)
+
+if __name__ == '__main__':
+	unittest.main()
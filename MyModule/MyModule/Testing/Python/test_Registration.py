@@ -0,0 +1,65 @@
+#
+# MyModuleLib/Registration.py: rigid registration of a surface moved by a known transform
+#
+
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from MyModuleLib import DistanceEngines
+from MyModuleLib import Registration
+from MyModuleLib import SyntheticMeshes
+
+def rotationMatrix(axis, degrees):
+
+	# Rodrigues rotation around a unit axis
+	axis = np.asarray(axis, dtype=np.float64) / np.linalg.norm(axis)
+	angle = np.radians(degrees)
+	cross = np.array([[0.0, -axis[2], axis[1]], [axis[2], 0.0, -axis[0]], [-axis[1], axis[0], 0.0]])
+	return np.eye(3) + np.sin(angle) * cross + (1.0 - np.cos(angle)) * cross.dot(cross)
+
+class RegistrationTest(unittest.TestCase):
+
+	def setUp(self):
+
+		self.fixedPoints = DistanceEngines.polyDataPoints(SyntheticMeshes.ellipsoid((40.0, 25.0, 15.0), (5.0, -3.0, 2.0), 20000)).astype(np.float64)
+		self.matrix = Registration.matrixFromRotationTranslation(rotationMatrix((1.0, 2.0, 0.5), 30.0), (12.0, -7.0, 4.0))
+		self.movingPoints = Registration.transformPoints(np.linalg.inv(self.matrix), self.fixedPoints)
+
+	def test_bestRigidTransformOfCorrespondingPoints(self):
+
+		np.testing.assert_allclose(Registration.bestRigidTransform(self.movingPoints, self.fixedPoints), self.matrix, atol=1e-8)
+
+	def test_registrationAlignsSurfaces(self):
+
+		# The ellipsoid is symmetric: any of its symmetric poses is a correct registration, so the aligned
+		# points are compared to the fixed surface instead of the matrix to the known one
+		result = Registration.rigidRegistration(self.movingPoints, self.fixedPoints, seed=1)
+		self.assertLess(result['rmsResidual'], 0.5)
+		distances = Registration.NearestNeighbourSearch(self.fixedPoints).query(
+			Registration.transformPoints(result['matrix'], self.movingPoints))[0]
+		self.assertLess(distances.max(), 1.0)
+		rotation = result['matrix'][:3, :3]
+		np.testing.assert_allclose(rotation.T.dot(rotation), np.eye(3), atol=1e-8)
+
+	def test_resultsDependOnlyOnSeed(self):
+
+		first = Registration.rigidRegistration(self.movingPoints, self.fixedPoints, levels=(500, 1000), seed=3)
+		second = Registration.rigidRegistration(self.movingPoints, self.fixedPoints, levels=(500, 1000), seed=3)
+		np.testing.assert_array_equal(first['matrix'], second['matrix'])
+		self.assertEqual(first['iterations'], second['iterations'])
+
+	def test_bruteForceSearchMatchesKDTree(self):
+
+		search = Registration.NearestNeighbourSearch(self.fixedPoints[:3000], blockSize=256)
+		queryPoints = self.movingPoints[::10]
+		distances = search.query(queryPoints)[0]
+		search.tree = None
+		bruteDistances = search.query(queryPoints)[0]
+		np.testing.assert_allclose(bruteDistances, distances, atol=1e-6)
+
+if __name__ == '__main__':
+	unittest.main()
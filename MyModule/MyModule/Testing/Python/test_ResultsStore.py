@@ -0,0 +1,64 @@
+#
+# MyModuleLib/ResultsStore.py: insertion, replacement, queries and CSV export of results
+#
+
+import os
+import sys
+import csv
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from MyModuleLib.ResultsStore import ResultsStore
+
+class ResultsStoreTest(unittest.TestCase):
+
+	def setUp(self):
+
+		self.directory = tempfile.mkdtemp(prefix='MyModuleTest')
+		self.store = ResultsStore(os.path.join(self.directory, 'results.sqlite'))
+		self.store.addMetrics('case1', 'liver/ref', 'liver/auto', {'dice': 0.95, 'hausdorff95Mm': 1.5, 'name': 'ignored', 'valid': True},
+			engine='kdtree', software='SoftwareX')
+		self.store.addMetrics('case2', 'liver/ref', 'liver/auto', {'dice': 0.85, 'hausdorff95Mm': 4.0}, engine='kdtree', software='SoftwareY')
+
+	def tearDown(self):
+
+		self.store.close()
+		shutil.rmtree(self.directory, ignore_errors=True)
+
+	def test_onlyNumericMetricsAreStored(self):
+
+		self.assertEqual(self.store.numberOfResults(), 4)
+		self.assertEqual(self.store.cases(), ['case1', 'case2'])
+
+	def test_queries(self):
+
+		self.assertEqual([row['caseId'] for row in self.store.query(metric='dice', maxValue=0.9)], ['case2'])
+		self.assertEqual([row['caseId'] for row in self.store.query(metric='hausdorff95Mm', minValue=1.0)], ['case1', 'case2'])
+		self.assertEqual([row['value'] for row in self.store.query(caseId='case1', orderBy='metric')], [0.95, 1.5])
+		self.assertEqual(self.store.query(software='SoftwareZ'), [])
+		self.assertEqual([value for createdAt, caseId, value in self.store.trend('dice', software='SoftwareX')], [0.95])
+		with self.assertRaises(ValueError):
+			self.store.query(orderBy='unknown')
+
+	def test_sameKeyReplacesResult(self):
+
+		self.store.addMetrics('case1', 'liver/ref', 'liver/auto', {'dice': 0.97}, engine='kdtree')
+		self.assertEqual(self.store.numberOfResults(), 4)
+		self.assertEqual([row['value'] for row in self.store.query(metric='dice', caseId='case1')], [0.97])
+		# Other parameters (in any key order) are another result
+		self.store.addMetrics('case1', 'liver/ref', 'liver/auto', {'dice': 0.96}, engine='kdtree', parameters={'voxel': 0.5, 'seed': 0})
+		self.store.addMetrics('case1', 'liver/ref', 'liver/auto', {'dice': 0.96}, engine='kdtree', parameters={'seed': 0, 'voxel': 0.5})
+		self.assertEqual(self.store.numberOfResults(), 5)
+
+	def test_exportCSV(self):
+
+		path = os.path.join(self.directory, 'results.csv')
+		self.store.exportCSV(path, metric='dice')
+		with open(path, newline='') as csvFile:
+			rows = list(csv.DictReader(csvFile))
+		self.assertEqual([(row['caseId'], float(row['value'])) for row in rows], [('case1', 0.95), ('case2', 0.85)])
+
+if __name__ == '__main__':
+	unittest.main()
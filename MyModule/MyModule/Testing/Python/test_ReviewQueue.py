@@ -0,0 +1,108 @@
+#
+# MyModuleLib/ReviewQueue.py: prefetch of the next case, errors of a case and bounded prepared cases
+#
+
+import os
+import sys
+import time
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from MyModuleLib import ReviewQueue
+from MyModuleLib import SyntheticMeshes
+
+TIMEOUT_SECONDS = 30.0
+
+def waitForCurrentCase(queue):
+
+	# Polls the queue as the review timer of the module does
+	startTime = time.time()
+	while not queue.poll():
+		if time.time() - startTime > TIMEOUT_SECONDS:
+			raise AssertionError('Case %d was not prepared' % queue.index)
+		time.sleep(0.005)
+	return queue.currentCase()
+
+def waitForPrefetch(queue):
+
+	startTime = time.time()
+	while queue.task is not None:
+		if time.time() - startTime > TIMEOUT_SECONDS:
+			raise AssertionError('Case %d was not prefetched' % queue.taskIndex)
+		queue.poll()
+		time.sleep(0.005)
+
+class ReviewQueueTest(unittest.TestCase):
+
+	def setUp(self):
+
+		self.cases = [{'case': 'case%d' % index, 'segment1': 'a%d' % index, 'segment2': 'b%d' % index} for index in range(5)]
+		self.preparedCases = []
+		self.lock = threading.Lock()
+
+	def prepare(self, case, progressCallback):
+
+		with self.lock:
+			self.preparedCases.append(case['case'])
+		progressCallback(0.5, 'Preparing ' + case['case'])
+		if case['case'] == 'case2':
+			raise ValueError('Cannot read ' + case['segment1'])
+		return {'case': case, 'error': None}
+
+	def test_nextCaseIsPrefetched(self):
+
+		queue = ReviewQueue.ReviewQueue(self.cases, self.prepare)
+		queue.moveTo(0)
+		self.assertEqual(waitForCurrentCase(queue)['case']['case'], 'case0')
+		waitForPrefetch(queue)
+		self.assertEqual(queue.statistics()['prepared'], [0, 1])
+		self.assertIsNotNone(queue.next())
+		self.assertEqual(queue.statistics()['hits'], 1)
+		self.assertEqual(queue.statistics()['misses'], 1)
+		queue.close()
+
+	def test_errorsAreKeptInTheCase(self):
+
+		queue = ReviewQueue.ReviewQueue(self.cases, self.prepare)
+		queue.moveTo(2)
+		prepared = waitForCurrentCase(queue)
+		self.assertIsInstance(prepared['error'], ValueError)
+		self.assertIn('Cannot read a2', prepared['traceback'])
+		# The review goes on with the next case
+		waitForPrefetch(queue)
+		self.assertIsNone(queue.next()['error'])
+		queue.close()
+
+	def test_preparedCasesAreBounded(self):
+
+		queue = ReviewQueue.ReviewQueue(self.cases, self.prepare)
+		queue.moveTo(0)
+		for index in range(len(self.cases)):
+			waitForCurrentCase(queue)
+			waitForPrefetch(queue)
+			self.assertLessEqual(len(queue.statistics()['prepared']), 2)
+			queue.next()
+		self.assertFalse(queue.hasNext())
+		self.assertEqual(queue.statistics()['prepared'], [4])
+		# Going back prepares the dropped case again
+		queue.previous()
+		self.assertEqual(waitForCurrentCase(queue)['case']['case'], 'case3')
+		self.assertEqual(self.preparedCases.count('case3'), 2)
+		with self.assertRaises(IndexError):
+			queue.moveTo(len(self.cases))
+		queue.close()
+
+	def test_prepareCase(self):
+
+		# Metrics and both distance maps of a case of synthetic spheres
+		surfaces = {'a': SyntheticMeshes.sphere(20.0, (0.0, 0.0, 0.0), 5000), 'b': SyntheticMeshes.sphere(18.0, (0.0, 0.0, 0.0), 5000)}
+		prepared = ReviewQueue.prepareCase({'case': 'spheres', 'segment1': 'a', 'segment2': 'b'}, alignmentMode='none',
+			readSurface=lambda path: surfaces[path])
+		self.assertIsNone(prepared['error'])
+		self.assertAlmostEqual(prepared['metrics']['hausdorffMaxMm'], 2.0, delta=0.2)
+		self.assertEqual(prepared['distancePolyData'].GetNumberOfPoints(), surfaces['a'].GetNumberOfPoints())
+		self.assertEqual(prepared['reverseDistancePolyData'].GetNumberOfPoints(), surfaces['b'].GetNumberOfPoints())
+
+if __name__ == '__main__':
+	unittest.main()
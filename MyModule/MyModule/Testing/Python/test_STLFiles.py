@@ -0,0 +1,125 @@
+#
+# MyModuleLib/STLFiles.py: binary and ASCII files read as by vtkSTLReader
+#
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+from vtkmodules.vtkIOGeometry import vtkSTLReader, vtkSTLWriter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from MyModuleLib import DistanceEngines
+from MyModuleLib import STLFiles
+from MyModuleLib import SyntheticMeshes
+
+def triangleCoordinates(polyData):
+
+	# One row of 9 coordinates per triangle, rows sorted, so that surfaces can be compared whatever
+	# the order of their points
+	points = DistanceEngines.polyDataPoints(polyData).astype(np.float64)
+	coordinates = points[DistanceEngines.polyDataTriangles(polyData)].reshape(-1, 9)
+	return coordinates[np.lexsort(coordinates.T[::-1])]
+
+class STLFilesTest(unittest.TestCase):
+
+	def setUp(self):
+
+		self.directory = tempfile.mkdtemp(prefix='MyModuleTest')
+		self.surface = SyntheticMeshes.sphere(30.0, (1.5, -2.0, 4.0), 5000)
+
+	def tearDown(self):
+
+		shutil.rmtree(self.directory, ignore_errors=True)
+
+	def writeSTL(self, fileName, binary):
+
+		path = os.path.join(self.directory, fileName)
+		writer = vtkSTLWriter()
+		writer.SetInputData(self.surface)
+		writer.SetFileName(path)
+		if binary:
+			writer.SetFileTypeToBinary()
+		else:
+			writer.SetFileTypeToASCII()
+		writer.Write()
+		return path
+
+	def readWithVTK(self, path):
+
+		reader = vtkSTLReader()
+		reader.SetFileName(path)
+		reader.Update()
+		return reader.GetOutput()
+
+	def test_binaryMatchesVTKReader(self):
+
+		path = self.writeSTL('binary.stl', True)
+		self.assertTrue(STLFiles.isBinarySTL(path))
+		polyData = STLFiles.readSTLPolyData(path)
+		expected = self.readWithVTK(path)
+		self.assertEqual(polyData.GetNumberOfPoints(), expected.GetNumberOfPoints())
+		np.testing.assert_array_equal(triangleCoordinates(polyData), triangleCoordinates(expected))
+
+	def test_asciiMatchesVTKReader(self):
+
+		path = self.writeSTL('ascii.stl', False)
+		self.assertFalse(STLFiles.isBinarySTL(path))
+		polyData = STLFiles.readSTLPolyData(path)
+		expected = self.readWithVTK(path)
+		self.assertEqual(polyData.GetNumberOfPoints(), expected.GetNumberOfPoints())
+		np.testing.assert_allclose(triangleCoordinates(polyData), triangleCoordinates(expected), rtol=1e-6)
+
+	def test_smallChunksGiveTheSameMesh(self):
+
+		path = self.writeSTL('binary.stl', True)
+		points, faces = STLFiles.readSTL(path)
+		chunkedPoints, chunkedFaces = STLFiles.mergeVertices(STLFiles.triangleChunks(path, 1000))
+		np.testing.assert_array_equal(points[faces], chunkedPoints[chunkedFaces])
+
+	@unittest.skipUnless(os.path.exists('/proc/self/maps'), 'needs /proc/self/maps')
+	def test_filesAreUnmapped(self):
+
+		# The memory map is closed when reading ends, also when the caller stops early
+		def isMapped(path):
+			with open('/proc/self/maps') as maps:
+				return os.path.realpath(path) in maps.read()
+		for binary in [True, False]:
+			path = self.writeSTL('mapped.stl', binary)
+			chunks = STLFiles.triangleChunks(path, 100)
+			next(chunks)
+			self.assertTrue(isMapped(path))
+			chunks.close()
+			self.assertFalse(isMapped(path))
+			list(STLFiles.triangleChunks(path, 100))
+			self.assertFalse(isMapped(path))
+
+	def test_invalidASCIIFile(self):
+
+		path = self.writeSTL('ascii.stl', False)
+		with open(path, 'rb') as stlFile:
+			content = stlFile.read()
+		vertexStart = content.index(b'vertex')
+		vertexLine = content[vertexStart:content.index(b'\n', vertexStart) + 1]
+		for name, invalidContent in [('number.stl', content.replace(b'vertex ', b'vertex x', 1)),
+			('incomplete.stl', content.replace(vertexLine, b'', 1))]:
+			invalidPath = os.path.join(self.directory, name)
+			with open(invalidPath, 'wb') as stlFile:
+				stlFile.write(invalidContent)
+			with self.assertRaises(STLFiles.STLFormatError):
+				STLFiles.readSTL(invalidPath)
+
+	def test_lpsFilesAreConvertedToRAS(self):
+
+		# Files without a SPACE= header are LPS (as written by Slicer by default)
+		path = self.writeSTL('binary.stl', True)
+		lps = DistanceEngines.polyDataPoints(STLFiles.readSTLPolyData(path))
+		ras = DistanceEngines.polyDataPoints(STLFiles.readSTLPolyData(path, 'RAS'))
+		np.testing.assert_array_equal(ras[:, :2], -lps[:, :2])
+		np.testing.assert_array_equal(ras[:, 2], lps[:, 2])
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,61 @@
+#
+# MyModuleLib/SurfaceHausdorff.py: exact and sampled Hausdorff distances against a brute-force
+# evaluation of every vertex against every triangle
+#
+
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from MyModuleLib import DistanceEngines
+from MyModuleLib import SurfaceHausdorff
+from MyModuleLib import SyntheticMeshes
+
+def bruteForceDistances(sourcePolyData, targetPolyData):
+
+	points = DistanceEngines.polyDataPoints(sourcePolyData).astype(np.float64)
+	targetPoints = DistanceEngines.polyDataPoints(targetPolyData).astype(np.float64)
+	triangles = DistanceEngines.polyDataTriangles(targetPolyData)
+	a, b, c = [targetPoints[triangles[:, corner]][None, :, :] for corner in range(3)]
+	return np.sqrt(DistanceEngines.squaredDistancesToTriangles(points[:, None, :], a, b, c).min(axis=1))
+
+class SurfaceHausdorffTest(unittest.TestCase):
+
+	def setUp(self):
+
+		bumps = SyntheticMeshes.bumpsDisplacement(2.0)
+		self.surface1 = SyntheticMeshes.radialSurface(lambda directions: 50.0 + bumps(directions), 2000)
+		self.surface2 = SyntheticMeshes.sphere(48.0, (1.0, 0.0, 0.0), 1500)
+		self.distances12 = bruteForceDistances(self.surface1, self.surface2)
+		self.distances21 = bruteForceDistances(self.surface2, self.surface1)
+
+	def test_exactHausdorffMatchesBruteForce(self):
+
+		for engineName in ['locator', 'auto']:
+			result = SurfaceHausdorff.exactHausdorff(self.surface1, self.surface2, engineName)
+			self.assertAlmostEqual(result['hausdorffDirected12Mm'], self.distances12.max(), places=4)
+			self.assertAlmostEqual(result['hausdorffDirected21Mm'], self.distances21.max(), places=4)
+			self.assertAlmostEqual(result['hausdorffMaxMm'], max(self.distances12.max(), self.distances21.max()), places=4)
+
+	def test_sampledHausdorffWithAllVerticesIsExact(self):
+
+		distances = np.concatenate([self.distances12, self.distances21])
+		result = SurfaceHausdorff.sampledHausdorff(self.surface1, self.surface2, numberOfSamples=len(distances))
+		self.assertAlmostEqual(result['hausdorff95Mm'], float(np.percentile(distances, 95)), places=4)
+		self.assertAlmostEqual(result['hausdorffMeanMm'], float(distances.mean()), places=4)
+		self.assertEqual(result['hausdorff95LowerMm'], result['hausdorff95UpperMm'])
+
+	def test_sampledBoundsContainTheExactPercentile(self):
+
+		distances = np.concatenate([self.distances12, self.distances21])
+		result = SurfaceHausdorff.sampledHausdorff(self.surface1, self.surface2, numberOfSamples=1000, confidence=0.99)
+		percentile95 = float(np.percentile(distances, 95))
+		self.assertLessEqual(result['hausdorff95LowerMm'], percentile95 + 1e-6)
+		self.assertGreaterEqual(result['hausdorff95UpperMm'], percentile95 - 1e-6)
+		self.assertLessEqual(result['hausdorffMaxLowerBoundMm'], distances.max() + 1e-6)
+
+if __name__ == '__main__':
+	unittest.main()